@@ -18,6 +18,11 @@ import numpy as np
 import unicodedata
 import json
 
+from src.features.pareto_query import ParetoQuery
+from src.ml_models.rule_index import RuleIndex
+from src.utils.load_data import open_csv_tail
+from src.utils.raw_cache import ensure_csv_cache, read_csv_cache
+
 st.set_page_config(
     page_title="NINO - Dashboard Analítico",
     page_icon="📊",
@@ -117,6 +122,28 @@ st.markdown("""
 DATA_DIR = Path("data/app_dataset")
 PROCESSED_DIR = Path("data/processed")
 PREDICTIVE_DIR = Path("data/predictivos")
+CACHE_DIR = Path("data/cache")
+
+
+def _parse_fecha_horario(values):
+    """Parsea los timestamps del CSV horario (formato 'YYYY-mm-dd HH:MM:SS,000')."""
+    return pd.to_datetime(
+        values.str.replace(',000', '', regex=False),
+        format='%Y-%m-%d %H:%M:%S',
+        errors='coerce'
+    )
+
+@st.cache_resource
+def load_rule_index():
+    """Índice de reglas en memoria; reload() lo reconstruye solo si cambió reglas.parquet."""
+    return RuleIndex.from_parquet(DATA_DIR / 'reglas.parquet', by_id=False)
+
+
+@st.cache_resource(max_entries=4)
+def load_pareto_query(valor, mtime):
+    """Arreglos acumulados del Pareto de productos; ``mtime`` renueva la cache si cambia el archivo."""
+    return ParetoQuery.from_parquet(DATA_DIR / 'pareto_prod_global.parquet', value=valor)
+
 
 @st.cache_data
 def load_all_data():
@@ -155,12 +182,30 @@ def load_all_data():
         horario_path = Path('data/raw/comprobantes_ventas_horario.csv')
         if horario_path.exists():
             try:
-                print("Loading horario CSV...")
-                horario_df = pd.read_csv(
+                print("Loading horario CSV (cache Parquet)...")
+                horario_cache = ensure_csv_cache(
                     horario_path,
-                    sep=';',
-                    dtype=str,
-                    engine='python'
+                    CACHE_DIR,
+                    lambda: pd.read_csv(
+                        horario_path,
+                        sep=';',
+                        dtype=str,
+                        engine='python',
+                        chunksize=200_000
+                    ),
+                    date_column='Fecha',
+                    date_parser=_parse_fecha_horario,
+                    signature='horario-v1',
+                    read_appended=lambda offset: pd.read_csv(
+                        open_csv_tail(horario_path, offset),
+                        sep=';',
+                        dtype=str,
+                        engine='python',
+                        chunksize=200_000
+                    )
+                )
+                horario_df = read_csv_cache(
+                    horario_cache, columns=['Fecha', 'Hora', 'Comprobante']
                 )
                 print(f"[OK] Loaded CSV with {len(horario_df)} rows")
 
@@ -173,16 +218,8 @@ def load_all_data():
                     data['horario_semana_matrix'] = pd.DataFrame()
                 else:
                     # Procesar fechas
-                    horario_df['Fecha'] = pd.to_datetime(
-                        horario_df['Fecha'].str.replace(',000', '', regex=False),
-                        format='%Y-%m-%d %H:%M:%S',
-                        errors='coerce'
-                    )
-                    horario_df['Hora'] = pd.to_datetime(
-                        horario_df['Hora'].str.replace(',000', '', regex=False),
-                        format='%Y-%m-%d %H:%M:%S',
-                        errors='coerce'
-                    )
+                    horario_df['Fecha'] = _parse_fecha_horario(horario_df['Fecha'])
+                    horario_df['Hora'] = _parse_fecha_horario(horario_df['Hora'])
 
                     # Verificar si hay fechas válidas
                     valid_dates = horario_df['Fecha'].notna() & horario_df['Hora'].notna()
@@ -610,7 +647,7 @@ with tabs[0]:
             st.markdown("### Comparativo por tipo de día")
             kpi_tipo_plot = (
                 kpi_tipo_mod.copy()
-                .groupby("tipo_dia", as_index=False)
+                .groupby("tipo_dia", as_index=False, observed=True)
                 .agg(
                     ticket_promedio=("ticket_promedio", "mean"),
                     upt=("upt", "mean"),
@@ -932,6 +969,32 @@ with tabs[1]:
 
     st.dataframe(tabla_prod, use_container_width=True, hide_index=True)
 
+    st.markdown("### Umbrales ABC interactivos")
+    if (DATA_DIR / 'pareto_prod_global.parquet').exists():
+        valor_abc = st.radio("Clasificar por", ['margen', 'ventas'], horizontal=True, key='valor_abc')
+        consulta_pareto = load_pareto_query(
+            valor_abc, (DATA_DIR / 'pareto_prod_global.parquet').stat().st_mtime
+        )
+        corte_a, corte_b = st.slider("Cortes A / B (% acumulado)", 50, 99, (80, 95), key='cortes_abc')
+        conteos = consulta_pareto.class_counts((corte_a / 100, corte_b / 100))
+        col1, col2, col3 = st.columns(3)
+        col1.metric("SKU clase A", f"{conteos['A']:,}")
+        col2.metric("SKU clase B", f"{conteos['B']:,}")
+        col3.metric("SKU clase C", f"{conteos['C']:,}")
+        st.caption(
+            f"{consulta_pareto.count_for_share(corte_a / 100):,} de {len(consulta_pareto):,} SKU "
+            f"reúnen el {corte_a}% del {valor_abc}."
+        )
+        categorias_abc = sorted(consulta_pareto.category_bounds, key=str)
+        if categorias_abc:
+            categoria_abc = st.selectbox("Top de una categoría", categorias_abc, key='categoria_abc')
+            top_categoria = consulta_pareto.top_in_category(categoria_abc, 10)
+            st.dataframe(
+                top_categoria[['descripcion', valor_abc, 'participacion_acumulada']],
+                use_container_width=True,
+                hide_index=True,
+            )
+
     cobertura = float(top_prod_80['pct_acumulado_ventas'].max())
     categoria_dominante = top_prod_80['categoria'].value_counts().idxmax()
 
@@ -1002,6 +1065,21 @@ with tabs[2]:
         use_container_width=True
     )
 
+    # Completar canasta (consulta indexada)
+    st.markdown("### Completar Canasta: Sugerencias por Reglas")
+    if (DATA_DIR / 'reglas.parquet').exists():
+        indice_reglas = load_rule_index()
+        indice_reglas.reload()
+        productos_regla = sorted(indice_reglas.items, key=str)
+        canasta = st.multiselect("Productos en la canasta", productos_regla)
+        criterio = st.radio("Ordenar por", ['lift', 'confidence'], horizontal=True)
+        if canasta:
+            sugerencias = indice_reglas.recommend_frame(canasta, top_n=10, metric=criterio)
+            if sugerencias.empty:
+                st.info("Sin reglas que apliquen a esta canasta.")
+            else:
+                st.dataframe(sugerencias, hide_index=True, use_container_width=True)
+
     # Scatter plot
     st.markdown("### Visualización: Confidence vs Support")
 
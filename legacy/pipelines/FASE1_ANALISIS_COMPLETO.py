@@ -47,6 +47,12 @@ from sklearn.preprocessing import StandardScaler
 from mlxtend.frequent_patterns import apriori, association_rules
 from mlxtend.preprocessing import TransactionEncoder
 
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.utils.raw_cache import load_sales_cached  # noqa: E402
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
@@ -424,13 +430,9 @@ print("=" * 100)
 
 print("\n[1.1] Cargando archivo de ventas...")
 print(f"[INFO] Archivo seleccionado: {SALES_FILE}")
-df_raw = pd.read_csv(
-    SALES_FILE,
-    sep=';',
-    decimal=',',  # CRÍTICO: Formato argentino con coma decimal
-    encoding='utf-8',
-    low_memory=False
-)
+# CRÍTICO: Formato argentino con coma decimal (lo resuelve el lector tipado).
+# El CSV se convierte una sola vez a Parquet particionado por año/mes.
+df_raw = load_sales_cached(SALES_FILE, PROJECT_ROOT / "data" / "cache")
 
 print(f"Registros brutos cargados: {len(df_raw):,}")
 print(f"Columnas originales: {list(df_raw.columns)}")
@@ -2,11 +2,24 @@
 
 from __future__ import annotations
 
+import argparse
 import logging
 from pathlib import Path
 
-from src.data_prep.etl_basico import run_etl
-from src.features.clustering_tickets import run_ticket_clustering
+from src.data_prep.calendario import build_calendario_rango, save_calendario
+from src.data_prep.etl_basico import run_etl_chunked
+from src.data_prep.etl_incremental import (
+    EtlWatermark,
+    load_artifacts,
+    load_watermark,
+    run_etl_incremental,
+    save_artifacts,
+    save_watermark,
+)
+from src.data_prep.productos import build_dim_producto, save_dim_producto
+from src.data_prep.schema import load_dictionaries
+from src.features.basket_stats import load_basket_stats, update_basket_stats
+from src.features.clustering_tickets import run_composition_clustering, run_ticket_clustering
 from src.features.kpis_basicos import (
     build_kpi_categoria,
     build_kpi_dia,
@@ -14,15 +27,18 @@ from src.features.kpis_basicos import (
     build_kpi_tipo_dia,
     export_kpis,
 )
-from src.features.market_basket import run_market_basket
+from src.features.market_basket import run_market_basket, run_segmented_market_basket
+from src.features.pair_lift import run_pair_lift
 from src.features.pareto_margen import run_pareto
+from src.features.pareto_rolling import run_pareto_rolling
+from src.features.rule_stability import run_rule_stability
 from src.features.predictivos_ventas_simple import generate_forecasts
 from src.utils.load_data import (
     ensure_directory,
     load_feriados,
     load_rentabilidad_data,
-    load_sales_data,
 )
+from src.utils.raw_cache import iter_sales_cached
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
@@ -34,37 +50,89 @@ DATA_DIR = BASE_DIR / "data"
 RAW_DIR = DATA_DIR / "raw"
 PROCESSED_DIR = DATA_DIR / "processed"
 PREDICTIVE_DIR = DATA_DIR / "predictivos"
+CACHE_DIR = DATA_DIR / "cache"
+BASKET_STATS_DIR = PROCESSED_DIR / "basket_stats"
+PARETO_STORE_DIR = PROCESSED_DIR / "pareto_mensual"
+CLUSTER_MODEL_DIR = PROCESSED_DIR / "modelo_clusters"
 
 SALES_FILE = RAW_DIR / "SERIE_COMPROBANTES_COMPLETOS.csv"
 RENTABILIDAD_FILE = RAW_DIR / "RENTABILIDAD.csv"
 FERIADOS_FILE = RAW_DIR / "FERIADOS_2024_2025.csv"
 
+# Watermark of the data the downstream outputs (rules, Pareto, clusters,
+# forecasts) were last computed from; written once every stage has finished.
+SALIDAS_WATERMARK_FILE = "salidas_watermark.json"
+
+# Longest itemset mined for reglas.parquet; the bootstrap stability of those
+# rules must be measured at the same length.
+MAX_LEN_REGLAS = 3
+
 
-def main() -> None:
+def main(*, incremental: bool = False, bootstrap_reglas: int = 0) -> None:
     LOGGER.info("Iniciando pipeline modular")
 
     ensure_directory(PROCESSED_DIR)
     ensure_directory(PREDICTIVE_DIR)
 
     LOGGER.info("Cargando datasets base")
-    raw_sales = load_sales_data(SALES_FILE)
     rentabilidad = load_rentabilidad_data(RENTABILIDAD_FILE)
     feriados = load_feriados(FERIADOS_FILE)
 
-    LOGGER.info("Ejecutando ETL principal")
-    artifacts = run_etl(raw_sales, rentabilidad, feriados)
-
-    detalle_path = PROCESSED_DIR / "detalle_lineas.parquet"
-    tickets_path = PROCESSED_DIR / "tickets.parquet"
-    ventas_semana_path = PROCESSED_DIR / "ventas_semanales_categoria.parquet"
-    artifacts.detalle.to_parquet(detalle_path, index=False)
-    artifacts.tickets.to_parquet(tickets_path, index=False)
-    artifacts.ventas_semanales_categoria.to_parquet(ventas_semana_path, index=False)
+    watermark = load_watermark(PROCESSED_DIR) if incremental else None
+    previous = load_artifacts(PROCESSED_DIR) if watermark is not None else None
+    if previous is not None:
+        LOGGER.info(
+            "Ejecutando ETL incremental desde %s (ticket %s)",
+            watermark.fecha,
+            watermark.ticket_id,
+        )
+        artifacts = run_etl_incremental(
+            iter_sales_cached(SALES_FILE, CACHE_DIR, since=watermark.fecha),
+            rentabilidad,
+            feriados,
+            previous=previous,
+            watermark=watermark,
+        )
+    else:
+        if incremental:
+            LOGGER.info("Sin marca de agua o artefactos previos: se ejecuta el ETL completo")
+        LOGGER.info("Ejecutando ETL principal (cache Parquet por anio/mes)")
+        artifacts = run_etl_chunked(
+            iter_sales_cached(SALES_FILE, CACHE_DIR),
+            rentabilidad,
+            feriados,
+            dictionaries=load_dictionaries(PROCESSED_DIR),
+        )
+
+    # Lines the downstream stages have not seen yet: newer than the older of
+    # the ETL and outputs watermarks, so days loaded by a run that stopped
+    # before its last stage are picked up again. Without an outputs
+    # watermark every stage recounts the full history.
+    nuevos = None
+    salidas = load_watermark(PROCESSED_DIR, SALIDAS_WATERMARK_FILE)
+    if previous is not None and salidas is not None:
+        referencia = min(watermark, salidas, key=lambda marca: (marca.fecha, marca.ticket_id))
+        nuevos = referencia.newer_mask(artifacts.detalle)
+        if not nuevos.any():
+            LOGGER.info("Sin comprobantes nuevos desde %s: se conservan las salidas", referencia.fecha)
+            return
+        LOGGER.info("Lineas nuevas desde la ultima salida: %s", int(nuevos.sum()))
+
+    save_artifacts(artifacts, PROCESSED_DIR)
+    save_watermark(PROCESSED_DIR, EtlWatermark.from_detalle(artifacts.detalle))
+    save_calendario(
+        build_calendario_rango(
+            artifacts.detalle["fecha"].min(), artifacts.detalle["fecha"].max(), feriados
+        ),
+        PROCESSED_DIR,
+    )
+    productos = build_dim_producto(artifacts.detalle)
+    save_dim_producto(productos, PROCESSED_DIR)
 
     LOGGER.info("Calculando KPIs estandarizados")
     kpi_dia = build_kpi_dia(artifacts.ventas_diarias)
     kpi_tipo_dia = build_kpi_tipo_dia(kpi_dia)
-    kpi_categoria = build_kpi_categoria(artifacts.detalle)
+    kpi_categoria = build_kpi_categoria(artifacts.cubo)
     kpi_medio_pago = build_kpi_medio_pago(artifacts.tickets)
     export_kpis(
         output_dir=PROCESSED_DIR,
@@ -74,20 +142,113 @@ def main() -> None:
         kpi_medio_pago=kpi_medio_pago,
     )
 
-    LOGGER.info("Ejecutando market basket")
-    run_market_basket(artifacts.detalle, PROCESSED_DIR)
+    # On an incremental run the day-partitioned stores (basket counts, monthly
+    # Pareto) and the ticket cluster model are only updated for the touched
+    # days. Pair lift, margin Pareto, segmented rules and composition clusters
+    # are global over the history and are recomputed in full.
+    LOGGER.info("Actualizando conteos de canasta por dia")
+    dias_canasta = None
+    if nuevos is not None:
+        dias_canasta = artifacts.detalle.loc[nuevos, "fecha_key"].unique()
+    update_basket_stats(
+        artifacts.detalle,
+        BASKET_STATS_DIR,
+        dias=dias_canasta,
+        triples=True,
+        rebuild=previous is None,
+    )
+
+    LOGGER.info("Ejecutando market basket (itemsets de hasta %s items)", MAX_LEN_REGLAS)
+    run_market_basket(
+        artifacts.detalle,
+        PROCESSED_DIR,
+        max_len=MAX_LEN_REGLAS,
+        stats=load_basket_stats(BASKET_STATS_DIR),
+        productos=productos,
+    )
+
+    if bootstrap_reglas > 0:
+        LOGGER.info("Estabilidad de reglas sobre %s remuestreos bootstrap", bootstrap_reglas)
+        run_rule_stability(
+            artifacts.detalle,
+            PROCESSED_DIR,
+            n_boot=bootstrap_reglas,
+            max_len=MAX_LEN_REGLAS,
+            productos=productos,
+        )
+
+    LOGGER.info("Calculando socios por lift para todos los SKU")
+    run_pair_lift(artifacts.detalle, PROCESSED_DIR, productos=productos)
 
     LOGGER.info("Calculando Pareto de margen")
     run_pareto(artifacts.detalle, PROCESSED_DIR)
 
+    LOGGER.info("Actualizando Pareto mensual e historial ABC")
+    run_pareto_rolling(
+        artifacts.detalle,
+        PARETO_STORE_DIR,
+        PROCESSED_DIR,
+        meses=None if dias_canasta is None else sorted({int(dia) // 100 for dia in dias_canasta}),
+        rebuild=previous is None,
+    )
+
     LOGGER.info("Clustering de tickets")
-    run_ticket_clustering(artifacts.tickets, PROCESSED_DIR)
+    tickets_recientes = None
+    if nuevos is not None:
+        tickets_recientes = artifacts.tickets["ticket_id"].isin(
+            artifacts.detalle.loc[nuevos, "ticket_id"].unique()
+        )
+    clustering = run_ticket_clustering(
+        artifacts.tickets, PROCESSED_DIR, model_dir=CLUSTER_MODEL_DIR, recientes=tickets_recientes
+    )
+    LOGGER.info(
+        "Clusters de tickets: k=%s (silhouette %.3f, modelo v%s, %s)",
+        clustering.best_k,
+        clustering.silhouette,
+        clustering.model.version,
+        "reentrenado" if clustering.refitted else f"sin reentrenar, drift {clustering.drift}",
+    )
+
+    LOGGER.info("Clustering de tickets por composicion de canasta (categoria)")
+    composicion = run_composition_clustering(artifacts.detalle, PROCESSED_DIR)
+    LOGGER.info(
+        "Clusters de composicion: k=%s (silhouette %.3f, varianza SVD %.2f)",
+        composicion.best_k,
+        composicion.silhouette,
+        composicion.explained_variance,
+    )
+
+    LOGGER.info("Market basket segmentado (tipo de dia, cluster, franja horaria, medio de pago)")
+    run_segmented_market_basket(
+        artifacts.detalle, PROCESSED_DIR, tickets=clustering.assignments, productos=productos
+    )
 
     LOGGER.info("Generando pronosticos semanales por categoria")
     generate_forecasts(artifacts.ventas_semanales_categoria, PREDICTIVE_DIR)
 
+    save_watermark(
+        PROCESSED_DIR, EtlWatermark.from_detalle(artifacts.detalle), SALIDAS_WATERMARK_FILE
+    )
     LOGGER.info("Pipeline finalizado correctamente")
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Pipeline modular Supermercado NINO.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Procesa solo los comprobantes posteriores a la ultima ejecucion.",
+    )
+    parser.add_argument(
+        "--bootstrap-reglas",
+        type=int,
+        default=0,
+        metavar="B",
+        help="Mide la estabilidad de las reglas sobre B remuestreos de tickets (0 = desactivado).",
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    main(incremental=args.incremental, bootstrap_reglas=args.bootstrap_reglas)
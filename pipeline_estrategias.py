@@ -31,8 +31,15 @@ warnings.filterwarnings('ignore')
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import silhouette_score
-from mlxtend.frequent_patterns import apriori, association_rules
-from mlxtend.preprocessing import TransactionEncoder
+
+from src.data_prep.calendario import franja_horaria
+from src.data_prep.cubo_ventas import build_cubo_ventas, rollup_cubo
+from src.data_prep.productos import build_dim_producto, product_names
+from src.features.itemsets import association_rules, encode_transactions
+from src.features.itemsets import frequent_itemsets as mine_frequent_itemsets
+from src.features.market_basket import decorate_rules, mine_segmented_rules
+from src.features.pareto_margen import aggregate_cube, pareto_segmentado
+from src.utils.raw_cache import load_sales_cached
 
 # =============================================================================
 # CONFIGURACIÓN
@@ -42,6 +49,7 @@ DATA_DIR = BASE_DIR / "data"
 RAW_DIR = DATA_DIR / "raw"
 OUTPUT_DIR = DATA_DIR / "app_dataset"
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+CACHE_DIR = DATA_DIR / "cache"
 
 # Archivos fuente
 SALES_FILE = RAW_DIR / "SERIE_COMPROBANTES_COMPLETOS.csv"
@@ -74,13 +82,8 @@ print("=" * 100)
 print("\n[PASO 1] Cargando datos...")
 info(f"Archivo: {SALES_FILE}")
 
-df_raw = pd.read_csv(
-    SALES_FILE,
-    sep=';',
-    decimal=',',
-    encoding='utf-8',
-    low_memory=False
-)
+# Cache Parquet por año/mes: el CSV solo se vuelve a parsear si cambia
+df_raw = load_sales_cached(SALES_FILE, CACHE_DIR)
 
 info(f"Registros cargados: {len(df_raw):,}")
 info(f"Columnas: {list(df_raw.columns)}")
@@ -108,6 +111,10 @@ df = df_raw.rename(columns=column_mapping)
 
 # Convertir tipos
 df['fecha'] = pd.to_datetime(df['fecha'], errors='coerce')
+# Comprobante llega como texto: se descartan números de ticket vacíos o inválidos
+df['ticket_id'] = pd.to_numeric(df['ticket_id'], errors='coerce')
+df = df[df['ticket_id'].notna()].copy()
+df['ticket_id'] = df['ticket_id'].astype('int64')
 df['cantidad'] = pd.to_numeric(df['cantidad'].astype(str).str.replace(',', '.'), errors='coerce')
 df['precio_unitario'] = pd.to_numeric(df['precio_unitario'].astype(str).str.replace(',', '.'), errors='coerce')
 
@@ -221,6 +228,24 @@ df_tickets['fecha_corta'] = df_tickets['fecha'].dt.date
 
 info(f"Tickets agregados: {len(df_tickets):,}")
 
+# Cubo (fecha, hora, categoria, medio de pago) + atributos de calendario: los KPIs
+# de los pasos 6-7 y 12-13 se obtienen sumando el cubo, sin volver a recorrer df.
+CLAVES_CUBO = [
+    'fecha', 'hora', 'anio', 'periodo', 'semana_iso', 'dia_semana', 'es_fin_semana',
+    'categoria', 'tipo_medio_pago',
+]
+cubo = build_cubo_ventas(df, keys=CLAVES_CUBO)
+cubo['fecha_corta'] = cubo['fecha'].dt.date
+cubo['fecha_hora'] = cubo['fecha'].dt.floor('h')
+info(f"Cubo de ventas: {len(cubo):,} celdas")
+
+def kpi_desde_cubo(claves):
+    """Ventas, margen y tickets por ``claves`` sumando el cubo (columnas historicas)."""
+    kpi = rollup_cubo(cubo, claves)[claves + ['ventas_totales', 'margen_total', 'tickets']]
+    kpi = kpi.rename(columns={'ventas_totales': 'ventas', 'margen_total': 'margen'})
+    kpi['rentabilidad_pct'] = kpi['margen'] / kpi['ventas']
+    return kpi
+
 # =============================================================================
 # PASO 5: ALCANCE DEL DATASET (Sección 1)
 # =============================================================================
@@ -259,10 +284,11 @@ info("✓ alcance_dataset.parquet")
 # =============================================================================
 print("\n[PASO 6] Calculando KPIs base...")
 
-ticket_promedio = df_tickets['monto_total_ticket'].mean()
-items_promedio_ticket = df_tickets['items_ticket'].mean()
+totales_cubo = cubo[['ventas_totales', 'margen_total', 'unidades_totales', 'tickets_ancla']].sum()
+ticket_promedio = totales_cubo['ventas_totales'] / totales_cubo['tickets_ancla']
+items_promedio_ticket = totales_cubo['unidades_totales'] / totales_cubo['tickets_ancla']
 rentabilidad_global = margen_total / ventas_total if ventas_total > 0 else 0
-rentabilidad_promedio_ticket = df_tickets['margen_ticket'].mean()
+rentabilidad_promedio_ticket = totales_cubo['margen_total'] / totales_cubo['tickets_ancla']
 
 kpis_base = pd.DataFrame([{
     'rentabilidad_global': rentabilidad_global,
@@ -285,89 +311,33 @@ print(f"  Rentabilidad Promedio/Ticket: ${rentabilidad_promedio_ticket:,.2f}")
 print("\n[PASO 7] Generando KPIs temporales...")
 
 # kpi_diario.parquet
-kpi_diario = (
-    df_tickets.groupby('fecha_corta')
-    .agg(
-        ventas=('monto_total_ticket', 'sum'),
-        margen=('margen_ticket', 'sum'),
-        tickets=('ticket_id', 'count'),
-    )
-    .reset_index()
-)
-kpi_diario['fecha'] = pd.to_datetime(kpi_diario['fecha_corta'])
-kpi_diario['rentabilidad_pct'] = kpi_diario['margen'] / kpi_diario['ventas']
+kpi_diario = kpi_desde_cubo(['fecha_corta'])
+kpi_diario.insert(4, 'fecha', pd.to_datetime(kpi_diario['fecha_corta']))
 kpi_diario.to_parquet(OUTPUT_DIR / 'kpi_diario.parquet', index=False)
 info(f"✓ kpi_diario.parquet ({len(kpi_diario)} registros)")
 
 # kpi_hora.parquet
-df_tickets_hora = df_tickets.copy()
-df_tickets_hora['fecha_hora'] = df_tickets_hora['fecha'].dt.floor('H')
-kpi_hora = (
-    df_tickets_hora.groupby(['fecha_hora', 'hora'])
-    .agg(
-        ventas=('monto_total_ticket', 'sum'),
-        margen=('margen_ticket', 'sum'),
-        tickets=('ticket_id', 'count'),
-    )
-    .reset_index()
-)
-kpi_hora['rentabilidad_pct'] = kpi_hora['margen'] / kpi_hora['ventas']
+kpi_hora = kpi_desde_cubo(['fecha_hora', 'hora'])
 kpi_hora.to_parquet(OUTPUT_DIR / 'kpi_hora.parquet', index=False)
 info(f"✓ kpi_hora.parquet ({len(kpi_hora)} registros)")
 
 # kpi_semana.parquet
-kpi_semana = (
-    df_tickets.groupby('semana_iso')
-    .agg(
-        ventas=('monto_total_ticket', 'sum'),
-        margen=('margen_ticket', 'sum'),
-        tickets=('ticket_id', 'count'),
-    )
-    .reset_index()
-)
-kpi_semana['rentabilidad_pct'] = kpi_semana['margen'] / kpi_semana['ventas']
+kpi_semana = kpi_desde_cubo(['semana_iso'])
 kpi_semana.to_parquet(OUTPUT_DIR / 'kpi_semana.parquet', index=False)
 info(f"✓ kpi_semana.parquet ({len(kpi_semana)} registros)")
 
 # kpi_periodo.parquet (mensual)
-kpi_periodo = (
-    df_tickets.groupby('periodo')
-    .agg(
-        ventas=('monto_total_ticket', 'sum'),
-        margen=('margen_ticket', 'sum'),
-        tickets=('ticket_id', 'count'),
-    )
-    .reset_index()
-)
-kpi_periodo['rentabilidad_pct'] = kpi_periodo['margen'] / kpi_periodo['ventas']
+kpi_periodo = kpi_desde_cubo(['periodo'])
 kpi_periodo.to_parquet(OUTPUT_DIR / 'kpi_periodo.parquet', index=False)
 info(f"✓ kpi_periodo.parquet ({len(kpi_periodo)} registros)")
 
 # kpi_anio.parquet
-kpi_anio = (
-    df_tickets.groupby('anio')
-    .agg(
-        ventas=('monto_total_ticket', 'sum'),
-        margen=('margen_ticket', 'sum'),
-        tickets=('ticket_id', 'count'),
-    )
-    .reset_index()
-)
-kpi_anio['rentabilidad_pct'] = kpi_anio['margen'] / kpi_anio['ventas']
+kpi_anio = kpi_desde_cubo(['anio'])
 kpi_anio.to_parquet(OUTPUT_DIR / 'kpi_anio.parquet', index=False)
 info(f"✓ kpi_anio.parquet ({len(kpi_anio)} registros)")
 
 # kpi_dow_weekend.parquet
-kpi_dow_weekend = (
-    df_tickets.groupby(['dia_semana', 'es_fin_semana'])
-    .agg(
-        ventas=('monto_total_ticket', 'sum'),
-        margen=('margen_ticket', 'sum'),
-        tickets=('ticket_id', 'count'),
-    )
-    .reset_index()
-)
-kpi_dow_weekend['rentabilidad_pct'] = kpi_dow_weekend['margen'] / kpi_dow_weekend['ventas']
+kpi_dow_weekend = kpi_desde_cubo(['dia_semana', 'es_fin_semana'])
 kpi_dow_weekend.to_parquet(OUTPUT_DIR / 'kpi_dow_weekend.parquet', index=False)
 info(f"✓ kpi_dow_weekend.parquet ({len(kpi_dow_weekend)} registros)")
 
@@ -385,188 +355,94 @@ info(f"✓ rentabilidad_ticket.parquet ({len(rentabilidad_ticket)} registros)")
 # =============================================================================
 print("\n[PASO 9] Generando Pareto global y segmentado...")
 
-def calcular_pareto(df_grupo, nombre):
-    """Calcula clasificación ABC por ventas y margen"""
-    df_sorted = df_grupo.sort_values('ventas', ascending=False).reset_index(drop=True)
-    df_sorted['ventas_acumuladas'] = df_sorted['ventas'].cumsum()
-    df_sorted['pct_acumulado_ventas'] = (df_sorted['ventas_acumuladas'] / df_sorted['ventas'].sum() * 100).round(2)
-
-    df_sorted['abc_ventas'] = pd.cut(
-        df_sorted['pct_acumulado_ventas'],
-        bins=[0, 80, 95, 100],
-        labels=['A', 'B', 'C']
-    )
-
-    # ABC por margen
-    df_sorted_margen = df_grupo.sort_values('margen', ascending=False).reset_index(drop=True)
-    df_sorted_margen['margen_acumulado'] = df_sorted_margen['margen'].cumsum()
-    df_sorted_margen['pct_acumulado_margen'] = (df_sorted_margen['margen_acumulado'] / df_sorted_margen['margen'].sum() * 100).round(2)
-    df_sorted_margen['abc_margen'] = pd.cut(
-        df_sorted_margen['pct_acumulado_margen'],
-        bins=[0, 80, 95, 100],
-        labels=['A', 'B', 'C']
-    )
-
-    # Merge ABC margen
-    if 'producto_id' in df_sorted.columns:
-        merge_on = 'producto_id'
-    else:
-        merge_on = 'categoria'
+# Una sola agregacion producto x segmento (fin de semana); categorias y
+# segmentos se derivan del mismo cubo con sort/cumsum/searchsorted vectorizados.
+CLAVES_PRODUCTO = ['producto_id', 'descripcion', 'categoria']
+cubo_pareto = aggregate_cube(
+    df,
+    keys=CLAVES_PRODUCTO,
+    values={'ventas': 'importe_total', 'margen': 'margen_linea'},
+    segments=['es_fin_semana'],
+)
+pareto_niveles = {
+    'cat': (['categoria'], pareto_segmentado(cubo_pareto, keys=['categoria'], values=['ventas', 'margen'], segments=['es_fin_semana'])),
+    'prod': (CLAVES_PRODUCTO, pareto_segmentado(cubo_pareto, keys=CLAVES_PRODUCTO, values=['ventas', 'margen'], segments=['es_fin_semana'])),
+}
+PARETO_SEGMENTOS = {
+    'global': ('global', 'TODOS'),
+    'weekday': ('es_fin_semana', 'False'),
+    'weekend': ('es_fin_semana', 'True'),
+}
 
-    df_sorted = df_sorted.merge(
-        df_sorted_margen[[merge_on, 'abc_margen']],
-        on=merge_on,
-        how='left'
+def formato_pareto(pareto, claves, segmento, valor):
+    """Bloque de un segmento con las columnas historicas (ABC por ventas y por margen)."""
+    bloque = pareto[(pareto['segmento'] == segmento) & (pareto['valor_segmento'] == valor)]
+    bloque = bloque.sort_values('rank_ventas')
+    resultado = bloque[claves + ['ventas', 'margen', 'ventas_acumulado']].rename(
+        columns={'ventas_acumulado': 'ventas_acumuladas'}
     )
+    resultado['pct_acumulado_ventas'] = (bloque['participacion_acumulada_ventas'] * 100).round(2)
+    resultado['abc_ventas'] = pd.Categorical(bloque['abc_ventas'], categories=['A', 'B', 'C'])
+    resultado['abc_margen'] = pd.Categorical(bloque['abc_margen'], categories=['A', 'B', 'C'])
+    return resultado.reset_index(drop=True)
 
-    return df_sorted
-
-# Pareto categorías global
-pareto_cat_global = df.groupby('categoria').agg({
-    'importe_total': 'sum',
-    'margen_linea': 'sum'
-}).reset_index()
-pareto_cat_global.columns = ['categoria', 'ventas', 'margen']
-pareto_cat_global = calcular_pareto(pareto_cat_global, 'cat_global')
-pareto_cat_global.to_parquet(OUTPUT_DIR / 'pareto_cat_global.parquet', index=False)
-info(f"✓ pareto_cat_global.parquet ({len(pareto_cat_global)} registros)")
-
-# Pareto productos global
-pareto_prod_global = df.groupby(['producto_id', 'descripcion', 'categoria']).agg({
-    'importe_total': 'sum',
-    'margen_linea': 'sum'
-}).reset_index()
-pareto_prod_global.columns = ['producto_id', 'descripcion', 'categoria', 'ventas', 'margen']
-pareto_prod_global = calcular_pareto(pareto_prod_global, 'prod_global')
-pareto_prod_global.to_parquet(OUTPUT_DIR / 'pareto_prod_global.parquet', index=False)
-info(f"✓ pareto_prod_global.parquet ({len(pareto_prod_global)} registros)")
-
-# Pareto categorías weekday
-df_weekday = df[~df['es_fin_semana']]
-pareto_cat_weekday = df_weekday.groupby('categoria').agg({
-    'importe_total': 'sum',
-    'margen_linea': 'sum'
-}).reset_index()
-pareto_cat_weekday.columns = ['categoria', 'ventas', 'margen']
-pareto_cat_weekday = calcular_pareto(pareto_cat_weekday, 'cat_weekday')
-pareto_cat_weekday.to_parquet(OUTPUT_DIR / 'pareto_cat_weekday.parquet', index=False)
-info(f"✓ pareto_cat_weekday.parquet ({len(pareto_cat_weekday)} registros)")
-
-# Pareto categorías weekend
-df_weekend = df[df['es_fin_semana']]
-pareto_cat_weekend = df_weekend.groupby('categoria').agg({
-    'importe_total': 'sum',
-    'margen_linea': 'sum'
-}).reset_index()
-pareto_cat_weekend.columns = ['categoria', 'ventas', 'margen']
-pareto_cat_weekend = calcular_pareto(pareto_cat_weekend, 'cat_weekend')
-pareto_cat_weekend.to_parquet(OUTPUT_DIR / 'pareto_cat_weekend.parquet', index=False)
-info(f"✓ pareto_cat_weekend.parquet ({len(pareto_cat_weekend)} registros)")
-
-# Pareto productos weekday
-pareto_prod_weekday = df_weekday.groupby(['producto_id', 'descripcion', 'categoria']).agg({
-    'importe_total': 'sum',
-    'margen_linea': 'sum'
-}).reset_index()
-pareto_prod_weekday.columns = ['producto_id', 'descripcion', 'categoria', 'ventas', 'margen']
-pareto_prod_weekday = calcular_pareto(pareto_prod_weekday, 'prod_weekday')
-pareto_prod_weekday.to_parquet(OUTPUT_DIR / 'pareto_prod_weekday.parquet', index=False)
-info(f"✓ pareto_prod_weekday.parquet ({len(pareto_prod_weekday)} registros)")
-
-# Pareto productos weekend
-pareto_prod_weekend = df_weekend.groupby(['producto_id', 'descripcion', 'categoria']).agg({
-    'importe_total': 'sum',
-    'margen_linea': 'sum'
-}).reset_index()
-pareto_prod_weekend.columns = ['producto_id', 'descripcion', 'categoria', 'ventas', 'margen']
-pareto_prod_weekend = calcular_pareto(pareto_prod_weekend, 'prod_weekend')
-pareto_prod_weekend.to_parquet(OUTPUT_DIR / 'pareto_prod_weekend.parquet', index=False)
-info(f"✓ pareto_prod_weekend.parquet ({len(pareto_prod_weekend)} registros)")
+paretos = {}
+for nivel, (claves, pareto) in pareto_niveles.items():
+    for sufijo, (segmento, valor) in PARETO_SEGMENTOS.items():
+        nombre = f'pareto_{nivel}_{sufijo}'
+        paretos[nombre] = formato_pareto(pareto, claves, segmento, valor)
+        paretos[nombre].to_parquet(OUTPUT_DIR / f'{nombre}.parquet', index=False)
+        info(f"✓ {nombre}.parquet ({len(paretos[nombre])} registros)")
+pareto_prod_global = paretos['pareto_prod_global']
 
 # =============================================================================
 # PASO 10: MARKET BASKET + ADYACENCIAS + COMBOS (Sección 6)
 # =============================================================================
 print("\n[PASO 10] Market Basket Analysis...")
 
-# Identificar productos clave manualmente (COCA, FERNET, etc.) + top ventas
-productos_clave = []
-
-# Buscar Coca y Fernet explícitamente
-df['desc_upper'] = df['descripcion'].str.upper()
-productos_coca = df[df['desc_upper'].str.contains('COCA', na=False)]['producto_id'].unique()
-productos_fernet = df[df['desc_upper'].str.contains('FERNET', na=False)]['producto_id'].unique()
-
-# Agregar combos frecuentes conocidos
-productos_vino = df[df['desc_upper'].str.contains('VINO', na=False)].groupby('producto_id')['importe_total'].sum().nlargest(5).index.tolist()
-productos_carne = df[df['categoria'].str.contains('CARNI', na=False)].groupby('producto_id')['importe_total'].sum().nlargest(5).index.tolist()
-
-# Top 20 productos globales
-top_20 = pareto_prod_global.head(20)['producto_id'].tolist()
+# Todos los tickets (>= 2 productos) y todos los productos, sin muestreo:
+# matriz dispersa ticket x producto_id + Eclat sobre bitsets (src.features.itemsets).
+# Las descripciones se agregan al final desde la dimension de productos.
+productos_dim = build_dim_producto(df)
+nombres_producto = product_names(productos_dim)
+transacciones = encode_transactions(df, item_col='producto_id')
+info(f"Matriz: {transacciones.matrix.shape[0]:,} tickets × {transacciones.matrix.shape[1]:,} productos")
 
-# Unir todos
-productos_clave = list(set(list(productos_coca) + list(productos_fernet) + productos_vino + productos_carne + top_20))
-info(f"Productos para basket: {len(productos_clave)} (incluye COCA, FERNET, VINO, CARNE, TOP 20)")
-
-df_basket = df[df['producto_id'].isin(productos_clave)].copy()
-
-# Filtrar tickets con al menos 2 productos
-tickets_validos = df_basket.groupby('ticket_id')['producto_id'].nunique()
-tickets_validos = tickets_validos[tickets_validos >= 2].index
-
-# Muestra de 25000 tickets
-np.random.seed(42)
-if len(tickets_validos) > 25000:
-    tickets_sample = np.random.choice(tickets_validos, size=25000, replace=False)
-else:
-    tickets_sample = tickets_validos
-
-df_basket = df_basket[df_basket['ticket_id'].isin(tickets_sample)]
-
-info(f"Tickets para análisis (muestra): {df_basket['ticket_id'].nunique():,}")
-
-# Crear transacciones
-transacciones = df_basket.groupby('ticket_id')['descripcion'].apply(list).tolist()
-
-# Encoder
-te = TransactionEncoder()
-te_ary = te.fit(transacciones).transform(transacciones)
-df_encoded = pd.DataFrame(te_ary, columns=te.columns_)
-
-info(f"Matriz: {df_encoded.shape[0]} tickets × {df_encoded.shape[1]} productos")
-
-# Apriori
 try:
-    frequent_itemsets = apriori(df_encoded, min_support=MIN_SUPPORT, use_colnames=True)
+    frequent_itemsets = mine_frequent_itemsets(transacciones, min_support=MIN_SUPPORT)
 
     if len(frequent_itemsets) > 0:
-        rules = association_rules(frequent_itemsets, metric="confidence", min_threshold=MIN_CONFIDENCE)
+        rules = association_rules(frequent_itemsets, min_confidence=MIN_CONFIDENCE)
         rules = rules[rules['lift'] >= MIN_LIFT]
-        rules = rules.sort_values('lift', ascending=False)
+        rules = rules.sort_values('lift', ascending=False, kind='mergesort')
 
-        # Reglas
-        rules_export = rules.copy()
-        rules_export['antecedents'] = rules_export['antecedents'].apply(lambda x: ', '.join(list(x)))
-        rules_export['consequents'] = rules_export['consequents'].apply(lambda x: ', '.join(list(x)))
+        # Reglas (descripciones + listas de producto_id)
+        rules_export = decorate_rules(rules, productos_dim)
         rules_export.to_parquet(OUTPUT_DIR / 'reglas.parquet', index=False)
         info(f"✓ reglas.parquet ({len(rules_export)} registros)")
 
         # Adyacencias (pares con lift alto)
         adjacency_pairs = rules[rules['antecedents'].apply(len) == 1][['antecedents', 'consequents', 'support', 'confidence', 'lift']].copy()
-        adjacency_pairs['antecedent'] = adjacency_pairs['antecedents'].apply(lambda x: list(x)[0])
-        adjacency_pairs['consequent'] = adjacency_pairs['consequents'].apply(lambda x: list(x)[0])
-        adjacency_pairs = adjacency_pairs[['antecedent', 'consequent', 'support', 'confidence', 'lift']]
+        adjacency_pairs['antecedent_id'] = adjacency_pairs['antecedents'].apply(lambda x: list(x)[0])
+        adjacency_pairs['consequent_id'] = adjacency_pairs['consequents'].apply(lambda x: list(x)[0])
+        adjacency_pairs['antecedent'] = adjacency_pairs['antecedent_id'].map(nombres_producto)
+        adjacency_pairs['consequent'] = adjacency_pairs['consequent_id'].map(nombres_producto)
+        adjacency_pairs = adjacency_pairs[['antecedent', 'consequent', 'support', 'confidence', 'lift', 'antecedent_id', 'consequent_id']]
         adjacency_pairs = adjacency_pairs.nlargest(50, 'lift')
         adjacency_pairs.to_parquet(OUTPUT_DIR / 'adjacency_pairs.parquet', index=False)
         info(f"✓ adjacency_pairs.parquet ({len(adjacency_pairs)} registros)")
 
         # Combos recomendados (con precio y margen estimado)
         combos = rules.nlargest(20, 'lift').copy()
-        combos['antecedent'] = combos['antecedents'].apply(lambda x: ', '.join(list(x)))
-        combos['consequent'] = combos['consequents'].apply(lambda x: ', '.join(list(x)))
+        etiquetas = decorate_rules(combos, productos_dim)
+        combos['antecedent'] = etiquetas['antecedents']
+        combos['consequent'] = etiquetas['consequents']
+        combos['antecedents_ids'] = etiquetas['antecedents_ids']
+        combos['consequents_ids'] = etiquetas['consequents_ids']
 
-        # Calcular precios (promedio de productos involucrados)
-        precio_map = df.groupby('descripcion')['precio_unitario'].mean().to_dict()
-        margen_pct_map = df.groupby('descripcion')['rentabilidad_pct'].mean().to_dict()
+        # Calcular precios (promedio por producto_id de los productos involucrados)
+        precio_map = productos_dim['precio_promedio'].to_dict()
+        margen_pct_map = productos_dim['rentabilidad_pct_promedio'].to_dict()
 
         def calcular_precio_combo(row):
             items = list(row['antecedents']) + list(row['consequents'])
@@ -582,7 +458,7 @@ try:
         combos['margen_combo_estimado'] = combos.apply(calcular_margen_combo, axis=1)
         combos['adopcion_objetivo_pct'] = 2.0  # 2% objetivo
 
-        combos_export = combos[['antecedent', 'consequent', 'support', 'confidence', 'lift', 'precio_combo_sugerido', 'margen_combo_estimado', 'adopcion_objetivo_pct']]
+        combos_export = combos[['antecedent', 'consequent', 'support', 'confidence', 'lift', 'precio_combo_sugerido', 'margen_combo_estimado', 'adopcion_objetivo_pct', 'antecedents_ids', 'consequents_ids']]
         combos_export.to_parquet(OUTPUT_DIR / 'combos_recomendados.parquet', index=False)
         info(f"✓ combos_recomendados.parquet ({len(combos_export)} registros)")
     else:
@@ -590,6 +466,24 @@ try:
 except Exception as e:
     warn(f"Error en Market Basket: {e}")
 
+# Reglas segmentadas (fin de semana, franja horaria, medio de pago) sobre la misma matriz
+try:
+    df_segmentos = df.drop_duplicates('ticket_id').set_index('ticket_id')
+    segmentos = pd.DataFrame({
+        'tipo_dia': np.where(df_segmentos['es_fin_semana'], 'FDS', 'HABIL'),
+        'franja_horaria': franja_horaria(df_segmentos['hora']),
+        'tipo_medio_pago': df_segmentos['tipo_medio_pago'],
+    }, index=df_segmentos.index)
+    reglas_segmentadas = mine_segmented_rules(
+        transacciones, segmentos,
+        min_support=MIN_SUPPORT, min_confidence=MIN_CONFIDENCE, min_lift=MIN_LIFT,
+    )
+    reglas_segmentadas = decorate_rules(reglas_segmentadas, productos_dim)
+    reglas_segmentadas.to_parquet(OUTPUT_DIR / 'reglas_segmentadas.parquet', index=False)
+    info(f"✓ reglas_segmentadas.parquet ({len(reglas_segmentadas)} registros)")
+except Exception as e:
+    warn(f"Error en Market Basket segmentado: {e}")
+
 # =============================================================================
 # PASO 11: CLUSTERING (Sección 7)
 # =============================================================================
@@ -747,12 +641,7 @@ else:
 # =============================================================================
 print("\n[PASO 12] KPI por categoría...")
 
-kpi_categoria = df.groupby('categoria').agg({
-    'importe_total': 'sum',
-    'margen_linea': 'sum',
-    'cantidad': 'sum',
-    'ticket_id': 'nunique'
-}).reset_index()
+kpi_categoria = rollup_cubo(cubo, ['categoria'])
 kpi_categoria.columns = ['categoria', 'ventas', 'margen', 'unidades', 'tickets']
 kpi_categoria['margen_pct'] = (kpi_categoria['margen'] / kpi_categoria['ventas'] * 100).round(2)
 kpi_categoria['pct_ventas'] = (kpi_categoria['ventas'] / kpi_categoria['ventas'].sum() * 100).round(2)
@@ -763,16 +652,7 @@ info(f"✓ kpi_categoria.parquet ({len(kpi_categoria)} registros)")
 # =============================================================================
 # PASO 13: KPI POR DÍA (para compatibilidad)
 # =============================================================================
-kpi_dia_semana = (
-    df_tickets.groupby('dia_semana')
-    .agg(
-        ventas=('monto_total_ticket', 'sum'),
-        margen=('margen_ticket', 'sum'),
-        tickets=('ticket_id', 'count'),
-    )
-    .reset_index()
-)
-kpi_dia_semana['rentabilidad_pct'] = kpi_dia_semana['margen'] / kpi_dia_semana['ventas']
+kpi_dia_semana = kpi_desde_cubo(['dia_semana'])
 kpi_dia_semana.to_parquet(OUTPUT_DIR / 'kpi_dia.parquet', index=False)
 info(f"✓ kpi_dia.parquet ({len(kpi_dia_semana)} registros)")
 
@@ -0,0 +1,118 @@
+"""Benchmark the vectorized ticket aggregation against the former groupby/mode lambda."""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.data_prep.etl_basico import build_tickets  # noqa: E402
+
+
+MEDIOS_PAGO = np.array(
+    ["EFECTIVO", "TARJETA_DEBITO", "TARJETA_CREDITO", "TRANSFERENCIA", "QR"], dtype=object
+)
+TIPOS_DIA = np.array(["HABIL", "FDS", "FERIADO"], dtype=object)
+
+
+def build_synthetic_detalle(n_lines: int, *, seed: int = 42) -> pd.DataFrame:
+    """Detalle-shaped frame with ~10 lines per ticket and a skewed product mix."""
+    rng = np.random.default_rng(seed)
+    lineas_por_ticket = rng.integers(1, 20, size=n_lines // 5)
+    lineas_por_ticket = lineas_por_ticket[np.cumsum(lineas_por_ticket) <= n_lines]
+    n_tickets = len(lineas_por_ticket)
+    ticket_id = np.repeat(np.arange(1, n_tickets + 1, dtype=np.int64), lineas_por_ticket)
+    n = len(ticket_id)
+
+    fechas_ticket = pd.Timestamp("2024-10-01") + pd.to_timedelta(
+        np.sort(rng.integers(0, 365 * 24 * 3600, size=n_tickets)), unit="s"
+    )
+    fecha = np.repeat(fechas_ticket.to_numpy(), lineas_por_ticket)
+    iso = pd.DatetimeIndex(fechas_ticket).isocalendar()
+    semana = (iso["year"].astype(str) + "-W" + iso["week"].astype(str).str.zfill(2)).to_numpy()
+
+    medio_ticket = rng.integers(0, len(MEDIOS_PAGO), size=n_tickets)
+    medio = np.repeat(medio_ticket, lineas_por_ticket)
+    cambio = rng.random(n) < 0.05
+    medio[cambio] = rng.integers(0, len(MEDIOS_PAGO), size=int(cambio.sum()))
+
+    producto = rng.zipf(1.3, size=n) % 12_000
+    importe = rng.gamma(2.0, 1_500.0, size=n).round(2)
+    return pd.DataFrame(
+        {
+            "ticket_id": ticket_id,
+            "fecha": fecha,
+            "anio": np.repeat(pd.DatetimeIndex(fechas_ticket).year.to_numpy(), lineas_por_ticket),
+            "mes": np.repeat(pd.DatetimeIndex(fechas_ticket).month.to_numpy(), lineas_por_ticket),
+            "semana_iso": np.repeat(semana, lineas_por_ticket),
+            "tipo_dia": np.repeat(TIPOS_DIA[rng.integers(0, 3, size=n_tickets)], lineas_por_ticket),
+            "tipo_medio_pago": MEDIOS_PAGO[medio],
+            "producto_id": producto.astype(str),
+            "importe_total": importe,
+            "margen_linea": importe * 0.28,
+            "cantidad": rng.integers(1, 5, size=n).astype(np.float64),
+        }
+    )
+
+
+def build_tickets_groupby(df: pd.DataFrame) -> pd.DataFrame:
+    """Previous implementation: groupby with a per-ticket ``mode`` lambda."""
+    return (
+        df.groupby("ticket_id")
+        .agg(
+            fecha=("fecha", "first"),
+            anio=("anio", "first"),
+            mes=("mes", "first"),
+            semana_iso=("semana_iso", "first"),
+            tipo_dia=("tipo_dia", "first"),
+            tipo_medio_pago=("tipo_medio_pago", lambda x: x.mode().iat[0] if not x.mode().empty else "EFECTIVO"),
+            ventas_totales=("importe_total", "sum"),
+            margen_total=("margen_linea", "sum"),
+            unidades_totales=("cantidad", "sum"),
+            productos_unicos=("producto_id", "nunique"),
+        )
+        .reset_index()
+    )
+
+
+def _timed(func, df: pd.DataFrame) -> tuple[pd.DataFrame, float]:
+    start = time.perf_counter()
+    result = func(df)
+    return result, time.perf_counter() - start
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=5_000_000, help="Lineas sinteticas a generar.")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    detalle = build_synthetic_detalle(args.lines, seed=args.seed)
+    print(f"Detalle sintetico: {len(detalle):,} lineas, {detalle['ticket_id'].nunique():,} tickets")
+
+    vectorizado, t_vectorizado = _timed(build_tickets, detalle)
+    print(f"build_tickets vectorizado: {t_vectorizado:8.2f} s")
+    anterior, t_anterior = _timed(build_tickets_groupby, detalle)
+    print(f"groupby + lambda mode:     {t_anterior:8.2f} s")
+    print(f"Aceleracion: x{t_anterior / t_vectorizado:,.1f}")
+
+    # build_tickets returns tipo_medio_pago as categorical; compare the labels.
+    for tabla in (vectorizado, anterior):
+        tabla["tipo_medio_pago"] = tabla["tipo_medio_pago"].astype(str)
+    pd.testing.assert_frame_equal(vectorizado, anterior, check_dtype=False)
+    print("Resultados identicos.")
+
+
+if __name__ == "__main__":
+    main()
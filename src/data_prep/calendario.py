@@ -0,0 +1,121 @@
+"""Calendar dimension shared by the ETL and the reporting layer.
+
+Temporal attributes (ISO week, period, weekday, holiday flags, tipo_dia)
+are computed once per distinct day and attached to the sales lines through
+an integer date key, instead of being derived line by line.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from src.utils.load_data import ensure_directory
+
+
+CALENDAR_FILE = "calendario.parquet"
+
+CALENDAR_COLUMNS = (
+    "anio",
+    "mes",
+    "dia",
+    "dia_semana",
+    "periodo",
+    "semana_iso",
+    "es_fin_de_semana",
+    "es_feriado",
+    "tipo_dia",
+)
+
+FRANJAS_HORARIAS = pd.IntervalIndex.from_breaks([0, 12, 16, 20, 24], closed="left")
+FRANJA_LABELS = ["MANANA", "MEDIODIA", "TARDE", "NOCHE"]
+
+
+def fecha_key(dias: pd.DatetimeIndex) -> np.ndarray:
+    """Integer ``YYYYMMDD`` key of each day."""
+    return (dias.year * 10000 + dias.month * 100 + dias.day).to_numpy(dtype=np.int32)
+
+
+def franja_horaria(hora: pd.Series) -> pd.Series:
+    """Hour band (``FRANJA_LABELS``) of each ``hora`` value, as a categorical."""
+    return pd.cut(hora, FRANJAS_HORARIAS).cat.rename_categories(FRANJA_LABELS)
+
+
+def build_calendario(dias, feriados: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Build one calendar row per day in ``dias`` (any datetime-like sequence)."""
+    dias = pd.DatetimeIndex(dias).normalize()
+    iso = dias.isocalendar()
+    anio = dias.year.to_numpy(dtype=np.int32)
+    mes = dias.month.to_numpy(dtype=np.int32)
+
+    if feriados is None or feriados.empty:
+        es_feriado = np.zeros(len(dias), dtype=bool)
+    else:
+        es_feriado = dias.isin(feriados["fecha"].dt.normalize())
+    es_fin_de_semana = dias.dayofweek.to_numpy() >= 5
+
+    calendario = pd.DataFrame(
+        {
+            "fecha_key": fecha_key(dias),
+            "fecha": dias,
+            "anio": anio,
+            "mes": mes,
+            "dia": dias.day.to_numpy(dtype=np.int32),
+            "dia_semana": dias.day_name(),
+            "periodo": [f"{a:04d}-{m:02d}" for a, m in zip(anio, mes)],
+            "semana_iso": [f"{y:04d}-W{w:02d}" for y, w in zip(iso["year"], iso["week"])],
+            "es_fin_de_semana": es_fin_de_semana,
+            "es_feriado": es_feriado,
+            "tipo_dia": np.select(
+                [es_feriado, es_fin_de_semana], ["FERIADO", "FDS"], default="HABIL"
+            ),
+        }
+    )
+    return calendario.reset_index(drop=True)
+
+
+def build_calendario_rango(
+    inicio: pd.Timestamp, fin: pd.Timestamp, feriados: Optional[pd.DataFrame] = None
+) -> pd.DataFrame:
+    """Calendar covering every day between ``inicio`` and ``fin`` (inclusive)."""
+    return build_calendario(
+        pd.date_range(pd.Timestamp(inicio).normalize(), pd.Timestamp(fin).normalize(), freq="D"),
+        feriados,
+    )
+
+
+def attach_calendario(df: pd.DataFrame, feriados: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Add ``fecha_key``, ``hora`` and the calendar attributes to sales lines.
+
+    Lines are factorized by their day number, the calendar is built for the
+    distinct days only and joined back with an integer take.
+    """
+    fechas = df["fecha"].to_numpy(dtype="datetime64[ns]")
+    dias = fechas.astype("datetime64[D]")
+    codes, dias_unicos = pd.factorize(dias.view(np.int64))
+    calendario = build_calendario(dias_unicos.astype("datetime64[D]"), feriados)
+
+    df["fecha_key"] = calendario["fecha_key"].to_numpy()[codes]
+    for column in CALENDAR_COLUMNS:
+        valores = calendario[column]
+        if valores.dtype == object:
+            categorias = pd.Categorical(valores)
+            df[column] = pd.Categorical.from_codes(
+                categorias.codes[codes], categories=categorias.categories
+            )
+        else:
+            df[column] = valores.to_numpy()[codes]
+
+    hora = ((fechas - dias) // np.timedelta64(1, "h")).astype(np.int32)
+    df.insert(df.columns.get_loc("dia_semana") + 1, "hora", hora)
+    return df
+
+
+def save_calendario(calendario: pd.DataFrame, directory: Path) -> Path:
+    ensure_directory(directory)
+    path = directory / CALENDAR_FILE
+    calendario.to_parquet(path, index=False)
+    return path
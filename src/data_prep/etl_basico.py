@@ -3,11 +3,15 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Optional
+from typing import Iterable, Optional
 
 import numpy as np
 import pandas as pd
 
+from src.data_prep.calendario import attach_calendario
+from src.data_prep.cubo_ventas import build_cubo_ventas, rollup_cubo
+from src.data_prep.schema import Dictionaries, concat_detalle, encode_detalle
+
 
 @dataclass
 class EtlArtifacts:
@@ -15,6 +19,7 @@ class EtlArtifacts:
     tickets: pd.DataFrame
     ventas_diarias: pd.DataFrame
     ventas_semanales_categoria: pd.DataFrame
+    cubo: pd.DataFrame
 
 
 COLUMN_MAPPING = {
@@ -36,125 +41,179 @@ COLUMN_MAPPING = {
 }
 
 
-def _normalize_text(series: pd.Series, fill: str) -> pd.Series:
-    text = series.astype(str).str.strip().str.upper()
-    text = text.replace({"NAN": np.nan})
-    return text.fillna(fill)
-
+MEDIO_PAGO_MAPPING = {
+    "DEBITO": "TARJETA_DEBITO",
+    "CREDITO": "TARJETA_CREDITO",
+    "TARJETA DEBITO": "TARJETA_DEBITO",
+    "TARJETA CREDITO": "TARJETA_CREDITO",
+}
 
-def _enrich_temporal(df: pd.DataFrame, feriados: Optional[pd.DataFrame]) -> pd.DataFrame:
-    df["anio"] = df["fecha"].dt.year
-    df["mes"] = df["fecha"].dt.month
-    df["dia"] = df["fecha"].dt.day
-    df["dia_semana"] = df["fecha"].dt.day_name()
-    df["hora"] = df["fecha"].dt.hour
-    df["periodo"] = df["anio"].astype(str) + "-" + df["mes"].astype(str).str.zfill(2)
 
-    iso_calendar = df["fecha"].dt.isocalendar()
-    df["semana_iso"] = (
-        iso_calendar["year"].astype(str)
-        + "-W"
-        + iso_calendar["week"].astype(str).str.zfill(2)
+def _normalize_text(
+    series: pd.Series, fill: str, replace: Optional[dict[str, str]] = None
+) -> pd.Series:
+    """Strip/upper-case text into a categorical, touching each distinct value once."""
+    codes, uniques = pd.factorize(series)
+    text = pd.Series(np.asarray(uniques, dtype=object)).astype(str).str.strip().str.upper()
+    text = pd.concat([text, pd.Series([fill])], ignore_index=True).replace({"NAN": fill})
+    if replace:
+        text = text.replace(replace)
+    categorias, remap = np.unique(text.to_numpy(dtype=object), return_inverse=True)
+    codes = np.where(codes < 0, len(uniques), codes)
+    return pd.Series(
+        pd.Categorical.from_codes(remap[codes], categories=categorias), index=series.index
     )
 
-    df["es_fin_de_semana"] = df["fecha"].dt.dayofweek >= 5
 
-    if feriados is None or feriados.empty:
-        df["es_feriado"] = False
-    else:
-        feriados_idx = feriados["fecha"].dt.normalize().unique()
-        df["es_feriado"] = df["fecha"].dt.normalize().isin(feriados_idx)
+def _map_categories(series: pd.Series, mapping: dict, fill) -> np.ndarray:
+    """Look up ``mapping`` once per category and broadcast it through the codes."""
+    valores = pd.Series(series.cat.categories).map(mapping).fillna(fill).to_numpy()
+    return valores[series.cat.codes.to_numpy()]
 
-    df["tipo_dia"] = np.select(
-        [df["es_feriado"], df["es_fin_de_semana"]],
-        ["FERIADO", "FDS"],
-        default="HABIL",
-    )
-    return df
 
+def _to_numeric(series: pd.Series) -> pd.Series:
+    if pd.api.types.is_numeric_dtype(series):
+        return series
+    return pd.to_numeric(series.astype(str).str.replace(",", "."), errors="coerce")
 
-def run_etl(
+
+def prepare_detalle(
     raw_sales: pd.DataFrame,
     rentabilidad: pd.DataFrame,
     feriados: Optional[pd.DataFrame] = None,
     *,
     fallback_rentabilidad: float = 18.0,
-) -> EtlArtifacts:
-    """Execute ETL steps and return canonical datasets."""
+) -> pd.DataFrame:
+    """Normalize a block of raw sales lines into the canonical detalle layout."""
     rename_columns = {
         source: target for source, target in COLUMN_MAPPING.items() if source in raw_sales.columns
     }
     df = raw_sales.rename(columns=rename_columns)
 
     df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
-    df = df[df["fecha"].notna()].copy()
+    df["ticket_id"] = pd.to_numeric(df["ticket_id"], errors="coerce")
+    df = df[df["fecha"].notna() & df["ticket_id"].notna()].copy()
+    df["ticket_id"] = df["ticket_id"].astype(np.int64)
 
-    df["cantidad"] = pd.to_numeric(
-        df["cantidad"].astype(str).str.replace(",", "."), errors="coerce"
-    )
-    df["precio_unitario"] = pd.to_numeric(
-        df["precio_unitario"].astype(str).str.replace(",", "."), errors="coerce"
-    )
+    df["cantidad"] = _to_numeric(df["cantidad"])
+    df["precio_unitario"] = _to_numeric(df["precio_unitario"])
 
     df["categoria"] = _normalize_text(df.get("categoria", pd.Series(dtype=str)), "SIN CATEGORIA")
     df["marca"] = _normalize_text(df.get("marca", pd.Series(dtype=str)), "SIN MARCA")
     df["descripcion"] = _normalize_text(df.get("descripcion", pd.Series(dtype=str)), "SIN DESCRIPCION")
     df["producto_id"] = _normalize_text(df.get("producto_id", pd.Series(dtype=str)), "SIN CODIGO")
     df["tipo_medio_pago"] = _normalize_text(
-        df.get("tipo_medio_pago", pd.Series(dtype=str)), "EFECTIVO"
-    ).replace(
-        {
-            "DEBITO": "TARJETA_DEBITO",
-            "CREDITO": "TARJETA_CREDITO",
-            "TARJETA DEBITO": "TARJETA_DEBITO",
-            "TARJETA CREDITO": "TARJETA_CREDITO",
-        }
+        df.get("tipo_medio_pago", pd.Series(dtype=str)), "EFECTIVO", MEDIO_PAGO_MAPPING
     )
     df["emisor_tarjeta"] = _normalize_text(
         df.get("emisor_tarjeta", pd.Series(dtype=str)), "DESCONOCIDO"
     )
 
-    df = _enrich_temporal(df, feriados)
+    df = attach_calendario(df, feriados)
 
     rent_dict = rentabilidad.set_index("Departamento")["rentabilidad_pct"].to_dict()
     clas_dict = rentabilidad.set_index("Departamento")["Clasificacion"].to_dict()
 
-    df["rentabilidad_pct"] = df["categoria"].map(rent_dict).fillna(fallback_rentabilidad)
-    df["clasificacion_departamento"] = df["categoria"].map(clas_dict).fillna(
-        "SIN CLASIFICACION"
+    df["rentabilidad_pct"] = _map_categories(df["categoria"], rent_dict, fallback_rentabilidad)
+    df["clasificacion_departamento"] = _map_categories(
+        df["categoria"], clas_dict, "SIN CLASIFICACION"
     )
     df["margen_linea"] = df["importe_total"] * (df["rentabilidad_pct"] / 100.0)
+    return encode_detalle(df)
 
-    tickets = (
-        df.groupby("ticket_id")
-        .agg(
-            fecha=("fecha", "first"),
-            anio=("anio", "first"),
-            mes=("mes", "first"),
-            semana_iso=("semana_iso", "first"),
-            tipo_dia=("tipo_dia", "first"),
-            tipo_medio_pago=("tipo_medio_pago", lambda x: x.mode().iat[0] if not x.mode().empty else "EFECTIVO"),
-            ventas_totales=("importe_total", "sum"),
-            margen_total=("margen_linea", "sum"),
-            unidades_totales=("cantidad", "sum"),
-            productos_unicos=("producto_id", "nunique"),
-        )
-        .reset_index()
+
+TICKET_FIRST_COLUMNS = ("fecha", "anio", "mes", "semana_iso", "tipo_dia")
+TICKET_SUM_COLUMNS = {
+    "ventas_totales": "importe_total",
+    "margen_total": "margen_linea",
+    "unidades_totales": "cantidad",
+}
+
+
+def _modal_codes(groups: np.ndarray, codes: np.ndarray, n_groups: int, n_codes: int) -> np.ndarray:
+    """Most frequent code per group; ties resolve to the lowest code, -1 if none."""
+    valid = codes >= 0
+    counts = np.bincount(
+        groups[valid] * n_codes + codes[valid], minlength=n_groups * n_codes
+    ).reshape(n_groups, n_codes)
+    modal = counts.argmax(axis=1)
+    modal[counts.max(axis=1) == 0] = -1
+    return modal
+
+
+def build_tickets(df: pd.DataFrame) -> pd.DataFrame:
+    """Aggregate detalle lines into one row per ticket.
+
+    Fully vectorized: lines are sorted once by (ticket_id, producto_id) and
+    every measure is derived from that ordering. ``first`` picks the earliest
+    original row of each ticket, sums use ``np.add.reduceat``, ``nunique``
+    counts (ticket, producto) boundaries and the modal payment method comes
+    from a ticket x medio count matrix (ties -> alphabetically first, as
+    ``Series.mode``).
+    """
+    columns = ["ticket_id", *TICKET_FIRST_COLUMNS, "tipo_medio_pago", *TICKET_SUM_COLUMNS, "productos_unicos"]
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+
+    ticket_ids = df["ticket_id"].to_numpy()
+    producto_codes, _ = pd.factorize(df["producto_id"])
+    order = np.lexsort((producto_codes, ticket_ids))
+
+    ids_sorted = ticket_ids[order]
+    productos_sorted = producto_codes[order]
+    nuevo_ticket = np.empty(len(order), dtype=bool)
+    nuevo_ticket[0] = True
+    np.not_equal(ids_sorted[1:], ids_sorted[:-1], out=nuevo_ticket[1:])
+    starts = np.flatnonzero(nuevo_ticket)
+    groups = np.cumsum(nuevo_ticket) - 1
+    n_groups = len(starts)
+
+    tickets = pd.DataFrame({"ticket_id": ids_sorted[starts]})
+
+    first_rows = np.minimum.reduceat(order, starts)
+    for column in TICKET_FIRST_COLUMNS:
+        tickets[column] = df[column].take(first_rows).reset_index(drop=True)
+
+    # Factorize the labels, not the categorical: on a categorical ``sort=True``
+    # follows category order, which need not be alphabetical.
+    medio_codes, medios = pd.factorize(df["tipo_medio_pago"].astype(object), sort=True)
+    modal = _modal_codes(groups, medio_codes[order], n_groups, max(len(medios), 1))
+    tickets["tipo_medio_pago"] = pd.Categorical(
+        np.where(modal >= 0, np.asarray(medios, dtype=object).take(np.maximum(modal, 0)), "EFECTIVO")
     )
 
-    ventas_diarias = (
-        df.groupby(["fecha", "anio", "mes", "semana_iso", "tipo_dia"])
-        .agg(
-            ventas_totales=("importe_total", "sum"),
-            margen_total=("margen_linea", "sum"),
-            unidades_totales=("cantidad", "sum"),
-            tickets=("ticket_id", "nunique"),
-        )
-        .reset_index()
+    for target, source in TICKET_SUM_COLUMNS.items():
+        values = df[source].to_numpy(dtype=np.float64)[order]
+        tickets[target] = np.add.reduceat(np.nan_to_num(values, nan=0.0), starts)
+
+    nuevo_par = nuevo_ticket.copy()
+    nuevo_par[1:] |= productos_sorted[1:] != productos_sorted[:-1]
+    nuevo_par &= productos_sorted >= 0
+    tickets["productos_unicos"] = np.add.reduceat(nuevo_par.astype(np.int64), starts)
+    return tickets[columns]
+
+
+def build_ventas_diarias(cubo: pd.DataFrame) -> pd.DataFrame:
+    """Daily totals rolled up from the sales cube (see ``src.data_prep.cubo_ventas``)."""
+    return rollup_cubo(cubo, ["fecha", "anio", "mes", "semana_iso", "tipo_dia"])
+
+
+def build_ventas_semanales_categoria(cubo: pd.DataFrame) -> pd.DataFrame:
+    """Weekly totals per category rolled up from the sales cube."""
+    return rollup_cubo(cubo, ["semana_iso", "anio", "categoria"]).rename(
+        columns={
+            "ventas_totales": "ventas_semana",
+            "margen_total": "margen_semana",
+            "unidades_totales": "unidades_semana",
+            "tickets": "tickets_semana",
+        }
     )
 
-    ventas_semanales_categoria = (
-        df.groupby(["semana_iso", "anio", "categoria"])
+
+def build_ventas_semanales_producto(df: pd.DataFrame) -> pd.DataFrame:
+    """Weekly totals per SKU, same layout as ``build_ventas_semanales_categoria``."""
+    return (
+        df.groupby(["semana_iso", "anio", "producto_id"], observed=True)
         .agg(
             ventas_semana=("importe_total", "sum"),
             margen_semana=("margen_linea", "sum"),
@@ -164,10 +223,58 @@ def run_etl(
         .reset_index()
     )
 
+
+def build_artifacts(df: pd.DataFrame) -> EtlArtifacts:
+    """Aggregate a normalized detalle into ticket tables and the sales cube.
+
+    Daily and weekly tables are rollups of the cube, so detalle is scanned
+    once for them.
+    """
+    cubo = build_cubo_ventas(df)
     return EtlArtifacts(
         detalle=df,
-        tickets=tickets,
-        ventas_diarias=ventas_diarias,
-        ventas_semanales_categoria=ventas_semanales_categoria,
+        tickets=build_tickets(df),
+        ventas_diarias=build_ventas_diarias(cubo),
+        ventas_semanales_categoria=build_ventas_semanales_categoria(cubo),
+        cubo=cubo,
+    )
+
+
+def run_etl(
+    raw_sales: pd.DataFrame,
+    rentabilidad: pd.DataFrame,
+    feriados: Optional[pd.DataFrame] = None,
+    *,
+    fallback_rentabilidad: float = 18.0,
+) -> EtlArtifacts:
+    """Execute ETL steps and return canonical datasets."""
+    df = prepare_detalle(
+        raw_sales, rentabilidad, feriados, fallback_rentabilidad=fallback_rentabilidad
     )
+    return build_artifacts(df)
+
 
+def run_etl_chunked(
+    chunks: Iterable[pd.DataFrame],
+    rentabilidad: pd.DataFrame,
+    feriados: Optional[pd.DataFrame] = None,
+    *,
+    fallback_rentabilidad: float = 18.0,
+    dictionaries: Optional[Dictionaries] = None,
+) -> EtlArtifacts:
+    """Execute the ETL over a stream of raw chunks (see ``iter_sales_data``).
+
+    Each chunk is normalized as soon as it is read, so only the compact
+    detalle blocks are kept in memory instead of the whole raw export.
+    ``dictionaries`` (see ``src.data_prep.schema``) keeps the categorical
+    codes stable with respect to a previous run.
+    """
+    frames = [
+        prepare_detalle(
+            chunk, rentabilidad, feriados, fallback_rentabilidad=fallback_rentabilidad
+        )
+        for chunk in chunks
+    ]
+    if not frames:
+        raise ValueError("No se recibieron bloques de ventas para el ETL.")
+    return build_artifacts(concat_detalle(frames, dictionaries))
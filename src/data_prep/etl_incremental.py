@@ -0,0 +1,157 @@
+"""Incremental ETL that only processes sales lines newer than the last run."""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import pandas as pd
+
+from src.data_prep.cubo_ventas import CUBE_FILE, CUBE_KEYS, build_cubo_ventas
+from src.data_prep.etl_basico import (
+    EtlArtifacts,
+    build_tickets,
+    build_ventas_diarias,
+    build_ventas_semanales_categoria,
+    prepare_detalle,
+)
+from src.data_prep.schema import concat_detalle, dictionaries_from_detalle, save_dictionaries
+from src.utils.load_data import ensure_directory
+
+
+WATERMARK_FILE = "etl_watermark.json"
+
+ARTIFACT_FILES = {
+    "detalle": "detalle_lineas.parquet",
+    "tickets": "tickets.parquet",
+    "ventas_diarias": "ventas_diarias.parquet",
+    "ventas_semanales_categoria": "ventas_semanales_categoria.parquet",
+    "cubo": CUBE_FILE,
+}
+
+
+@dataclass
+class EtlWatermark:
+    """Last (fecha, ticket_id) already included in the persisted artifacts."""
+
+    fecha: pd.Timestamp
+    ticket_id: int
+
+    @classmethod
+    def from_detalle(cls, detalle: pd.DataFrame) -> "EtlWatermark":
+        ultimo = detalle.sort_values(["fecha", "ticket_id"]).iloc[-1]
+        return cls(fecha=pd.Timestamp(ultimo["fecha"]), ticket_id=int(ultimo["ticket_id"]))
+
+    def newer_mask(self, detalle: pd.DataFrame) -> pd.Series:
+        """Flag lines strictly after the watermark in (fecha, ticket_id) order."""
+        fecha = detalle["fecha"]
+        return (fecha > self.fecha) | ((fecha == self.fecha) & (detalle["ticket_id"] > self.ticket_id))
+
+
+def load_watermark(processed_dir: Path, filename: str = WATERMARK_FILE) -> Optional[EtlWatermark]:
+    path = processed_dir / filename
+    if not path.exists():
+        return None
+    payload = json.loads(path.read_text(encoding="utf-8"))
+    return EtlWatermark(fecha=pd.Timestamp(payload["fecha"]), ticket_id=int(payload["ticket_id"]))
+
+
+def save_watermark(
+    processed_dir: Path, watermark: EtlWatermark, filename: str = WATERMARK_FILE
+) -> Path:
+    ensure_directory(processed_dir)
+    path = processed_dir / filename
+    path.write_text(
+        json.dumps({"fecha": watermark.fecha.isoformat(), "ticket_id": watermark.ticket_id}),
+        encoding="utf-8",
+    )
+    return path
+
+
+def load_artifacts(processed_dir: Path) -> Optional[EtlArtifacts]:
+    """Read the persisted ETL outputs, or ``None`` if any of them is missing."""
+    paths = {name: processed_dir / filename for name, filename in ARTIFACT_FILES.items()}
+    if not all(path.exists() for path in paths.values()):
+        return None
+    return EtlArtifacts(**{name: pd.read_parquet(path) for name, path in paths.items()})
+
+
+def save_artifacts(artifacts: EtlArtifacts, processed_dir: Path) -> Dict[str, Path]:
+    """Write the ETL tables plus the categorical dictionaries of ``detalle``."""
+    ensure_directory(processed_dir)
+    paths = {name: processed_dir / filename for name, filename in ARTIFACT_FILES.items()}
+    for name, path in paths.items():
+        getattr(artifacts, name).to_parquet(path, index=False)
+    paths["diccionarios"] = save_dictionaries(
+        dictionaries_from_detalle(artifacts.detalle), processed_dir
+    )
+    return paths
+
+
+def _replace_rows(
+    previous: pd.DataFrame,
+    recomputed: pd.DataFrame,
+    stale: pd.Series,
+    sort_by: list[str],
+) -> pd.DataFrame:
+    merged = concat_detalle([previous[~stale], recomputed])
+    return merged.sort_values(sort_by, kind="mergesort").reset_index(drop=True)
+
+
+def run_etl_incremental(
+    chunks: Iterable[pd.DataFrame],
+    rentabilidad: pd.DataFrame,
+    feriados: Optional[pd.DataFrame],
+    *,
+    previous: EtlArtifacts,
+    watermark: EtlWatermark,
+    fallback_rentabilidad: float = 18.0,
+) -> EtlArtifacts:
+    """Merge sales lines newer than ``watermark`` into ``previous`` artifacts.
+
+    Only the tickets and the cube days touched by the new lines are
+    re-aggregated; every other row of the persisted tables is reused as is.
+    ``chunks`` may include already processed lines (e.g. the whole month read
+    from the raw cache); they are dropped using the watermark.
+    """
+    frames = []
+    for chunk in chunks:
+        detalle_chunk = prepare_detalle(
+            chunk, rentabilidad, feriados, fallback_rentabilidad=fallback_rentabilidad
+        )
+        frames.append(detalle_chunk[watermark.newer_mask(detalle_chunk)])
+    nuevos = concat_detalle(frames) if frames else pd.DataFrame()
+    if nuevos.empty:
+        return previous
+
+    detalle = concat_detalle(
+        [previous.detalle, nuevos], known=dictionaries_from_detalle(previous.detalle)
+    )
+
+    tickets_nuevos = nuevos["ticket_id"].unique()
+    tickets = _replace_rows(
+        previous.tickets,
+        build_tickets(detalle[detalle["ticket_id"].isin(tickets_nuevos)]),
+        previous.tickets["ticket_id"].isin(tickets_nuevos),
+        ["ticket_id"],
+    )
+
+    # Cube cells are replaced day by day; daily and weekly tables are then
+    # rolled up again from the (small) cube instead of from detalle.
+    dias_nuevos = nuevos["fecha"].dt.normalize().unique()
+    cubo = _replace_rows(
+        previous.cubo,
+        build_cubo_ventas(detalle[detalle["fecha"].dt.normalize().isin(dias_nuevos)]),
+        previous.cubo["fecha"].dt.normalize().isin(dias_nuevos),
+        list(CUBE_KEYS),
+    )
+
+    return EtlArtifacts(
+        detalle=detalle,
+        tickets=tickets,
+        ventas_diarias=build_ventas_diarias(cubo),
+        ventas_semanales_categoria=build_ventas_semanales_categoria(cubo),
+        cubo=cubo,
+    )
@@ -0,0 +1,65 @@
+"""Product dimension keyed by ``producto_id``.
+
+Basket mining and the combo simulator work on producto_id codes; names,
+category and average price/margin are looked up here once per SKU instead
+of being carried (and string-matched) on every sales line.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, Iterable, Mapping
+
+import numpy as np
+import pandas as pd
+
+from src.utils.load_data import ensure_directory
+
+
+PRODUCT_FILE = "dim_producto.parquet"
+
+_ATTRIBUTES = ("descripcion", "categoria", "marca")
+
+
+def build_dim_producto(detalle: pd.DataFrame) -> pd.DataFrame:
+    """One row per ``producto_id`` (index) with its latest name and mean price/margin.
+
+    When a code was sold under several names, the one on its most recent
+    line wins.
+    """
+    if "fecha" in detalle.columns:
+        detalle = detalle.sort_values("fecha", kind="mergesort")
+    grupos = detalle.groupby("producto_id", observed=True, sort=True)
+    aggregations = {
+        column: (column, "last") for column in _ATTRIBUTES if column in detalle.columns
+    }
+    if "precio_unitario" in detalle.columns:
+        aggregations["precio_promedio"] = ("precio_unitario", "mean")
+    if "rentabilidad_pct" in detalle.columns:
+        aggregations["rentabilidad_pct_promedio"] = ("rentabilidad_pct", "mean")
+    dim = grupos.agg(**aggregations)
+    dim.index = dim.index.astype(str)
+    return dim
+
+
+def product_names(dim: pd.DataFrame, column: str = "descripcion") -> Dict[str, str]:
+    """``producto_id -> name`` mapping for decorating codes."""
+    return dim[column].astype(str).to_dict()
+
+
+def describe_itemset(itemset: Iterable, nombres: Mapping[str, str]) -> str:
+    """Names of the SKUs in ``itemset`` joined by ", " (unknown codes keep the code)."""
+    return ", ".join(sorted(nombres.get(item, str(item)) for item in itemset))
+
+
+def match_productos(dim: pd.DataFrame, pattern: str, column: str = "descripcion") -> np.ndarray:
+    """Codes whose ``column`` contains ``pattern`` (case-insensitive, literal)."""
+    mask = dim[column].astype(str).str.contains(pattern, case=False, regex=False, na=False)
+    return dim.index[mask.to_numpy()].to_numpy()
+
+
+def save_dim_producto(dim: pd.DataFrame, directory: Path) -> Path:
+    ensure_directory(directory)
+    path = directory / PRODUCT_FILE
+    dim.rename_axis("producto_id").reset_index().to_parquet(path, index=False)
+    return path
@@ -0,0 +1,126 @@
+"""Canonical categorical schema for the line-level ``detalle`` dataset.
+
+Low-cardinality text columns are stored as pandas categoricals whose
+dictionaries are shared across runs: they are persisted next to
+``detalle_lineas.parquet`` and new values are always appended, so the
+integer code of an existing value never changes.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from src.utils.load_data import ensure_directory
+
+
+CATEGORICAL_COLUMNS = (
+    "categoria",
+    "marca",
+    "descripcion",
+    "producto_id",
+    "tipo_medio_pago",
+    "emisor_tarjeta",
+    "dia_semana",
+    "periodo",
+    "semana_iso",
+    "tipo_dia",
+)
+
+DICTIONARY_FILE = "detalle_diccionarios.parquet"
+
+Dictionaries = Dict[str, List[str]]
+
+
+def _as_categorical(series: pd.Series) -> pd.Series:
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    return series.astype("category")
+
+
+def build_dictionaries(
+    frames: Iterable[pd.DataFrame], known: Optional[Dictionaries] = None
+) -> Dictionaries:
+    """Merge the categories seen in ``frames`` into the ``known`` dictionaries.
+
+    Known values keep their position (and thus their code); unseen values are
+    appended in sorted order.
+    """
+    frames = list(frames)
+    known = known or {}
+    dictionaries: Dictionaries = {}
+    for column in CATEGORICAL_COLUMNS:
+        present = [frame[column] for frame in frames if column in frame.columns]
+        if not present and column not in known:
+            continue
+        base = list(known.get(column, []))
+        vistos = set(base)
+        nuevos = set()
+        for series in present:
+            nuevos.update(
+                value for value in _as_categorical(series).cat.categories if value not in vistos
+            )
+        dictionaries[column] = base + sorted(nuevos)
+    return dictionaries
+
+
+def encode_detalle(
+    df: pd.DataFrame, dictionaries: Optional[Dictionaries] = None
+) -> pd.DataFrame:
+    """Cast the canonical columns of ``df`` to categoricals over ``dictionaries``."""
+    dictionaries = dictionaries if dictionaries is not None else build_dictionaries([df])
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns and column in dictionaries:
+            df[column] = _as_categorical(df[column]).cat.set_categories(dictionaries[column])
+    return df
+
+
+def concat_detalle(
+    frames: Iterable[pd.DataFrame], known: Optional[Dictionaries] = None
+) -> pd.DataFrame:
+    """Concatenate detalle blocks keeping the categorical columns as categoricals.
+
+    ``pd.concat`` falls back to ``object`` when categories differ, so every
+    block is first re-coded against the merged dictionaries. The inputs are
+    left untouched (only shallow copies are re-coded).
+    """
+    frames = list(frames)
+    dictionaries = build_dictionaries(frames, known)
+    return pd.concat(
+        [encode_detalle(frame.copy(deep=False), dictionaries) for frame in frames],
+        ignore_index=True,
+    )
+
+
+def dictionaries_from_detalle(df: pd.DataFrame) -> Dictionaries:
+    return {
+        column: list(df[column].cat.categories)
+        for column in CATEGORICAL_COLUMNS
+        if column in df.columns and isinstance(df[column].dtype, pd.CategoricalDtype)
+    }
+
+
+def save_dictionaries(dictionaries: Dictionaries, directory: Path) -> Path:
+    """Persist the dictionaries as a long (columna, codigo, valor) table."""
+    ensure_directory(directory)
+    rows = [
+        {"columna": column, "codigo": code, "valor": value}
+        for column, values in dictionaries.items()
+        for code, value in enumerate(values)
+    ]
+    path = directory / DICTIONARY_FILE
+    pd.DataFrame(rows, columns=["columna", "codigo", "valor"]).to_parquet(path, index=False)
+    return path
+
+
+def load_dictionaries(directory: Path) -> Dictionaries:
+    path = directory / DICTIONARY_FILE
+    if not path.exists():
+        return {}
+    table = pd.read_parquet(path).sort_values(["columna", "codigo"])
+    return {
+        str(column): group["valor"].astype(str).tolist()
+        for column, group in table.groupby("columna", sort=False)
+    }
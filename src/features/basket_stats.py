@@ -0,0 +1,353 @@
+"""Persisted co-occurrence counts for incremental association-rule maintenance.
+
+Item, pair (and optionally triple) counts are stored per day partition::
+
+    basket_stats/
+        tickets/fecha_key=20240105/part.parquet   (n_tickets)
+        items/fecha_key=20240105/part.parquet     (item, count)
+        pares/fecha_key=20240105/part.parquet     (item_a, item_b, count)
+        triples/fecha_key=20240105/part.parquet   (item_a, item_b, item_c, count)
+        totales/{tickets,items,pares,triples}.parquet   (running totals)
+        store.json                                (item column and whether triples are counted)
+
+Loading a day only rewrites that day's partitions and updates the running
+totals by subtracting the day's previous counts and adding the new ones,
+so rules, support, confidence and lift over the full history are
+regenerated from one table per kind, without rescanning the sales history
+or re-reading the day partitions (those are only read for date ranges).
+
+Triples are the expensive part: a ticket with m distinct items adds
+C(m, 3) rows to its day, and the totals keep one row per distinct triple
+ever seen, which grows with the assortment rather than with the number of
+days. Counts use the same
+transaction definition as ``src.features.itemsets`` (tickets with at least
+two distinct items), so derived rules match mining with ``max_len`` 2, or 3
+when triples are counted. Longer itemsets are not stored: callers that need
+them must mine the tickets (``run_market_basket`` does so on its own).
+"""
+
+from __future__ import annotations
+
+import json
+import shutil
+from dataclasses import dataclass
+from itertools import combinations
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+from scipy import sparse
+
+from src.features.itemsets import (
+    RULE_COLUMNS,
+    Transactions,
+    encode_transactions,
+    min_support_count,
+    rules_from_supports,
+)
+from src.utils.load_data import ensure_directory
+
+
+PARTITION_KEY = "fecha_key"
+TABLES = ("tickets", "items", "pares", "triples")
+TABLE_KEYS = {
+    "tickets": [],
+    "items": ["item"],
+    "pares": ["item_a", "item_b"],
+    "triples": ["item_a", "item_b", "item_c"],
+}
+STORE_META_FILE = "store.json"
+STORE_VERSION = 2
+TOTALS_DIR = "totales"
+# Pending day frames per table before they are folded into the totals.
+MAX_PENDING_FRAMES = 64
+
+
+@dataclass
+class BasketStats:
+    """Co-occurrence totals over a set of day partitions."""
+
+    n_tickets: int
+    items: pd.DataFrame
+    pares: pd.DataFrame
+    triples: Optional[pd.DataFrame] = None
+    item_col: str = "producto_id"
+
+    @property
+    def max_len(self) -> int:
+        """Largest itemset size the counts cover."""
+        return 2 if self.triples is None else 3
+
+
+def _pair_counts(transactions: Transactions) -> pd.DataFrame:
+    matrix = transactions.matrix.astype(np.int32)
+    cooc = sparse.triu(matrix.T @ matrix, k=1).tocoo()
+    return pd.DataFrame(
+        {
+            "item_a": transactions.items[cooc.row],
+            "item_b": transactions.items[cooc.col],
+            "count": cooc.data.astype(np.int64),
+        }
+    )
+
+
+def _triple_counts(transactions: Transactions) -> pd.DataFrame:
+    """Count item triples, generating C(m, 3) index triples per ticket size m."""
+    matrix = transactions.matrix
+    matrix.sort_indices()
+    sizes = np.diff(matrix.indptr)
+    n_items = np.int64(len(transactions.items))
+    keys = []
+    for size in np.unique(sizes[sizes >= 3]):
+        rows = np.flatnonzero(sizes == size)
+        positions = matrix.indptr[rows][:, None] + np.arange(size)
+        ticket_items = matrix.indices[positions].astype(np.int64)
+        template = np.array(list(combinations(range(size), 3)))
+        trios = ticket_items[:, template].reshape(-1, 3)
+        keys.append((trios[:, 0] * n_items + trios[:, 1]) * n_items + trios[:, 2])
+    if not keys:
+        return pd.DataFrame(columns=["item_a", "item_b", "item_c", "count"])
+    unique, counts = np.unique(np.concatenate(keys), return_counts=True)
+    ab, c = np.divmod(unique, n_items)
+    a, b = np.divmod(ab, n_items)
+    return pd.DataFrame(
+        {
+            "item_a": transactions.items[a],
+            "item_b": transactions.items[b],
+            "item_c": transactions.items[c],
+            "count": counts.astype(np.int64),
+        }
+    )
+
+
+def count_basket_day(
+    detalle_dia: pd.DataFrame, *, item_col: str = "producto_id", triples: bool = False
+) -> Dict[str, pd.DataFrame]:
+    """Count tickets, items, pairs (and triples) for one day of detalle lines."""
+    transactions = encode_transactions(detalle_dia, item_col=item_col)
+    # Columns in label order, so (item_a, item_b[, item_c]) is the same key on every day.
+    order = np.argsort(transactions.items, kind="stable")
+    transactions = Transactions(
+        matrix=transactions.matrix[:, order].tocsr(),
+        items=transactions.items[order],
+        ticket_ids=transactions.ticket_ids,
+    )
+    item_counts = np.asarray(transactions.matrix.sum(axis=0)).ravel().astype(np.int64)
+    tables = {
+        "tickets": pd.DataFrame({"n_tickets": [transactions.n_transactions]}),
+        "items": pd.DataFrame({"item": transactions.items, "count": item_counts}),
+        "pares": _pair_counts(transactions),
+    }
+    if triples:
+        tables["triples"] = _triple_counts(transactions)
+    return tables
+
+
+def _read_meta(store_dir: Path) -> dict:
+    meta_path = store_dir / STORE_META_FILE
+    return json.loads(meta_path.read_text()) if meta_path.exists() else {}
+
+
+def _partition_dir(store_dir: Path, table: str, key: int) -> Path:
+    return store_dir / table / f"{PARTITION_KEY}={key}"
+
+
+def _count_column(table: str) -> str:
+    return "n_tickets" if table == "tickets" else "count"
+
+
+def _combine_counts(frames: list, table: str) -> pd.DataFrame:
+    """Sum signed count frames of one table by key, dropping keys that net to zero."""
+    keys, value = TABLE_KEYS[table], _count_column(table)
+    frames = [frame for frame in frames if frame is not None and len(frame)]
+    if not keys:
+        return pd.DataFrame({value: [int(sum(frame[value].sum() for frame in frames))]})
+    if not frames:
+        return pd.DataFrame({**{key: pd.Series(dtype=object) for key in keys}, value: pd.Series(dtype=np.int64)})
+    merged = pd.concat(frames, ignore_index=True)
+    total = merged.groupby(keys, observed=True, sort=False)[value].sum().reset_index()
+    return total[total[value] != 0].reset_index(drop=True)
+
+
+def _read_totals(store_dir: Path) -> Dict[str, pd.DataFrame]:
+    path = store_dir / TOTALS_DIR
+    return {
+        table: pd.read_parquet(path / f"{table}.parquet")
+        for table in TABLES
+        if (path / f"{table}.parquet").exists()
+    }
+
+
+def update_basket_stats(
+    detalle: pd.DataFrame,
+    store_dir: Path,
+    *,
+    dias: Optional[Iterable[int]] = None,
+    item_col: str = "producto_id",
+    triples: bool = False,
+    rebuild: bool = False,
+) -> list[int]:
+    """Recount the given days (``fecha_key`` values) and replace their partitions.
+
+    ``dias=None`` recounts every day present in ``detalle``; ``rebuild``
+    also drops partitions of days no longer present. Recounting a whole
+    day keeps the store idempotent when late tickets arrive for it. A
+    store that is missing, has no metadata or was counted over a different
+    ``item_col`` or ``triples`` setting is rebuilt from every day of
+    ``detalle`` (``dias`` is ignored), so it never covers a partial history.
+    """
+    meta_path = store_dir / STORE_META_FILE
+    settings = {"item_col": item_col, "triples": bool(triples), "version": STORE_VERSION}
+    if not rebuild and _read_meta(store_dir) != settings:
+        rebuild, dias = True, None
+    if rebuild and store_dir.exists():
+        shutil.rmtree(store_dir)
+    ensure_directory(store_dir)
+    # Without metadata the next update rebuilds, so an interrupted update
+    # never leaves the totals out of step with the day partitions.
+    meta_path.unlink(missing_ok=True)
+
+    totales = _read_totals(store_dir)
+    pendientes = {table: [totales.get(table)] for table in TABLES}
+    claves = detalle[PARTITION_KEY].to_numpy()
+    dias = np.unique(claves) if dias is None else np.unique(np.asarray(list(dias)))
+    actualizados = []
+    for dia in dias:
+        tables = count_basket_day(
+            detalle[claves == dia], item_col=item_col, triples=triples
+        )
+        for table in TABLES:
+            partition = _partition_dir(store_dir, table, int(dia))
+            if partition.exists():
+                anterior = pd.read_parquet(partition / "part.parquet")
+                anterior[_count_column(table)] = -anterior[_count_column(table)]
+                pendientes[table].append(anterior)
+                shutil.rmtree(partition)
+            if table not in tables:
+                continue
+            ensure_directory(partition)
+            tables[table].to_parquet(partition / "part.parquet", index=False)
+            pendientes[table].append(tables[table])
+            if len(pendientes[table]) > MAX_PENDING_FRAMES:
+                pendientes[table] = [_combine_counts(pendientes[table], table)]
+        actualizados.append(int(dia))
+
+    ensure_directory(store_dir / TOTALS_DIR)
+    for table in TABLES:
+        path = store_dir / TOTALS_DIR / f"{table}.parquet"
+        if table == "triples" and not triples:
+            path.unlink(missing_ok=True)
+            continue
+        _combine_counts(pendientes[table], table).to_parquet(path, index=False)
+    meta_path.write_text(json.dumps(settings))
+    return actualizados
+
+
+def _read_table(
+    store_dir: Path,
+    table: str,
+    columns: list[str],
+    desde: Optional[int],
+    hasta: Optional[int],
+) -> Optional[pd.DataFrame]:
+    path = store_dir / table
+    if not path.exists():
+        return None
+    dataset = ds.dataset(
+        path,
+        format=ds.ParquetFileFormat(
+            read_options=ds.ParquetReadOptions(
+                dictionary_columns=[c for c in columns if c.startswith("item")]
+            )
+        ),
+        partitioning="hive",
+    )
+    filtro = None
+    if desde is not None:
+        filtro = ds.field(PARTITION_KEY) >= desde
+    if hasta is not None:
+        hasta_expr = ds.field(PARTITION_KEY) <= hasta
+        filtro = hasta_expr if filtro is None else filtro & hasta_expr
+    return dataset.to_table(columns=columns, filter=filtro).unify_dictionaries().to_pandas()
+
+
+def _sum_counts(frame: Optional[pd.DataFrame], keys: list[str]) -> Optional[pd.DataFrame]:
+    if frame is None:
+        return None
+    return frame.groupby(keys, observed=True, sort=False)["count"].sum().reset_index()
+
+
+def load_basket_stats(
+    store_dir: Path, *, desde: Optional[int] = None, hasta: Optional[int] = None
+) -> BasketStats:
+    """Sum the stored counts over the day partitions in ``[desde, hasta]``.
+
+    Without a range the running totals are read instead of the partitions.
+    """
+    totales = _read_totals(store_dir) if desde is None and hasta is None else {}
+    if {"tickets", "items", "pares"} <= totales.keys():
+        tickets, items, pares = totales["tickets"], totales["items"], totales["pares"]
+        triples = totales.get("triples")
+    else:
+        tickets = _read_table(store_dir, "tickets", ["n_tickets"], desde, hasta)
+        items = _read_table(store_dir, "items", ["item", "count"], desde, hasta)
+        pares = _read_table(store_dir, "pares", ["item_a", "item_b", "count"], desde, hasta)
+        triples = _read_table(
+            store_dir, "triples", ["item_a", "item_b", "item_c", "count"], desde, hasta
+        )
+    if tickets is None or items is None or pares is None:
+        raise FileNotFoundError(f"No hay estadisticas de canasta en {store_dir}")
+    meta = _read_meta(store_dir)
+    if not meta.get("triples", triples is not None):
+        triples = None
+    return BasketStats(
+        n_tickets=int(tickets["n_tickets"].sum()),
+        items=_sum_counts(items, ["item"]),
+        pares=_sum_counts(pares, ["item_a", "item_b"]),
+        triples=_sum_counts(triples, ["item_a", "item_b", "item_c"]),
+        item_col=meta.get("item_col", "producto_id"),
+    )
+
+
+def rules_from_stats(
+    stats: BasketStats,
+    *,
+    min_support: float,
+    min_confidence: float = 0.0,
+    max_len: Optional[int] = None,
+) -> pd.DataFrame:
+    """Association rules derived from the counts.
+
+    Itemsets go up to ``max_len`` (default: ``stats.max_len``, 2 or 3).
+    Asking for longer itemsets than the store holds raises ``ValueError``,
+    since the rules would silently differ from mining the tickets.
+    """
+    if max_len is None:
+        max_len = stats.max_len
+    elif max_len > stats.max_len:
+        raise ValueError(
+            f"Las estadisticas de canasta cubren itemsets de hasta {stats.max_len} items "
+            f"(max_len={max_len})"
+        )
+    n = stats.n_tickets
+    if n == 0:
+        return pd.DataFrame(columns=RULE_COLUMNS)
+    min_count = min_support_count(min_support, n)
+
+    support_of: Dict[frozenset, float] = {
+        frozenset([item]): count / n
+        for item, count in zip(stats.items["item"], stats.items["count"])
+        if count >= min_count
+    }
+    if max_len >= 2:
+        pares = stats.pares[stats.pares["count"] >= min_count]
+        for a, b, count in pares[["item_a", "item_b", "count"]].itertuples(index=False):
+            support_of[frozenset([a, b])] = count / n
+    if max_len >= 3 and stats.triples is not None:
+        triples = stats.triples[stats.triples["count"] >= min_count]
+        for a, b, c, count in triples[["item_a", "item_b", "item_c", "count"]].itertuples(index=False):
+            support_of[frozenset([a, b, c])] = count / n
+
+    return rules_from_supports(support_of, min_confidence=min_confidence)
@@ -1,18 +1,157 @@
-"""Ticket-level clustering using KMeans and silhouette search."""
+"""Ticket-level clustering using MiniBatchKMeans and silhouette search.
+
+Each candidate k is fitted with ``MiniBatchKMeans`` in its own process and
+scored without the quadratic exact silhouette: either the exact silhouette
+on a sample stratified by cluster (``scoring="sampled"``) or the simplified
+silhouette over all tickets, which compares each ticket's distance to its
+own centroid with the distance to the nearest other centroid
+(``scoring="simplified"``, O(n * k)).
+
+The fitted scaler and centroids are persisted as versioned JSON models
+(``modelo_clusters/v0001.json``, ...). Later runs label tickets with a
+vectorized nearest-centroid step and only refit when the drift metrics of
+the recent tickets cross ``DRIFT_THRESHOLDS``; a refit maps its clusters onto
+the previous ones (Hungarian matching of centroids) so labels stay stable.
+
+``run_composition_clustering`` clusters tickets by basket composition
+instead: a sparse ticket x categoria spend-share matrix built straight from
+``detalle``, reduced with ``TruncatedSVD`` (which accepts the sparse matrix
+as is) and clustered with the same k search in the reduced space.
+"""
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+import json
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, Iterable, Optional
+from typing import Dict, Iterable, Optional, Tuple
 
 import numpy as np
 import pandas as pd
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
+from scipy import sparse
+from scipy.optimize import linear_sum_assignment
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.metrics import euclidean_distances, silhouette_score
 from sklearn.preprocessing import StandardScaler
 
 from src.utils.load_data import ensure_directory
+from src.utils.parallel import resolve_n_jobs
+
+
+SCORING_MODES = ("sampled", "simplified")
+SILHOUETTE_SAMPLE = 10_000
+BATCH_SIZE = 4096
+RANDOM_STATE = 42
+
+MODEL_DIR_NAME = "modelo_clusters"
+# Relative growth of the mean distance to the nearest centroid, and PSI of
+# the cluster shares, of the recent tickets against the training tickets.
+DRIFT_THRESHOLDS = {"distancia": 0.25, "psi": 0.20}
+COMPOSITION_COMPONENTS = 20
+
+
+@dataclass
+class ClusterModel:
+    """Scaler parameters and centroids (scaled space) of one fitted clustering."""
+
+    version: int
+    features: Tuple[str, ...]
+    mean: np.ndarray
+    scale: np.ndarray
+    centers: np.ndarray
+    labels: np.ndarray
+    silhouette: float
+    ref_distance: float
+    ref_shares: np.ndarray
+
+    def transform(self, features: pd.DataFrame) -> np.ndarray:
+        return (features[list(self.features)].to_numpy(dtype=float) - self.mean) / self.scale
+
+    def _nearest(self, scaled: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, one matrix product for all tickets.
+        squared = (
+            np.einsum("ij,ij->i", scaled, scaled)[:, None]
+            - 2.0 * scaled @ self.centers.T
+            + np.einsum("ij,ij->i", self.centers, self.centers)[None, :]
+        )
+        nearest = squared.argmin(axis=1)
+        distance = np.sqrt(np.maximum(squared[np.arange(len(nearest)), nearest], 0.0))
+        return nearest, distance
+
+    def assign(self, features: pd.DataFrame) -> np.ndarray:
+        """Cluster label of each row (nearest centroid)."""
+        nearest, _ = self._nearest(self.transform(features))
+        return self.labels[nearest]
+
+    def drift(self, features: pd.DataFrame) -> Dict[str, float]:
+        """Drift metrics of ``features`` against the tickets the model was fitted on."""
+        nearest, distance = self._nearest(self.transform(features))
+        if not len(nearest):
+            return {"distancia": 0.0, "psi": 0.0}
+        shares = np.bincount(nearest, minlength=len(self.centers)) / len(nearest)
+        expected = np.clip(self.ref_shares, 1e-6, None)
+        observed = np.clip(shares, 1e-6, None)
+        return {
+            "distancia": float(distance.mean() / self.ref_distance - 1.0) if self.ref_distance else 0.0,
+            "psi": float(np.sum((observed - expected) * np.log(observed / expected))),
+        }
+
+    @property
+    def centroids(self) -> pd.DataFrame:
+        """Centroids in the original feature units."""
+        centroids = pd.DataFrame(self.centers * self.scale + self.mean, columns=list(self.features))
+        centroids["cluster_ticket"] = self.labels
+        return centroids
+
+    def save(self, model_dir: Path) -> Path:
+        ensure_directory(model_dir)
+        path = model_dir / f"v{self.version:04d}.json"
+        payload = {
+            "version": self.version,
+            "features": list(self.features),
+            "mean": self.mean.tolist(),
+            "scale": self.scale.tolist(),
+            "centers": self.centers.tolist(),
+            "labels": self.labels.tolist(),
+            "silhouette": self.silhouette,
+            "ref_distance": self.ref_distance,
+            "ref_shares": self.ref_shares.tolist(),
+        }
+        path.write_text(json.dumps(payload), encoding="utf-8")
+        return path
+
+
+def load_cluster_model(model_dir: Path) -> Optional[ClusterModel]:
+    """Latest persisted model version, or ``None`` if there is none."""
+    versions = sorted(model_dir.glob("v*.json")) if model_dir.exists() else []
+    if not versions:
+        return None
+    payload = json.loads(versions[-1].read_text(encoding="utf-8"))
+    return ClusterModel(
+        version=int(payload["version"]),
+        features=tuple(payload["features"]),
+        mean=np.asarray(payload["mean"], dtype=float),
+        scale=np.asarray(payload["scale"], dtype=float),
+        centers=np.asarray(payload["centers"], dtype=float),
+        labels=np.asarray(payload["labels"], dtype=np.int64),
+        silhouette=float(payload["silhouette"]),
+        ref_distance=float(payload["ref_distance"]),
+        ref_shares=np.asarray(payload["ref_shares"], dtype=float),
+    )
+
+
+def _align_labels(previous: ClusterModel, centroids: np.ndarray) -> np.ndarray:
+    """Labels for new centroids (original units): matched ones inherit the previous label."""
+    anteriores = previous.centroids[list(previous.features)].to_numpy()
+    filas, columnas = linear_sum_assignment(euclidean_distances(centroids, anteriores))
+    labels = np.full(len(centroids), -1, dtype=np.int64)
+    labels[filas] = previous.labels[columnas]
+    libres = iter(sorted(set(range(len(centroids) + len(anteriores))) - set(labels[filas])))
+    for position in np.flatnonzero(labels < 0):
+        labels[position] = next(libres)
+    return labels
 
 
 @dataclass
@@ -21,6 +160,10 @@ class ClusteringResult:
     centroids: pd.DataFrame
     best_k: int
     silhouette: float
+    k_scores: Dict[int, float] = field(default_factory=dict)
+    model: Optional[ClusterModel] = None
+    refitted: bool = True
+    drift: Dict[str, float] = field(default_factory=dict)
 
 
 def _prepare_features(tickets: pd.DataFrame) -> pd.DataFrame:
@@ -34,26 +177,126 @@ def _prepare_features(tickets: pd.DataFrame) -> pd.DataFrame:
     ].fillna(0.0)
 
 
+def _stratified_sample(labels: np.ndarray, size: int, rng: np.random.Generator) -> np.ndarray:
+    """Row positions drawn per cluster in proportion to its size (at least 2 per cluster)."""
+    if len(labels) <= size:
+        return np.arange(len(labels))
+    clusters, counts = np.unique(labels, return_counts=True)
+    quotas = np.maximum(np.round(size * counts / len(labels)).astype(int), np.minimum(counts, 2))
+    return np.concatenate(
+        [
+            rng.choice(np.flatnonzero(labels == cluster), quota, replace=False)
+            for cluster, quota in zip(clusters, quotas)
+        ]
+    )
+
+
+def simplified_silhouette(data: np.ndarray, labels: np.ndarray, centers: np.ndarray) -> float:
+    """Mean of ``(b - a) / max(a, b)`` with centroid distances instead of pairwise ones."""
+    distances = euclidean_distances(data, centers)
+    rows = np.arange(len(labels))
+    own = distances[rows, labels].copy()
+    distances[rows, labels] = np.inf
+    nearest = distances.min(axis=1)
+    scale = np.maximum(own, nearest)
+    scores = np.divide(nearest - own, scale, out=np.zeros_like(own), where=scale > 0)
+    return float(scores.mean())
+
+
+def _score_k(
+    data: np.ndarray, k: int, scoring: str, sample_size: int
+) -> Tuple[int, Optional[float], MiniBatchKMeans]:
+    model = MiniBatchKMeans(
+        n_clusters=k, random_state=RANDOM_STATE, batch_size=BATCH_SIZE, n_init=3
+    )
+    labels = model.fit_predict(data)
+    if len(np.unique(labels)) < 2:
+        return k, None, model
+    if scoring == "simplified":
+        return k, simplified_silhouette(data, labels, model.cluster_centers_), model
+    sample = _stratified_sample(labels, sample_size, np.random.default_rng(RANDOM_STATE + k))
+    return k, float(silhouette_score(data[sample], labels[sample])), model
+
+
 def _find_best_k(
-    data: np.ndarray, k_candidates: Iterable[int]
-) -> tuple[int, float]:
+    data: np.ndarray,
+    k_candidates: Iterable[int],
+    *,
+    scoring: str = "sampled",
+    sample_size: int = SILHOUETTE_SAMPLE,
+    n_jobs: Optional[int] = -1,
+) -> tuple[int, float, Dict[int, float], Optional[MiniBatchKMeans]]:
+    """Best k by silhouette, the score of every candidate and the fitted best model."""
+    if scoring not in SCORING_MODES:
+        raise ValueError(f"Scoring desconocido: {scoring}. Opciones: {SCORING_MODES}")
+    candidates = [k for k in k_candidates if k < data.shape[0]]
+    workers = resolve_n_jobs(n_jobs, len(candidates))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_score_k, data, k, scoring, sample_size) for k in candidates
+            ]
+            resultados = [future.result() for future in futures]
+    else:
+        resultados = [_score_k(data, k, scoring, sample_size) for k in candidates]
+
     best_k = 0
     best_score = -1.0
-    for k in k_candidates:
-        if k >= data.shape[0]:
+    best_model = None
+    scores: Dict[int, float] = {}
+    for k, score, model in resultados:
+        if score is None:
             continue
-        model = KMeans(n_clusters=k, random_state=42, n_init="auto")
-        labels = model.fit_predict(data)
-        if len(set(labels)) < 2:
-            continue
-        score = silhouette_score(data, labels)
+        scores[k] = score
         if score > best_score:
             best_score = score
             best_k = k
+            best_model = model
     if best_k == 0:
         best_k = 3
         best_score = -1.0
-    return best_k, best_score
+    return best_k, best_score, scores, best_model
+
+
+def _fit_model(
+    features: pd.DataFrame,
+    k_values: Iterable[int],
+    *,
+    scoring: str,
+    sample_size: int,
+    n_jobs: Optional[int],
+    previous: Optional[ClusterModel],
+) -> Tuple[ClusterModel, Dict[int, float]]:
+    scaler = StandardScaler()
+    scaled = scaler.fit_transform(features)
+
+    best_k, best_score, scores, model = _find_best_k(
+        scaled, k_values, scoring=scoring, sample_size=sample_size, n_jobs=n_jobs
+    )
+    if model is None:
+        model = MiniBatchKMeans(
+            n_clusters=best_k, random_state=RANDOM_STATE, batch_size=BATCH_SIZE, n_init=3
+        ).fit(scaled)
+    centers = model.cluster_centers_
+    labels = np.arange(len(centers), dtype=np.int64)
+    if previous is not None:
+        labels = _align_labels(previous, scaler.inverse_transform(centers))
+
+    cluster_model = ClusterModel(
+        version=1 if previous is None else previous.version + 1,
+        features=tuple(features.columns),
+        mean=scaler.mean_,
+        scale=scaler.scale_,
+        centers=centers,
+        labels=labels,
+        silhouette=best_score,
+        ref_distance=0.0,
+        ref_shares=np.zeros(len(centers)),
+    )
+    nearest, distance = cluster_model._nearest(scaled)
+    cluster_model.ref_distance = float(distance.mean())
+    cluster_model.ref_shares = np.bincount(nearest, minlength=len(centers)) / len(nearest)
+    return cluster_model, scores
 
 
 def run_ticket_clustering(
@@ -61,25 +304,44 @@ def run_ticket_clustering(
     output_dir: Path,
     *,
     k_values: Optional[Iterable[int]] = None,
+    scoring: str = "sampled",
+    sample_size: int = SILHOUETTE_SAMPLE,
+    n_jobs: Optional[int] = -1,
+    model_dir: Optional[Path] = None,
+    recientes: Optional[pd.Series] = None,
+    refit: bool = False,
+    drift_thresholds: Optional[Dict[str, float]] = None,
 ) -> ClusteringResult:
+    """Label tickets with the persisted model, refitting only on drift (or ``refit``).
+
+    ``model_dir`` defaults to ``output_dir / MODEL_DIR_NAME``; drift is
+    measured on the ``recientes`` tickets (boolean mask, all tickets by
+    default).
+    """
     ensure_directory(output_dir)
     if k_values is None:
         k_values = range(3, 7)
+    model_dir = output_dir / MODEL_DIR_NAME if model_dir is None else model_dir
+    thresholds = DRIFT_THRESHOLDS if drift_thresholds is None else drift_thresholds
 
     features = _prepare_features(tickets)
-    scaler = StandardScaler()
-    scaled = scaler.fit_transform(features)
+    model = load_cluster_model(model_dir)
+    drift: Dict[str, float] = {}
+    if model is not None and not refit:
+        drift = model.drift(features if recientes is None else features[recientes.to_numpy()])
+        refit = any(drift[metric] > limit for metric, limit in thresholds.items())
 
-    best_k, best_score = _find_best_k(scaled, k_values)
-    model = KMeans(n_clusters=best_k, random_state=42, n_init="auto")
-    labels = model.fit_predict(scaled)
+    scores: Dict[int, float] = {}
+    refitted = model is None or refit
+    if refitted:
+        model, scores = _fit_model(
+            features, k_values, scoring=scoring, sample_size=sample_size, n_jobs=n_jobs, previous=model
+        )
+        model.save(model_dir)
 
     assignments = tickets.copy()
-    assignments["cluster_ticket"] = labels
-
-    centroids = pd.DataFrame(model.cluster_centers_, columns=features.columns)
-    centroids = pd.DataFrame(scaler.inverse_transform(centroids), columns=features.columns)
-    centroids["cluster_ticket"] = centroids.index
+    assignments["cluster_ticket"] = model.assign(features)
+    centroids = model.centroids
 
     assignments_path = output_dir / "clusters_tickets.parquet"
     centroids_path = output_dir / "clusters_tickets_centroides.parquet"
@@ -90,7 +352,128 @@ def run_ticket_clustering(
     return ClusteringResult(
         assignments=assignments,
         centroids=centroids,
+        best_k=len(model.centers),
+        silhouette=model.silhouette,
+        k_scores=scores,
+        model=model,
+        refitted=refitted,
+        drift=drift,
+    )
+
+
+@dataclass
+class CompositionClusteringResult:
+    assignments: pd.DataFrame
+    profiles: pd.DataFrame
+    best_k: int
+    silhouette: float
+    explained_variance: float
+    k_scores: Dict[int, float] = field(default_factory=dict)
+
+
+def category_share_matrix(
+    detalle: pd.DataFrame,
+    *,
+    ticket_col: str = "ticket_id",
+    category_col: str = "categoria",
+    value_col: str = "importe_total",
+) -> Tuple[sparse.csr_matrix, np.ndarray, np.ndarray]:
+    """Sparse ticket x category matrix of each category's share of the ticket spend.
+
+    Returns the matrix with its ticket ids (rows) and categories (columns).
+    Negative amounts (returns) count as zero; tickets without positive spend
+    keep an empty row.
+    """
+    ticket_codes, ticket_ids = pd.factorize(detalle[ticket_col])
+    if isinstance(detalle[category_col].dtype, pd.CategoricalDtype):
+        category_codes = detalle[category_col].cat.codes.to_numpy()
+        categorias = np.asarray(detalle[category_col].cat.categories, dtype=object)
+    else:
+        category_codes, categorias = pd.factorize(detalle[category_col])
+        categorias = np.asarray(categorias, dtype=object)
+
+    valid = (category_codes >= 0) & (ticket_codes >= 0)
+    gasto = np.clip(detalle[value_col].to_numpy(dtype=float)[valid], 0.0, None)
+    matrix = sparse.coo_matrix(
+        (gasto, (ticket_codes[valid], category_codes[valid])),
+        shape=(len(ticket_ids), len(categorias)),
+    ).tocsr()
+    matrix.sum_duplicates()
+    totals = np.asarray(matrix.sum(axis=1)).ravel()
+    inverse = np.divide(1.0, totals, out=np.zeros_like(totals), where=totals > 0)
+    matrix = sparse.diags(inverse) @ matrix
+    matrix.eliminate_zeros()
+    return matrix.tocsr(), np.asarray(ticket_ids), categorias
+
+
+def composition_profiles(
+    shares: sparse.csr_matrix, labels: np.ndarray, categorias: np.ndarray
+) -> pd.DataFrame:
+    """Mean category share of the tickets of each cluster (long format, largest first)."""
+    clusters, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    membership = sparse.csr_matrix(
+        (np.ones(len(labels)), (inverse, np.arange(len(labels)))),
+        shape=(len(clusters), len(labels)),
+    )
+    medias = np.asarray((membership @ shares).todense()) / counts[:, None]
+    profiles = pd.DataFrame(
+        {
+            "cluster_composicion": np.repeat(clusters, len(categorias)),
+            "tickets": np.repeat(counts, len(categorias)),
+            "categoria": np.tile(categorias, len(clusters)),
+            "participacion_media": medias.ravel(),
+        }
+    )
+    profiles = profiles[profiles["participacion_media"] > 0]
+    return profiles.sort_values(
+        ["cluster_composicion", "participacion_media"], ascending=[True, False], kind="mergesort"
+    ).reset_index(drop=True)
+
+
+def run_composition_clustering(
+    detalle: pd.DataFrame,
+    output_dir: Path,
+    *,
+    k_values: Optional[Iterable[int]] = None,
+    n_components: int = COMPOSITION_COMPONENTS,
+    scoring: str = "sampled",
+    sample_size: int = SILHOUETTE_SAMPLE,
+    n_jobs: Optional[int] = -1,
+) -> CompositionClusteringResult:
+    """Cluster tickets by category spend shares (sparse matrix -> TruncatedSVD -> k search).
+
+    Exports ``clusters_composicion.parquet`` (ticket_id, cluster_composicion)
+    and ``clusters_composicion_perfil.parquet`` (mean category shares).
+    """
+    ensure_directory(output_dir)
+    if k_values is None:
+        k_values = range(3, 9)
+
+    shares, ticket_ids, categorias = category_share_matrix(detalle)
+    components = max(1, min(n_components, len(categorias) - 1))
+    svd = TruncatedSVD(n_components=components, random_state=RANDOM_STATE)
+    reduced = svd.fit_transform(shares)
+
+    best_k, best_score, scores, model = _find_best_k(
+        reduced, k_values, scoring=scoring, sample_size=sample_size, n_jobs=n_jobs
+    )
+    if model is None:
+        model = MiniBatchKMeans(
+            n_clusters=best_k, random_state=RANDOM_STATE, batch_size=BATCH_SIZE, n_init=3
+        ).fit(reduced)
+    labels = model.predict(reduced)
+
+    assignments = pd.DataFrame({"ticket_id": ticket_ids, "cluster_composicion": labels})
+    profiles = composition_profiles(shares, labels, categorias)
+
+    assignments.to_parquet(output_dir / "clusters_composicion.parquet", index=False)
+    profiles.to_parquet(output_dir / "clusters_composicion_perfil.parquet", index=False)
+
+    return CompositionClusteringResult(
+        assignments=assignments,
+        profiles=profiles,
         best_k=best_k,
         silhouette=best_score,
+        explained_variance=float(svd.explained_variance_ratio_.sum()),
+        k_scores=scores,
     )
-
@@ -0,0 +1,438 @@
+"""Sparse frequent-itemset mining (Eclat over packed ticket bitsets).
+
+Replaces the dense ``TransactionEncoder`` + ``apriori`` combination: the
+ticket x item incidence is kept as a CSR matrix and every frequent item is
+stored as a bitset over tickets (one bit per ticket, packed in ``uint64``
+words). Supports are popcounts of bitset intersections, so all tickets and
+all SKUs can be mined without sampling. ``closed`` and ``maximal`` modes
+keep only the condensed itemsets, from which non-redundant rules are
+derived, so low support thresholds stay tractable.
+
+The outputs follow the mlxtend layouts (``support``/``itemsets`` for
+itemsets and the usual 14 columns for rules), so downstream code is
+unchanged.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+RULE_COLUMNS = [
+    "antecedents",
+    "consequents",
+    "antecedent support",
+    "consequent support",
+    "support",
+    "confidence",
+    "lift",
+    "representativity",
+    "leverage",
+    "conviction",
+    "zhangs_metric",
+    "jaccard",
+    "certainty",
+    "kulczynski",
+]
+
+
+@dataclass
+class Transactions:
+    """Ticket x item incidence matrix (one row per ticket, boolean CSR)."""
+
+    matrix: sparse.csr_matrix
+    items: np.ndarray
+    ticket_ids: np.ndarray
+
+    @property
+    def n_transactions(self) -> int:
+        return self.matrix.shape[0]
+
+
+def encode_transactions(
+    detalle: pd.DataFrame,
+    *,
+    item_col: str = "descripcion",
+    ticket_col: str = "ticket_id",
+    min_items: int = 2,
+) -> Transactions:
+    """Build the sparse ticket x item matrix from detalle lines.
+
+    Repeated items in a ticket count once. Tickets with fewer than
+    ``min_items`` distinct items are dropped (they cannot contain a pair).
+    """
+    ticket_codes, ticket_ids = pd.factorize(detalle[ticket_col])
+    if isinstance(detalle[item_col].dtype, pd.CategoricalDtype):
+        item_codes = detalle[item_col].cat.codes.to_numpy()
+        items = np.asarray(detalle[item_col].cat.categories, dtype=object)
+    else:
+        item_codes, items = pd.factorize(detalle[item_col])
+        items = np.asarray(items, dtype=object)
+
+    valid = (item_codes >= 0) & (ticket_codes >= 0)
+    matrix = sparse.coo_matrix(
+        (
+            np.ones(int(valid.sum()), dtype=np.int32),
+            (ticket_codes[valid], item_codes[valid]),
+        ),
+        shape=(len(ticket_ids), len(items)),
+    ).tocsr()
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    matrix = matrix.astype(bool)
+
+    keep_rows = np.diff(matrix.indptr) >= min_items
+    matrix = matrix[keep_rows]
+    used_items = np.flatnonzero(np.diff(matrix.tocsc().indptr) > 0)
+    return Transactions(
+        matrix=matrix[:, used_items].tocsr(),
+        items=items[used_items],
+        ticket_ids=np.asarray(ticket_ids)[keep_rows],
+    )
+
+
+if hasattr(np, "bitwise_count"):
+
+    def popcount(words: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+
+else:  # numpy < 2.0
+    _POPCOUNT_TABLE = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+    def popcount(words: np.ndarray) -> np.ndarray:
+        table = _POPCOUNT_TABLE[np.ascontiguousarray(words).view(np.uint8)]
+        return table.sum(axis=-1, dtype=np.int64)
+
+
+def min_support_count(min_support: float, n_transactions: int) -> int:
+    """Smallest ticket count whose support reaches ``min_support``."""
+    return max(int(np.ceil(min_support * n_transactions - 1e-9)), 1)
+
+
+def pack_bitsets(matrix: sparse.spmatrix, columns: np.ndarray) -> np.ndarray:
+    """Pack the given item columns into ``(len(columns), n_words)`` uint64 bitsets."""
+    csc = sparse.csc_matrix(matrix[:, columns])
+    n_words = max((matrix.shape[0] + 63) // 64, 1)
+    owners = np.repeat(np.arange(len(columns)), np.diff(csc.indptr))
+    rows = csc.indices.astype(np.int64)
+    packed = np.zeros((len(columns), n_words), dtype=np.uint64)
+    np.bitwise_or.at(
+        packed, (owners, rows >> 6), np.left_shift(np.uint64(1), (rows & 63).astype(np.uint64))
+    )
+    return packed
+
+
+ITEMSET_MODES = ("all", "closed", "maximal")
+
+
+def _eclat(
+    bitsets: np.ndarray,
+    counts: np.ndarray,
+    min_count: int,
+    max_len: Optional[int],
+    mode: str = "all",
+) -> List[Tuple[Tuple[int, ...], int]]:
+    """Depth-first Eclat; returns (item positions, support count) pairs.
+
+    Each node intersects its tidset with the tidsets of all remaining
+    candidate items in one vectorized ``&`` + popcount.
+    """
+    if mode != "all":
+        return _eclat_condensed(bitsets, counts, min_count, max_len, mode)
+    found: List[Tuple[Tuple[int, ...], int]] = []
+    n_items = len(counts)
+    stack = [
+        ((item,), bitsets[item], int(counts[item]), np.arange(item + 1, n_items))
+        for item in reversed(range(n_items))
+    ]
+    while stack:
+        prefix, tids, support, candidates = stack.pop()
+        found.append((prefix, support))
+        if (max_len is not None and len(prefix) >= max_len) or not candidates.size:
+            continue
+        intersections = bitsets[candidates] & tids
+        supports = popcount(intersections)
+
+        frequent = supports >= min_count
+        extensions = candidates[frequent]
+        intersections = intersections[frequent]
+        supports = supports[frequent]
+        for position in reversed(range(len(extensions))):
+            stack.append(
+                (
+                    prefix + (int(extensions[position]),),
+                    intersections[position],
+                    int(supports[position]),
+                    extensions[position + 1:],
+                )
+            )
+    return found
+
+
+def _eclat_condensed(
+    bitsets: np.ndarray,
+    counts: np.ndarray,
+    min_count: int,
+    max_len: Optional[int],
+    mode: str,
+) -> List[Tuple[Tuple[int, ...], int]]:
+    """Closed or maximal itemsets by depth-first search with closure jumps.
+
+    Every node carries the pool of items, before or after it in the item
+    order, that are frequent together with its parent, so one ``&`` +
+    popcount over the pool gives its extensions and its closure (the items
+    whose tidset contains the node's tidset). Without ``max_len`` the
+    closure is merged into the node instead of being branched on, and a
+    node whose closure adds an item earlier than the one that created it is
+    pruned before descending: that closed set is reached from an earlier
+    branch (LCM prefix-preserving extension). Each closed itemset is
+    visited once; the maximal ones are those with no frequent extension.
+
+    With ``max_len`` the lattice is truncated: every itemset of length
+    ``max_len`` is kept, so all frequent itemsets up to it are visited and
+    the pool only serves the closed/maximal checks of the shorter ones.
+    """
+    found: List[Tuple[Tuple[int, ...], int]] = []
+    n_items = len(counts)
+    todos = np.arange(n_items)
+    stack = [
+        ((item,), item, bitsets[item], int(counts[item]), np.delete(todos, item))
+        for item in reversed(range(n_items))
+    ]
+    while stack:
+        prefix, core, tids, support, pool = stack.pop()
+        if max_len is not None and len(prefix) >= max_len:
+            found.append((prefix, support))
+            continue
+        intersections = bitsets[pool] & tids
+        supports = popcount(intersections)
+        closure = supports == support
+        extension = supports >= min_count
+
+        if max_len is None:
+            if (pool[closure] < core).any():
+                continue
+            prefix = tuple(sorted(prefix + tuple(int(item) for item in pool[closure])))
+            extension &= ~closure
+            cerrado = True
+        else:
+            cerrado = not closure.any()
+
+        if not extension.any() or (mode == "closed" and cerrado):
+            found.append((prefix, support))
+
+        pool = pool[extension]
+        intersections = intersections[extension]
+        supports = supports[extension]
+        later = np.flatnonzero(pool > core)
+        if mode == "maximal" and max_len is None and later.size > 1:
+            # Every itemset below this node is a subset of prefix + all later
+            # extensions; if that union is frequent it is the only candidate.
+            union = np.bitwise_and.reduce(intersections[later], axis=0)
+            union_support = int(popcount(union))
+            if union_support >= min_count:
+                stack.append(
+                    (
+                        prefix + tuple(int(item) for item in pool[later]),
+                        int(pool[later[-1]]),
+                        union,
+                        union_support,
+                        np.delete(pool, later),
+                    )
+                )
+                continue
+        for position in reversed(later):
+            stack.append(
+                (
+                    prefix + (int(pool[position]),),
+                    int(pool[position]),
+                    intersections[position],
+                    int(supports[position]),
+                    np.delete(pool, position),
+                )
+            )
+    return found
+
+
+def frequent_itemsets(
+    transactions: Transactions,
+    *,
+    min_support: float,
+    max_len: Optional[int] = None,
+    mode: str = "all",
+) -> pd.DataFrame:
+    """Mine all itemsets with support >= ``min_support`` (mlxtend ``apriori`` layout).
+
+    ``mode="closed"`` keeps only itemsets with no superset of equal support
+    and ``mode="maximal"`` only those with no frequent superset; the
+    remaining itemsets are never materialized.
+    """
+    if mode not in ITEMSET_MODES:
+        raise ValueError(f"Modo de itemsets desconocido: {mode}. Opciones: {ITEMSET_MODES}")
+    n = transactions.n_transactions
+    if n == 0:
+        return pd.DataFrame(columns=["support", "itemsets"])
+    min_count = min_support_count(min_support, n)
+
+    counts = np.diff(transactions.matrix.tocsc().indptr)
+    frequent_items = np.flatnonzero(counts >= min_count)
+    # Ascending support keeps the intermediate tidsets small.
+    frequent_items = frequent_items[np.argsort(counts[frequent_items], kind="stable")]
+    if not frequent_items.size:
+        return pd.DataFrame(columns=["support", "itemsets"])
+
+    bitsets = pack_bitsets(transactions.matrix, frequent_items)
+    found = _eclat(bitsets, counts[frequent_items], min_count, max_len, mode)
+
+    labels = transactions.items[frequent_items]
+    itemsets = [frozenset(labels[list(positions)]) for positions, _ in found]
+    result = pd.DataFrame(
+        {
+            "support": np.array([count for _, count in found], dtype=float) / n,
+            "itemsets": itemsets,
+        }
+    )
+    length = np.fromiter((len(positions) for positions, _ in found), dtype=np.int64, count=len(found))
+    return result.iloc[np.argsort(length, kind="stable")].reset_index(drop=True)
+
+
+def association_rules(itemsets: pd.DataFrame, *, min_confidence: float = 0.0) -> pd.DataFrame:
+    """Rules A -> C from a frequent-itemset table, with the mlxtend metric columns."""
+    return rules_from_supports(
+        dict(zip(itemsets["itemsets"], itemsets["support"])), min_confidence=min_confidence
+    )
+
+
+def rules_from_supports(
+    support_of: Dict[frozenset, float], *, min_confidence: float = 0.0
+) -> pd.DataFrame:
+    """Rules A -> C from an ``itemset -> support`` mapping.
+
+    Every non-empty proper subset of an itemset is tried as antecedent; the
+    mapping must be downward closed (it is for frequent itemsets), so all
+    supports come from it.
+    """
+    antecedents, consequents, s_ac, s_a, s_c = [], [], [], [], []
+    for itemset, support in support_of.items():
+        for size in range(len(itemset) - 1, 0, -1):
+            for combo in combinations(itemset, size):
+                antecedent = frozenset(combo)
+                support_a = support_of[antecedent]
+                if support / support_a < min_confidence:
+                    continue
+                consequent = itemset - antecedent
+                antecedents.append(antecedent)
+                consequents.append(consequent)
+                s_ac.append(support)
+                s_a.append(support_a)
+                s_c.append(support_of[consequent])
+
+    if not antecedents:
+        return pd.DataFrame(columns=RULE_COLUMNS)
+    return rule_metrics(antecedents, consequents, np.array(s_ac), np.array(s_a), np.array(s_c))
+
+
+def nonredundant_rules(
+    transactions: Transactions, itemsets: pd.DataFrame, *, min_confidence: float = 0.0
+) -> pd.DataFrame:
+    """Rules A -> Z \\ A from condensed (closed or maximal) itemsets Z.
+
+    Subsets of a condensed itemset are not in the table, so their supports
+    are popcounts of the intersected item bitsets. A rule is redundant, and
+    dropped, when a smaller antecedent A' of the same Z has the same support
+    (then A' -> Z \\ A' has the same support and confidence and a larger
+    consequent).
+    """
+    n = transactions.n_transactions
+    condensed = [itemset for itemset in itemsets["itemsets"] if len(itemset) > 1]
+    if n == 0 or not condensed:
+        return pd.DataFrame(columns=RULE_COLUMNS)
+
+    column_of = {label: column for column, label in enumerate(transactions.items)}
+    involved = np.array(sorted({column_of[item] for itemset in condensed for item in itemset}))
+    row_of = {transactions.items[column]: row for row, column in enumerate(involved)}
+    bitsets = pack_bitsets(transactions.matrix, involved)
+    cache: Dict[frozenset, int] = {}
+
+    def count_of(itemset: frozenset) -> int:
+        count = cache.get(itemset)
+        if count is None:
+            tids = np.bitwise_and.reduce(bitsets[[row_of[item] for item in itemset]], axis=0)
+            count = cache[itemset] = int(popcount(tids))
+        return count
+
+    antecedents, consequents, c_ac, c_a, c_c = [], [], [], [], []
+    for itemset in condensed:
+        count = count_of(itemset)
+        minimal: Dict[int, List[frozenset]] = {}
+        for size in range(1, len(itemset)):
+            for combo in combinations(itemset, size):
+                antecedent = frozenset(combo)
+                count_a = count_of(antecedent)
+                if count / count_a < min_confidence:
+                    continue
+                kept = minimal.setdefault(count_a, [])
+                if any(previous < antecedent for previous in kept):
+                    continue
+                kept.append(antecedent)
+                consequent = itemset - antecedent
+                antecedents.append(antecedent)
+                consequents.append(consequent)
+                c_ac.append(count)
+                c_a.append(count_a)
+                c_c.append(count_of(consequent))
+
+    if not antecedents:
+        return pd.DataFrame(columns=RULE_COLUMNS)
+    return rule_metrics(
+        antecedents,
+        consequents,
+        np.array(c_ac, dtype=float) / n,
+        np.array(c_a, dtype=float) / n,
+        np.array(c_c, dtype=float) / n,
+    )
+
+
+def rule_metrics(
+    antecedents: list,
+    consequents: list,
+    s_ac: np.ndarray,
+    s_a: np.ndarray,
+    s_c: np.ndarray,
+) -> pd.DataFrame:
+    """Assemble the rule table from (rule, A u C, A, C) supports."""
+    confidence = s_ac / s_a
+    leverage = s_ac - s_a * s_c
+    conviction = np.full(len(confidence), np.inf)
+    below_one = confidence < 1.0
+    conviction[below_one] = (1.0 - s_c[below_one]) / (1.0 - confidence[below_one])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        zhang_den = np.maximum(s_ac * (1 - s_a), s_a * (s_c - s_ac))
+        zhangs = np.where(zhang_den == 0, 0, leverage / zhang_den)
+        certainty = np.where(1 - s_c == 0, 0, (confidence - s_c) / (1 - s_c))
+
+    return pd.DataFrame(
+        {
+            "antecedents": antecedents,
+            "consequents": consequents,
+            "antecedent support": s_a,
+            "consequent support": s_c,
+            "support": s_ac,
+            "confidence": confidence,
+            "lift": confidence / s_c,
+            "representativity": 1.0,
+            "leverage": leverage,
+            "conviction": conviction,
+            "zhangs_metric": zhangs,
+            "jaccard": s_ac / (s_a + s_c - s_ac),
+            "certainty": certainty,
+            "kulczynski": (s_ac / s_a + s_ac / s_c) / 2,
+        },
+        columns=RULE_COLUMNS,
+    )
@@ -8,6 +8,7 @@ from typing import Dict
 import numpy as np
 import pandas as pd
 
+from src.data_prep.cubo_ventas import rollup_cubo
 from src.utils.load_data import ensure_directory
 
 
@@ -26,7 +27,7 @@ def build_kpi_dia(ventas_diarias: pd.DataFrame) -> pd.DataFrame:
 
 def build_kpi_tipo_dia(kpi_dia: pd.DataFrame) -> pd.DataFrame:
     grouped = (
-        kpi_dia.groupby("tipo_dia")
+        kpi_dia.groupby("tipo_dia", observed=True)
         .agg(
             ventas_totales=("ventas_totales", "sum"),
             margen_total=("margen_total", "sum"),
@@ -41,17 +42,9 @@ def build_kpi_tipo_dia(kpi_dia: pd.DataFrame) -> pd.DataFrame:
     return grouped
 
 
-def build_kpi_categoria(detalle: pd.DataFrame) -> pd.DataFrame:
-    grouped = (
-        detalle.groupby(["anio", "mes", "categoria", "tipo_dia"])
-        .agg(
-            ventas_totales=("importe_total", "sum"),
-            margen_total=("margen_linea", "sum"),
-            unidades_totales=("cantidad", "sum"),
-            tickets=("ticket_id", "nunique"),
-        )
-        .reset_index()
-    )
+def build_kpi_categoria(cubo: pd.DataFrame) -> pd.DataFrame:
+    """Monthly category KPIs rolled up from the sales cube (``src.data_prep.cubo_ventas``)."""
+    grouped = rollup_cubo(cubo, ["anio", "mes", "categoria", "tipo_dia"])
     grouped["ticket_promedio"] = _safe_ratio(grouped["ventas_totales"], grouped["tickets"])
     grouped["upt"] = _safe_ratio(grouped["unidades_totales"], grouped["tickets"])
     grouped["margen_pct"] = _safe_ratio(grouped["margen_total"], grouped["ventas_totales"])
@@ -60,7 +53,7 @@ def build_kpi_categoria(detalle: pd.DataFrame) -> pd.DataFrame:
 
 def build_kpi_medio_pago(tickets: pd.DataFrame) -> pd.DataFrame:
     grouped = (
-        tickets.groupby(["tipo_medio_pago", "anio", "mes"])
+        tickets.groupby(["tipo_medio_pago", "anio", "mes"], observed=True)
         .agg(
             ventas_totales=("ventas_totales", "sum"),
             margen_total=("margen_total", "sum"),
@@ -2,106 +2,345 @@
 
 from __future__ import annotations
 
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Iterable, Optional
 
 import numpy as np
 import pandas as pd
-from mlxtend.frequent_patterns import apriori, association_rules
-from mlxtend.preprocessing import TransactionEncoder
 
+from src.data_prep.calendario import franja_horaria
+from src.data_prep.productos import build_dim_producto, describe_itemset, product_names
+from src.features.basket_stats import BasketStats, rules_from_stats
+from src.features.partitioned_mining import month_shards, partitioned_frequent_itemsets
+from src.features.itemsets import (
+    RULE_COLUMNS,
+    Transactions,
+    association_rules,
+    encode_transactions,
+    frequent_itemsets,
+    nonredundant_rules,
+)
 from src.utils.load_data import ensure_directory
+from src.utils.parallel import resolve_n_jobs
 
 
-def _select_relevant_products(detalle: pd.DataFrame) -> pd.DataFrame:
-    """Reduce dimensionality keeping high-impact products."""
-    detalle = detalle.copy()
-    detalle["descripcion"] = detalle["descripcion"].str.upper()
+def _join_items(items) -> str:
+    return ", ".join(sorted(items))
 
-    keywords = ["COCA", "FERNET", "VINO", "CARNE"]
-    mask_keywords = detalle["descripcion"].str.contains("|".join(keywords), na=False)
-    productos_keywords = detalle[mask_keywords]["producto_id"].unique().tolist()
 
-    top_por_importe = (
-        detalle.groupby("producto_id")["importe_total"].sum().nlargest(200).index.tolist()
+def _format_itemsets(itemsets: pd.Series, format_itemset) -> pd.Series:
+    """Apply ``format_itemset`` once per distinct itemset (they repeat across rules)."""
+    codes, unicos = pd.factorize(itemsets)
+    formateados = np.empty(len(unicos), dtype=object)
+    formateados[:] = [format_itemset(itemset) for itemset in unicos]
+    return pd.Series(formateados[codes], index=itemsets.index)
+
+
+def decorate_rules(rules: pd.DataFrame, productos: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Export layout of a rules table: itemsets as joined strings.
+
+    With a product dimension (rules mined on ``producto_id``) the
+    ``antecedents``/``consequents`` columns carry the product names and the
+    sorted code lists are kept in ``antecedents_ids``/``consequents_ids``,
+    so two SKUs sharing a name remain different items.
+    """
+    decorated = rules.copy()
+    if productos is None:
+        for column in ("antecedents", "consequents"):
+            decorated[column] = _format_itemsets(rules[column], _join_items)
+        return decorated
+    nombres = product_names(productos)
+    for column in ("antecedents", "consequents"):
+        decorated[column] = _format_itemsets(
+            rules[column], lambda items: describe_itemset(items, nombres)
+        )
+        decorated[f"{column}_ids"] = _format_itemsets(rules[column], sorted)
+    return decorated
+
+
+SEGMENT_DIMENSIONS = ("tipo_dia", "cluster_ticket", "franja_horaria", "tipo_medio_pago")
+
+
+def mine_rules(
+    transactions: Transactions,
+    *,
+    min_support: float,
+    min_confidence: float,
+    max_len: Optional[int] = None,
+    itemset_mode: str = "all",
+) -> pd.DataFrame:
+    """Frequent itemsets + rules for one set of transactions.
+
+    With ``itemset_mode`` ``closed`` or ``maximal`` only the condensed
+    itemsets are mined and the rules are the non-redundant ones derived
+    from them (see ``src.features.itemsets.nonredundant_rules``).
+    """
+    if transactions.n_transactions == 0:
+        return pd.DataFrame(columns=RULE_COLUMNS)
+    itemsets = frequent_itemsets(
+        transactions, min_support=min_support, max_len=max_len, mode=itemset_mode
     )
+    if itemsets.empty:
+        return pd.DataFrame(columns=RULE_COLUMNS)
+    if itemset_mode != "all":
+        return nonredundant_rules(transactions, itemsets, min_confidence=min_confidence)
+    return association_rules(itemsets, min_confidence=min_confidence)
 
-    productos_clave = list(set(productos_keywords + top_por_importe))
-    if not productos_clave:
-        productos_clave = top_por_importe
-    return detalle[detalle["producto_id"].isin(productos_clave)].copy()
 
+def build_ticket_segments(
+    detalle: pd.DataFrame, tickets: Optional[pd.DataFrame] = None
+) -> pd.DataFrame:
+    """One row per ticket with the segmentation attributes used for basket mining.
 
-def run_market_basket(
+    ``tipo_dia`` and ``franja_horaria`` come from the first line of each
+    ticket; ``tipo_medio_pago`` and ``cluster_ticket`` are taken from
+    ``tickets`` (e.g. the clustering assignments) when available.
+    """
+    primeras = detalle.drop_duplicates("ticket_id").set_index("ticket_id")
+    segmentos = pd.DataFrame(index=primeras.index)
+    if "tipo_dia" in primeras.columns:
+        segmentos["tipo_dia"] = primeras["tipo_dia"]
+    if "hora" in primeras.columns:
+        segmentos["franja_horaria"] = franja_horaria(primeras["hora"])
+    if "tipo_medio_pago" in primeras.columns:
+        segmentos["tipo_medio_pago"] = primeras["tipo_medio_pago"]
+    if tickets is not None:
+        por_ticket = tickets.set_index("ticket_id")
+        for column in ("tipo_medio_pago", "cluster_ticket"):
+            if column in por_ticket.columns:
+                segmentos[column] = por_ticket[column].reindex(segmentos.index)
+    return segmentos
+
+
+def _segment_subset(transactions: Transactions, rows: np.ndarray) -> Transactions:
+    return Transactions(
+        matrix=transactions.matrix[rows],
+        items=transactions.items,
+        ticket_ids=transactions.ticket_ids[rows],
+    )
+
+
+def mine_segmented_rules(
+    transactions: Transactions,
+    segments: pd.DataFrame,
+    *,
+    dimensions: Iterable[str] = SEGMENT_DIMENSIONS,
+    min_support: float = 0.005,
+    min_confidence: float = 0.15,
+    min_lift: float = 1.0,
+    max_len: Optional[int] = None,
+    include_global: bool = True,
+    n_jobs: Optional[int] = 1,
+    itemset_mode: str = "all",
+) -> pd.DataFrame:
+    """Mine rules per segment value from row subsets of one encoded basket matrix.
+
+    ``segments`` is indexed by ticket_id (see ``build_ticket_segments``).
+    Each (dimension, value) pair mines the CSR rows of its tickets, so the
+    baskets are encoded only once; supports are relative to the segment's
+    own tickets. ``n_jobs`` > 1 mines the segments in a process pool.
+    Returns one rules table with ``segmento``/``valor_segmento`` columns
+    (``global``/``TODOS`` for the unsegmented rules).
+    """
+    alineados = segments.reindex(transactions.ticket_ids)
+    tareas = []
+    if include_global:
+        tareas.append(("global", "TODOS", np.arange(transactions.n_transactions)))
+    for dimension in dimensions:
+        if dimension not in alineados.columns:
+            continue
+        codes, valores = pd.factorize(alineados[dimension], sort=True)
+        for code, valor in enumerate(valores):
+            tareas.append((dimension, str(valor), np.flatnonzero(codes == code)))
+
+    options = {
+        "min_support": min_support,
+        "min_confidence": min_confidence,
+        "max_len": max_len,
+        "itemset_mode": itemset_mode,
+    }
+    workers = resolve_n_jobs(n_jobs, len(tareas))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(mine_rules, _segment_subset(transactions, rows), **options)
+                for _, _, rows in tareas
+            ]
+            resultados = [future.result() for future in futures]
+    else:
+        resultados = [
+            mine_rules(_segment_subset(transactions, rows), **options) for _, _, rows in tareas
+        ]
+
+    tablas = []
+    for (dimension, valor, rows), rules in zip(tareas, resultados):
+        rules = rules[rules["lift"] >= min_lift]
+        if rules.empty:
+            continue
+        rules = rules.sort_values("lift", ascending=False, kind="mergesort")
+        rules.insert(0, "segmento", dimension)
+        rules.insert(1, "valor_segmento", valor)
+        rules.insert(2, "tickets_segmento", len(rows))
+        tablas.append(rules)
+    if not tablas:
+        return pd.DataFrame(columns=["segmento", "valor_segmento", "tickets_segmento", *RULE_COLUMNS])
+    return pd.concat(tablas, ignore_index=True)
+
+
+def run_segmented_market_basket(
     detalle: pd.DataFrame,
     output_dir: Path,
     *,
+    tickets: Optional[pd.DataFrame] = None,
+    dimensions: Iterable[str] = SEGMENT_DIMENSIONS,
     min_support: float = 0.005,
     min_confidence: float = 0.15,
     min_lift: float = 1.0,
-    sample_tickets: int = 25000,
+    item_col: str = "producto_id",
+    max_len: Optional[int] = None,
+    n_jobs: Optional[int] = 1,
+    productos: Optional[pd.DataFrame] = None,
+    itemset_mode: str = "all",
 ) -> Dict[str, Path]:
+    """Export ``reglas_segmentadas.parquet`` (global + one block per segment value)."""
     ensure_directory(output_dir)
-    filtered = _select_relevant_products(detalle)
-
-    tickets = filtered.groupby("ticket_id")["producto_id"].nunique()
-    tickets_validos = tickets[tickets >= 2].index
-    if tickets_validos.empty:
+    if productos is None and item_col == "producto_id":
+        productos = build_dim_producto(detalle)
+    rules = mine_segmented_rules(
+        encode_transactions(detalle, item_col=item_col),
+        build_ticket_segments(detalle, tickets),
+        dimensions=dimensions,
+        min_support=min_support,
+        min_confidence=min_confidence,
+        min_lift=min_lift,
+        max_len=max_len,
+        n_jobs=n_jobs,
+        itemset_mode=itemset_mode,
+    )
+    if rules.empty:
         return {}
+    path = output_dir / "reglas_segmentadas.parquet"
+    decorate_rules(rules, productos).to_parquet(path, index=False)
+    return {"reglas_segmentadas": path}
 
-    rng = np.random.default_rng(seed=42)
-    if len(tickets_validos) > sample_tickets:
-        sample_ids = rng.choice(tickets_validos, size=sample_tickets, replace=False)
-    else:
-        sample_ids = tickets_validos
 
-    df_sample = filtered[filtered["ticket_id"].isin(sample_ids)]
-    transacciones = df_sample.groupby("ticket_id")["descripcion"].apply(list).tolist()
-    if not transacciones:
-        return {}
+def run_market_basket(
+    detalle: pd.DataFrame,
+    output_dir: Path,
+    *,
+    min_support: float = 0.005,
+    min_confidence: float = 0.15,
+    min_lift: float = 1.0,
+    item_col: str = "producto_id",
+    max_len: Optional[int] = None,
+    stats: Optional[BasketStats] = None,
+    productos: Optional[pd.DataFrame] = None,
+    itemset_mode: str = "all",
+    partitioned: bool = False,
+    n_jobs: Optional[int] = 1,
+) -> Dict[str, Path]:
+    """Mine association rules over every ticket with at least two items.
 
-    encoder = TransactionEncoder()
-    encoded = encoder.fit(transacciones).transform(transacciones)
-    basket_matrix = pd.DataFrame(encoded, columns=encoder.columns_)
+    Uses the sparse Eclat engine in ``src.features.itemsets``: no ticket
+    sampling and no product pre-selection, so the rules are reproducible
+    from run to run. When ``stats`` (see ``src.features.basket_stats``) is
+    given and covers the request (same ``item_col`` and a ``max_len`` no
+    longer than the stored itemsets, 2 or 3), the rules are derived from the
+    persisted co-occurrence counts instead without scanning ``detalle``,
+    which is then only used for combo prices and margins. Otherwise (e.g.
+    ``max_len=None``) the tickets are mined as usual.
 
-    frequent_itemsets = apriori(basket_matrix, min_support=min_support, use_colnames=True)
-    if frequent_itemsets.empty:
-        return {}
+    Items are ``producto_id`` codes by default; the exported tables are
+    decorated with names from ``productos`` (built from ``detalle`` when
+    not given, see ``src.data_prep.productos``).
+
+    ``itemset_mode`` ``closed``/``maximal`` mines condensed itemsets and
+    keeps only non-redundant rules, which bounds the table at low
+    ``min_support``; it needs the tickets, so ``stats`` is then ignored.
+
+    ``partitioned`` mines each month in its own process (``n_jobs``) and
+    counts the union of the monthly itemsets over the full history (see
+    ``src.features.partitioned_mining``); the rules are the same as in a
+    single pass.
+    """
+    ensure_directory(output_dir)
+    if productos is None and item_col == "producto_id":
+        productos = build_dim_producto(detalle)
 
-    rules = association_rules(
-        frequent_itemsets, metric="confidence", min_threshold=min_confidence
+    if partitioned and itemset_mode != "all":
+        raise ValueError("El modo particionado solo admite itemset_mode='all'")
+    usar_stats = (
+        stats is not None
+        and itemset_mode == "all"
+        and not partitioned
+        and stats.item_col == item_col
+        and max_len is not None
+        and max_len <= stats.max_len
     )
-    rules = rules[rules["lift"] >= min_lift].sort_values("lift", ascending=False)
+    if usar_stats:
+        rules = rules_from_stats(
+            stats, min_support=min_support, min_confidence=min_confidence, max_len=max_len
+        )
+    elif partitioned:
+        itemsets = partitioned_frequent_itemsets(
+            month_shards(detalle, item_col=item_col),
+            min_support=min_support,
+            max_len=max_len,
+            n_jobs=n_jobs,
+        )
+        rules = (
+            association_rules(itemsets, min_confidence=min_confidence)
+            if not itemsets.empty
+            else pd.DataFrame(columns=RULE_COLUMNS)
+        )
+    else:
+        rules = mine_rules(
+            encode_transactions(detalle, item_col=item_col),
+            min_support=min_support,
+            min_confidence=min_confidence,
+            max_len=max_len,
+            itemset_mode=itemset_mode,
+        )
+
+    rules = rules[rules["lift"] >= min_lift].sort_values("lift", ascending=False, kind="mergesort")
     if rules.empty:
         return {}
 
     export_paths: Dict[str, Path] = {}
 
-    rules_export = rules.copy()
-    rules_export["antecedents"] = rules_export["antecedents"].apply(
-        lambda x: ", ".join(list(x))
-    )
-    rules_export["consequents"] = rules_export["consequents"].apply(
-        lambda x: ", ".join(list(x))
-    )
     export_paths["reglas"] = output_dir / "reglas.parquet"
-    rules_export.to_parquet(export_paths["reglas"], index=False)
+    decorate_rules(rules, productos).to_parquet(export_paths["reglas"], index=False)
 
-    adjacency = rules[rules["antecedents"].apply(len) == 1].copy()
-    adjacency["antecedent"] = adjacency["antecedents"].apply(lambda x: list(x)[0])
-    adjacency["consequent"] = adjacency["consequents"].apply(lambda x: list(x)[0])
-    adjacency = adjacency[["antecedent", "consequent", "support", "confidence", "lift"]]
-    adjacency = adjacency.nlargest(50, "lift")
+    nombres = product_names(productos) if productos is not None else {}
+    adjacency = rules[rules["antecedents"].apply(len) == 1].nlargest(50, "lift").copy()
+    adjacency["antecedent_id"] = adjacency["antecedents"].apply(lambda x: next(iter(x)))
+    adjacency["consequent_id"] = adjacency["consequents"].apply(lambda x: next(iter(x)))
+    adjacency["antecedent"] = adjacency["antecedent_id"].map(lambda item: nombres.get(item, item))
+    adjacency["consequent"] = adjacency["consequent_id"].map(lambda item: nombres.get(item, item))
+    columns = ["antecedent", "consequent", "support", "confidence", "lift"]
+    if productos is not None:
+        columns += ["antecedent_id", "consequent_id"]
+    adjacency = adjacency[columns]
     if not adjacency.empty:
         export_paths["adjacency_pairs"] = output_dir / "adjacency_pairs.parquet"
         adjacency.to_parquet(export_paths["adjacency_pairs"], index=False)
 
     combos = rules.nlargest(20, "lift").copy()
-    combos["antecedent"] = combos["antecedents"].apply(lambda x: ", ".join(list(x)))
-    combos["consequent"] = combos["consequents"].apply(lambda x: ", ".join(list(x)))
+    etiquetas = decorate_rules(combos, productos)
+    combos["antecedent"] = etiquetas["antecedents"]
+    combos["consequent"] = etiquetas["consequents"]
+    id_columns = []
+    if productos is not None:
+        id_columns = ["antecedents_ids", "consequents_ids"]
+        combos[id_columns] = etiquetas[id_columns]
 
-    precio_map = df_sample.groupby("descripcion")["precio_unitario"].mean().to_dict()
-    margen_pct_map = df_sample.groupby("descripcion")["rentabilidad_pct"].mean().to_dict()
+    if productos is not None:
+        precio_map = productos["precio_promedio"].to_dict()
+        margen_pct_map = productos["rentabilidad_pct_promedio"].to_dict()
+    else:
+        precio_map = detalle.groupby(item_col, observed=True)["precio_unitario"].mean().to_dict()
+        margen_pct_map = detalle.groupby(item_col, observed=True)["rentabilidad_pct"].mean().to_dict()
 
     def _precio_combo(row: pd.Series) -> float:
         items = list(row["antecedents"]) + list(row["consequents"])
@@ -126,6 +365,7 @@ def run_market_basket(
             "precio_combo_sugerido",
             "margen_combo_estimado",
             "adopcion_objetivo_pct",
+            *id_columns,
         ]
     ].to_parquet(export_paths["combos_recomendados"], index=False)
 
@@ -0,0 +1,110 @@
+"""All-pairs co-occurrence and lift between SKUs from one sparse product.
+
+The ticket x SKU incidence matrix ``X`` (CSR, one row per ticket) gives
+every pair's co-occurrence count in ``X^T X``: no support threshold, so
+long-tail SKUs keep their partners. Top-k partners per SKU are then
+selected by lift, confidence or raw count with a single sort over the
+non-zero entries.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from src.data_prep.productos import build_dim_producto, product_names
+from src.features.itemsets import Transactions, encode_transactions
+from src.utils.load_data import ensure_directory
+
+
+PAIR_METRICS = ("lift", "confidence", "count")
+
+
+def cooccurrence_matrix(transactions: Transactions) -> sparse.csr_matrix:
+    """Symmetric SKU x SKU co-occurrence counts (diagonal = tickets per SKU)."""
+    matrix = transactions.matrix.astype(np.int32)
+    return (matrix.T @ matrix).tocsr()
+
+
+def top_partners(
+    transactions: Transactions,
+    *,
+    k: int = 10,
+    metric: str = "lift",
+    min_count: int = 1,
+) -> pd.DataFrame:
+    """Top ``k`` partners of every SKU ranked by ``metric``.
+
+    ``confidence`` is P(partner | item) and ``lift`` is
+    count * N / (n_item * n_partner) over the N tickets of ``transactions``.
+    Pairs seen in fewer than ``min_count`` tickets are ignored. Ties are
+    broken by count and then by partner position, so the ranking is stable.
+    """
+    if metric not in PAIR_METRICS:
+        raise ValueError(f"Metrica desconocida: {metric}. Opciones: {PAIR_METRICS}")
+
+    cooc = cooccurrence_matrix(transactions)
+    item_counts = cooc.diagonal().astype(np.float64)
+    cooc.setdiag(0)
+    cooc.eliminate_zeros()
+    if min_count > 1:
+        cooc.data[cooc.data < min_count] = 0
+        cooc.eliminate_zeros()
+
+    rows = np.repeat(np.arange(cooc.shape[0]), np.diff(cooc.indptr))
+    cols = cooc.indices
+    count = cooc.data.astype(np.int64)
+    n = transactions.n_transactions
+
+    confidence = count / item_counts[rows]
+    lift = confidence * n / item_counts[cols]
+    score = {"lift": lift, "confidence": confidence, "count": count}[metric]
+
+    order = np.lexsort((cols, -count, -score, rows))
+    rows_sorted = rows[order]
+    starts = np.searchsorted(rows_sorted, rows_sorted, side="left")
+    rank = np.arange(len(order)) - starts
+    keep = order[rank < k]
+
+    return pd.DataFrame(
+        {
+            "item": transactions.items[rows[keep]],
+            "partner": transactions.items[cols[keep]],
+            "rank": rank[rank < k] + 1,
+            "count": count[keep],
+            "support": count[keep] / n,
+            "confidence": confidence[keep],
+            "lift": lift[keep],
+        }
+    )
+
+
+def run_pair_lift(
+    detalle: pd.DataFrame,
+    output_dir: Path,
+    *,
+    item_col: str = "producto_id",
+    k: int = 10,
+    metric: str = "lift",
+    min_count: int = 2,
+    productos: Optional[pd.DataFrame] = None,
+) -> Dict[str, Path]:
+    """Export the top-k partners of every SKU over all tickets."""
+    ensure_directory(output_dir)
+    transactions = encode_transactions(detalle, item_col=item_col, min_items=1)
+    if transactions.n_transactions == 0:
+        return {}
+    partners = top_partners(transactions, k=k, metric=metric, min_count=min_count)
+    if item_col == "producto_id" and "descripcion" in detalle.columns:
+        if productos is None:
+            productos = build_dim_producto(detalle)
+        nombres = product_names(productos)
+        partners.insert(1, "descripcion", partners["item"].map(nombres))
+        partners.insert(3, "descripcion_partner", partners["partner"].map(nombres))
+    path = output_dir / "socios_producto.parquet"
+    partners.to_parquet(path, index=False)
+    return {"socios_producto": path}
@@ -1,46 +1,172 @@
-"""Pareto analysis on margin contribution by category and product."""
+"""Pareto analysis on margin contribution by category and product.
+
+Sales lines are aggregated once into a cube at key x segment granularity
+(``aggregate_cube``); every segment's ranking, share, cumulative share and
+ABC class are then derived from the cube with one sort, a grouped cumsum
+and ``searchsorted`` (``pareto_segmentado``). Coarser keys (e.g. category
+from a product cube) are rollups of the same cube, and a new segment
+column only adds one small groupby over the cube.
+"""
 
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Mapping, Sequence, Union
 
+import numpy as np
 import pandas as pd
 
+from src.data_prep.calendario import franja_horaria
 from src.utils.load_data import ensure_directory
 
 
-def _pareto(df: pd.DataFrame, value_col: str, id_col: str) -> pd.DataFrame:
-    ordered = (
-        df.groupby(id_col)[value_col]
-        .sum()
-        .sort_values(ascending=False)
+ABC_BREAKS = (0.80, 0.95)
+ABC_LABELS = np.array(["A", "B", "C"])
+
+PARETO_SEGMENTS = ("tipo_dia", "periodo", "franja_horaria")
+
+
+def clasificar_abc(acumulada: np.ndarray, breaks: Sequence[float] = ABC_BREAKS) -> np.ndarray:
+    """ABC class of cumulative shares: A up to ``breaks[0]``, B up to ``breaks[1]``, else C."""
+    return ABC_LABELS[np.searchsorted(np.asarray(breaks), acumulada, side="left")]
+
+
+def aggregate_cube(
+    detalle: pd.DataFrame,
+    *,
+    keys: Sequence[str],
+    values: Mapping[str, str],
+    segments: Sequence[Union[str, pd.Series]] = (),
+) -> pd.DataFrame:
+    """Sum ``values`` (output name -> source column) per key and segment value.
+
+    ``segments`` are column names or Series aligned with ``detalle`` (named
+    after the segment), so derived segments need not be added as columns.
+    """
+    return (
+        detalle.groupby([*keys, *segments], observed=True, sort=False)
+        .agg(**{name: (column, "sum") for name, column in values.items()})
         .reset_index()
     )
-    ordered["participacion"] = ordered[value_col] / ordered[value_col].sum()
-    ordered["participacion_acumulada"] = ordered["participacion"].cumsum()
 
-    def clasifica(row: pd.Series) -> str:
-        if row["participacion_acumulada"] <= 0.8:
-            return "A"
-        if row["participacion_acumulada"] <= 0.95:
-            return "B"
-        return "C"
 
-    ordered["segmento_pareto"] = ordered.apply(clasifica, axis=1)
-    return ordered
+def rank_within(
+    frame: pd.DataFrame,
+    *,
+    group_cols: Sequence[str],
+    value_cols: Sequence[str],
+    breaks: Sequence[float] = ABC_BREAKS,
+) -> pd.DataFrame:
+    """Add rank, share, cumulative value/share and ABC class of each value per group."""
+    result = frame.reset_index(drop=True)
+    groups = result.groupby(list(group_cols), observed=True, sort=False).ngroup().to_numpy()
+    for value in value_cols:
+        valores = result[value].to_numpy(dtype=float)
+        order = np.lexsort((-valores, groups))
+        grupos = groups[order]
+        ordenados = valores[order]
+        inicio = np.searchsorted(grupos, grupos, side="left")
+        total = np.bincount(groups, weights=valores)[grupos]
+        acumulado = pd.Series(ordenados).groupby(grupos, sort=False).cumsum().to_numpy()
+
+        columnas = {
+            f"rank_{value}": np.arange(len(order)) - inicio + 1,
+            f"participacion_{value}": ordenados / total,
+            f"{value}_acumulado": acumulado,
+            f"participacion_acumulada_{value}": acumulado / total,
+        }
+        columnas[f"abc_{value}"] = clasificar_abc(columnas[f"participacion_acumulada_{value}"], breaks)
+        for name, ordered_values in columnas.items():
+            column = np.empty_like(ordered_values)
+            column[order] = ordered_values
+            result[name] = column
+    return result
+
+
+def pareto_segmentado(
+    cube: pd.DataFrame,
+    *,
+    keys: Sequence[str],
+    values: Sequence[str],
+    segments: Sequence[str] = (),
+    include_global: bool = True,
+    breaks: Sequence[float] = ABC_BREAKS,
+) -> pd.DataFrame:
+    """Pareto of ``keys`` within the global total and within each segment value.
+
+    Returns one long table with ``segmento``/``valor_segmento`` columns
+    (``global``/``TODOS`` for the unsegmented ranking), ordered by segment
+    and by rank of the first value column.
+    """
+    bloques = []
+    if include_global:
+        bloque = cube.groupby(list(keys), observed=True, sort=False)[list(values)].sum().reset_index()
+        bloques.append(bloque.assign(segmento="global", valor_segmento="TODOS"))
+    for segment in segments:
+        bloque = (
+            cube.groupby([*keys, segment], observed=True, sort=False)[list(values)].sum().reset_index()
+        )
+        bloque["valor_segmento"] = bloque.pop(segment).astype(str)
+        bloques.append(bloque.assign(segmento=segment))
+    largo = pd.concat(bloques, ignore_index=True)
+    largo = largo[["segmento", "valor_segmento", *keys, *values]]
+
+    ranked = rank_within(largo, group_cols=["segmento", "valor_segmento"], value_cols=values, breaks=breaks)
+    return ranked.sort_values(
+        ["segmento", "valor_segmento", f"rank_{values[0]}"], kind="mergesort"
+    ).reset_index(drop=True)
+
+
+def _segment_series(detalle: pd.DataFrame) -> list:
+    segments = [column for column in ("tipo_dia", "periodo") if column in detalle.columns]
+    if "hora" in detalle.columns:
+        segments.append(franja_horaria(detalle["hora"]).rename("franja_horaria"))
+    return segments
+
+
+def _legacy_layout(pareto: pd.DataFrame, key: str) -> pd.DataFrame:
+    """Global block in the historical ``pareto_*.parquet`` column layout."""
+    bloque = pareto[pareto["segmento"] == "global"]
+    return pd.DataFrame(
+        {
+            key: bloque[key],
+            "margen_linea": bloque["margen_linea"],
+            "participacion": bloque["participacion_margen_linea"],
+            "participacion_acumulada": bloque["participacion_acumulada_margen_linea"],
+            "segmento_pareto": bloque["abc_margen_linea"],
+        }
+    ).reset_index(drop=True)
 
 
 def run_pareto(detalle: pd.DataFrame, output_dir: Path) -> Dict[str, Path]:
+    """Export the global category/product Pareto and ``pareto_segmentado.parquet``.
+
+    ``pareto_producto.parquet`` keeps its historical one-row-per-description
+    layout. In ``pareto_segmentado`` products are keyed by ``producto_id``
+    (with their description), so SKUs sharing a name are ranked separately.
+    """
     ensure_directory(output_dir)
-    categoria = _pareto(detalle, "margen_linea", "categoria")
-    producto = _pareto(detalle, "margen_linea", "descripcion")
+    values = {"margen_linea": "margen_linea", "importe_total": "importe_total"}
+    segments = _segment_series(detalle)
+    cube = aggregate_cube(
+        detalle, keys=["producto_id", "descripcion", "categoria"], values=values, segments=segments
+    )
+    nombres = [segment if isinstance(segment, str) else segment.name for segment in segments]
+
+    categoria = pareto_segmentado(cube, keys=["categoria"], values=list(values), segments=nombres)
+    producto = pareto_segmentado(
+        cube, keys=["producto_id", "descripcion", "categoria"], values=list(values), segments=nombres
+    )
 
     paths = {
         "pareto_categoria": output_dir / "pareto_categoria.parquet",
         "pareto_producto": output_dir / "pareto_producto.parquet",
+        "pareto_segmentado": output_dir / "pareto_segmentado.parquet",
     }
-    categoria.to_parquet(paths["pareto_categoria"], index=False)
-    producto.to_parquet(paths["pareto_producto"], index=False)
+    _legacy_layout(categoria, "categoria").to_parquet(paths["pareto_categoria"], index=False)
+    por_descripcion = pareto_segmentado(cube, keys=["descripcion"], values=["margen_linea"])
+    _legacy_layout(por_descripcion, "descripcion").to_parquet(paths["pareto_producto"], index=False)
+    pd.concat(
+        [categoria.assign(nivel="categoria"), producto.assign(nivel="producto")], ignore_index=True
+    ).to_parquet(paths["pareto_segmentado"], index=False)
     return paths
-
@@ -0,0 +1,126 @@
+"""Threshold queries over a precomputed Pareto ranking.
+
+``ParetoQuery`` keeps the items sorted by value together with their
+cumulative share, plus a category-grouped copy of the same ranking. Every
+question ("how many items make X%", "class of item Y under cutoffs A/B",
+"top N of a category") is answered with ``searchsorted`` or a slice, so
+thresholds can change without regrouping the sales data.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Hashable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from src.features.pareto_margen import ABC_BREAKS, ABC_LABELS, clasificar_abc
+
+
+@dataclass
+class ParetoQuery:
+    """
+    Sorted cumulative-share arrays of one Pareto ranking.
+
+    ``keys``/``values``/``acumulada`` follow the global rank (value
+    descending, ties in input order). ``by_category`` holds the positions of
+    the same ranking grouped by category (each group still in rank order) and
+    ``category_bounds`` the ``[start, end)`` slice of every category.
+    Classes use the same rule as ``clasificar_abc``: an item is A while its
+    cumulative share is at most the first cutoff.
+    """
+
+    frame: pd.DataFrame
+    key: str
+    value: str
+    keys: np.ndarray
+    values: np.ndarray
+    acumulada: np.ndarray
+    category: Optional[str] = None
+    by_category: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    category_bounds: Dict[Hashable, tuple] = field(default_factory=dict)
+    _position: Dict[Hashable, int] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_frame(
+        cls,
+        frame: pd.DataFrame,
+        *,
+        value: str = "margen",
+        key: str = "producto_id",
+        category: Optional[str] = "categoria",
+    ) -> "ParetoQuery":
+        """Rank ``frame`` (one row per item) by ``value`` and precompute the query arrays."""
+        valores = frame[value].to_numpy(dtype=float)
+        order = np.argsort(-valores, kind="stable")
+        ranked = frame.iloc[order].reset_index(drop=True)
+        values = valores[order]
+        total = values.sum()
+        acumulada = np.cumsum(values) / total if total else np.zeros(len(values))
+        keys = ranked[key].to_numpy()
+
+        by_category = np.empty(0, dtype=np.int64)
+        bounds: Dict[Hashable, tuple] = {}
+        if category is not None:
+            codes, labels = pd.factorize(ranked[category])
+            by_category = np.argsort(codes, kind="stable")
+            starts = np.searchsorted(codes[by_category], np.arange(len(labels)), side="left")
+            ends = np.searchsorted(codes[by_category], np.arange(len(labels)), side="right")
+            bounds = {label: (int(start), int(end)) for label, start, end in zip(labels, starts, ends)}
+
+        return cls(
+            frame=ranked,
+            key=key,
+            value=value,
+            keys=keys,
+            values=values,
+            acumulada=acumulada,
+            category=category,
+            by_category=by_category,
+            category_bounds=bounds,
+            _position={item: position for position, item in enumerate(keys)},
+        )
+
+    @classmethod
+    def from_parquet(cls, path: Path, **kwargs) -> "ParetoQuery":
+        return cls.from_frame(pd.read_parquet(path), **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def count_for_share(self, share: float) -> int:
+        """Fewest top-ranked items whose cumulative share reaches ``share``."""
+        if not len(self) or share <= 0:
+            return 0
+        return min(int(np.searchsorted(self.acumulada, share, side="left")) + 1, len(self))
+
+    def share_of_top(self, n: int) -> float:
+        """Cumulative share of the ``n`` top-ranked items."""
+        n = min(max(int(n), 0), len(self))
+        return float(self.acumulada[n - 1]) if n else 0.0
+
+    def class_counts(self, breaks: Sequence[float] = ABC_BREAKS) -> Dict[str, int]:
+        """Number of items in each class under ``breaks``."""
+        limits = np.searchsorted(self.acumulada, np.asarray(breaks), side="right")
+        edges = np.concatenate([[0], limits, [len(self)]])
+        return {label: int(count) for label, count in zip(ABC_LABELS, np.diff(edges))}
+
+    def classify(self, item: Hashable, breaks: Sequence[float] = ABC_BREAKS) -> str:
+        """Class of one item under ``breaks`` (``KeyError`` if it is not ranked)."""
+        return str(clasificar_abc(self.acumulada[self._position[item]], breaks))
+
+    def classes(self, breaks: Sequence[float] = ABC_BREAKS) -> np.ndarray:
+        """Class of every item, in rank order."""
+        return clasificar_abc(self.acumulada, breaks)
+
+    def top(self, n: int) -> pd.DataFrame:
+        """Top ``n`` rows with their cumulative share."""
+        return self.frame.iloc[:n].assign(participacion_acumulada=self.acumulada[:n])
+
+    def top_in_category(self, categoria: Hashable, n: int) -> pd.DataFrame:
+        """Top ``n`` rows of one category (empty when the category is unknown)."""
+        start, end = self.category_bounds.get(categoria, (0, 0))
+        positions = self.by_category[start:min(end, start + max(int(n), 0))]
+        return self.frame.iloc[positions].assign(participacion_acumulada=self.acumulada[positions])
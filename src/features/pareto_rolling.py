@@ -0,0 +1,178 @@
+"""Rolling monthly Pareto over persisted per-month product aggregates.
+
+Product margin and sales are stored per month partition::
+
+    pareto_mensual/
+        mes_key=202401/part.parquet   (producto_id, categoria, margen_linea, importe_total)
+
+Each run recomputes only the months that received new lines. ABC classes
+for a month, or for any trailing window of months, come from summing the
+stored aggregates, and the class history is kept as one ``int8`` column
+per month (0 = A, 1 = B, 2 = C, -1 = no sales in the window).
+"""
+
+from __future__ import annotations
+
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+from src.features.pareto_margen import ABC_LABELS, rank_within
+from src.utils.load_data import ensure_directory
+
+
+PARTITION_KEY = "mes_key"
+MONTH_VALUES = ("margen_linea", "importe_total")
+SIN_VENTAS = -1
+
+
+def mes_key(detalle: pd.DataFrame) -> np.ndarray:
+    """``YYYYMM`` key of each line."""
+    if "fecha_key" in detalle.columns:
+        return detalle["fecha_key"].to_numpy() // 100
+    fechas = pd.to_datetime(detalle["fecha"])
+    return (fechas.dt.year * 100 + fechas.dt.month).to_numpy()
+
+
+def update_pareto_mensual(
+    detalle: pd.DataFrame,
+    store_dir: Path,
+    *,
+    meses: Optional[Iterable[int]] = None,
+    rebuild: bool = False,
+) -> list[int]:
+    """Recompute the product aggregates of ``meses`` (all months of ``detalle`` by default).
+
+    A missing store is seeded with every month of ``detalle`` (``meses`` is
+    ignored), so the ABC history never covers a partial period.
+    """
+    if rebuild and store_dir.exists():
+        shutil.rmtree(store_dir)
+    if not store_dir.exists():
+        meses = None
+    claves = mes_key(detalle)
+    meses = np.unique(claves) if meses is None else np.unique(np.asarray(list(meses)))
+    actualizados = []
+    for mes in meses:
+        partition = store_dir / f"{PARTITION_KEY}={int(mes)}"
+        if partition.exists():
+            shutil.rmtree(partition)
+        lineas = detalle[claves == mes]
+        if lineas.empty:
+            continue
+        agregado = (
+            lineas.groupby(["producto_id", "categoria"], observed=True, sort=False)[list(MONTH_VALUES)]
+            .sum()
+            .reset_index()
+        )
+        agregado["producto_id"] = agregado["producto_id"].astype(str)
+        agregado["categoria"] = agregado["categoria"].astype(str)
+        ensure_directory(partition)
+        agregado.to_parquet(partition / "part.parquet", index=False)
+        actualizados.append(int(mes))
+    return actualizados
+
+
+def load_pareto_mensual(
+    store_dir: Path, *, desde: Optional[int] = None, hasta: Optional[int] = None
+) -> pd.DataFrame:
+    """Stored month aggregates (long format, one row per month and product)."""
+    if not store_dir.exists():
+        raise FileNotFoundError(f"No hay agregados mensuales de Pareto en {store_dir}")
+    dataset = ds.dataset(store_dir, format="parquet", partitioning="hive")
+    filtro = None
+    if desde is not None:
+        filtro = ds.field(PARTITION_KEY) >= desde
+    if hasta is not None:
+        hasta_expr = ds.field(PARTITION_KEY) <= hasta
+        filtro = hasta_expr if filtro is None else filtro & hasta_expr
+    mensual = dataset.to_table(filter=filtro).to_pandas()
+    mensual[PARTITION_KEY] = mensual[PARTITION_KEY].astype(np.int32)
+    return mensual
+
+
+def _month_offset(mes: int, delta: int) -> int:
+    indice = (mes // 100) * 12 + (mes % 100 - 1) + delta
+    return (indice // 12) * 100 + indice % 12 + 1
+
+
+def abc_ventana(
+    mensual: pd.DataFrame,
+    *,
+    hasta: Optional[int] = None,
+    meses: int = 1,
+    value: str = "margen_linea",
+) -> pd.DataFrame:
+    """Pareto of products over the ``meses`` months ending at ``hasta`` (latest by default)."""
+    hasta = int(mensual[PARTITION_KEY].max()) if hasta is None else hasta
+    desde = _month_offset(hasta, -(meses - 1))
+    ventana = mensual[mensual[PARTITION_KEY].between(desde, hasta)]
+    agregado = (
+        ventana.groupby(["producto_id", "categoria"], observed=True, sort=False)[list(MONTH_VALUES)]
+        .sum()
+        .reset_index()
+    )
+    agregado["ventana"] = f"{desde}-{hasta}"
+    ranked = rank_within(agregado, group_cols=["ventana"], value_cols=[value])
+    return ranked.sort_values(f"rank_{value}", kind="mergesort").reset_index(drop=True)
+
+
+def abc_historial(
+    mensual: pd.DataFrame, *, meses: int = 1, value: str = "margen_linea"
+) -> pd.DataFrame:
+    """ABC code per product (rows) and month (``int8`` columns), over trailing windows.
+
+    Window sums are a rolling sum over the product x month matrix, and all
+    months are ranked together with ``rank_within`` grouped by month.
+    """
+    matriz = mensual.pivot_table(
+        index="producto_id", columns=PARTITION_KEY, values=value, aggfunc="sum", observed=True
+    )
+    # Every calendar month between the first and last stored ones, so windows count months.
+    calendario = [int(matriz.columns.min())]
+    while calendario[-1] < int(matriz.columns.max()):
+        calendario.append(_month_offset(calendario[-1], 1))
+    matriz = matriz.reindex(columns=calendario)
+
+    presente = matriz.notna().T.rolling(meses, min_periods=1).max().T.astype(bool)
+    ventana = matriz.fillna(0.0).T.rolling(meses, min_periods=1).sum().T
+
+    largo = ventana.where(presente).stack().rename(value).reset_index()
+    ranked = rank_within(largo, group_cols=[PARTITION_KEY], value_cols=[value])
+    codigos = np.searchsorted(ABC_LABELS, ranked[f"abc_{value}"].to_numpy()).astype(np.int8)
+    historial = (
+        pd.DataFrame(
+            {"producto_id": ranked["producto_id"], PARTITION_KEY: ranked[PARTITION_KEY], "abc": codigos}
+        )
+        .pivot(index="producto_id", columns=PARTITION_KEY, values="abc")
+        .reindex(index=matriz.index, columns=calendario)
+        .fillna(SIN_VENTAS)
+        .astype(np.int8)
+    )
+    historial.columns = [str(columna) for columna in historial.columns]
+    return historial.reset_index()
+
+
+def run_pareto_rolling(
+    detalle: pd.DataFrame,
+    store_dir: Path,
+    output_dir: Path,
+    *,
+    meses: Optional[Iterable[int]] = None,
+    rebuild: bool = False,
+    ventanas: Iterable[int] = (1, 3),
+) -> Dict[str, Path]:
+    """Update the month store and export the ABC history for each trailing window size."""
+    update_pareto_mensual(detalle, store_dir, meses=meses, rebuild=rebuild)
+    mensual = load_pareto_mensual(store_dir)
+    ensure_directory(output_dir)
+    paths = {}
+    for ventana in ventanas:
+        nombre = f"abc_historial_{ventana}m"
+        paths[nombre] = output_dir / f"{nombre}.parquet"
+        abc_historial(mensual, meses=ventana).to_parquet(paths[nombre], index=False)
+    return paths
@@ -0,0 +1,145 @@
+"""Partitioned (SON) frequent-itemset mining over monthly ticket shards.
+
+Pass 1 mines every month on its own (one process per shard) with the same
+relative ``min_support``; an itemset that is frequent over the whole
+history is frequent in at least one month, so the union of the local
+results is a complete candidate set. Pass 2 counts every candidate in
+every shard and keeps the globally frequent ones, which gives exactly the
+itemsets of a single-pass run.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.features.itemsets import (
+    Transactions,
+    encode_transactions,
+    frequent_itemsets,
+    min_support_count,
+    pack_bitsets,
+    popcount,
+)
+from src.utils.parallel import resolve_n_jobs
+
+
+COUNT_CHUNK = 4096
+
+Candidate = Tuple
+
+
+def _ticket_months(detalle: pd.DataFrame, ticket_col: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Month key (``YYYYMM``) of each line, taken from the first line of its ticket."""
+    if "fecha_key" in detalle.columns:
+        meses = detalle["fecha_key"].to_numpy() // 100
+    else:
+        fechas = pd.to_datetime(detalle["fecha"])
+        meses = (fechas.dt.year * 100 + fechas.dt.month).to_numpy()
+    ticket_codes, _ = pd.factorize(detalle[ticket_col])
+    _, primera = np.unique(ticket_codes, return_index=True)
+    return meses[primera][ticket_codes], np.unique(meses)
+
+
+def month_shards(
+    detalle: pd.DataFrame,
+    *,
+    item_col: str = "producto_id",
+    ticket_col: str = "ticket_id",
+    min_items: int = 2,
+) -> List[Transactions]:
+    """One encoded transaction matrix per month (a ticket belongs to a single month)."""
+    mes_linea, meses = _ticket_months(detalle, ticket_col)
+    shards = []
+    for mes in meses:
+        shard = encode_transactions(
+            detalle[mes_linea == mes], item_col=item_col, ticket_col=ticket_col, min_items=min_items
+        )
+        if shard.n_transactions:
+            shards.append(shard)
+    return shards
+
+
+def _local_candidates(
+    transactions: Transactions, min_support: float, max_len: Optional[int]
+) -> List[Candidate]:
+    itemsets = frequent_itemsets(transactions, min_support=min_support, max_len=max_len)
+    return [tuple(sorted(itemset, key=str)) for itemset in itemsets["itemsets"]]
+
+
+def _count_candidates(transactions: Transactions, candidates: Sequence[Candidate]) -> np.ndarray:
+    """Support count of every candidate in one shard (candidates of equal length batched)."""
+    counts = np.zeros(len(candidates), dtype=np.int64)
+    column_of = {label: column for column, label in enumerate(transactions.items)}
+    by_length: Dict[int, List[int]] = {}
+    for position, candidate in enumerate(candidates):
+        if all(item in column_of for item in candidate):
+            by_length.setdefault(len(candidate), []).append(position)
+
+    for length, positions in by_length.items():
+        positions = np.asarray(positions)
+        columns = np.array(
+            [[column_of[item] for item in candidates[position]] for position in positions]
+        ).reshape(len(positions), length)
+        involved, local = np.unique(columns, return_inverse=True)
+        local = local.reshape(columns.shape)
+        bitsets = pack_bitsets(transactions.matrix, involved)
+        for start in range(0, len(positions), COUNT_CHUNK):
+            block = local[start:start + COUNT_CHUNK]
+            tids = bitsets[block[:, 0]]
+            for step in range(1, length):
+                tids = tids & bitsets[block[:, step]]
+            counts[positions[start:start + COUNT_CHUNK]] = popcount(tids)
+    return counts
+
+
+def _map_shards(
+    executor: Optional[Executor], function: Callable, shards: List[Transactions], *args
+) -> list:
+    if executor is None:
+        return [function(shard, *args) for shard in shards]
+    futures = [executor.submit(function, shard, *args) for shard in shards]
+    return [future.result() for future in futures]
+
+
+def partitioned_frequent_itemsets(
+    shards: List[Transactions],
+    *,
+    min_support: float,
+    max_len: Optional[int] = None,
+    n_jobs: Optional[int] = -1,
+) -> pd.DataFrame:
+    """Global frequent itemsets from per-shard mining + a global counting pass.
+
+    Same ``support``/``itemsets`` layout (sorted by length) as
+    ``src.features.itemsets.frequent_itemsets`` over the concatenated shards.
+    """
+    n = sum(shard.n_transactions for shard in shards)
+    if n == 0:
+        return pd.DataFrame(columns=["support", "itemsets"])
+
+    workers = resolve_n_jobs(n_jobs, len(shards))
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        locales = _map_shards(executor, _local_candidates, shards, min_support, max_len)
+        candidates = sorted(
+            {candidate for local in locales for candidate in local},
+            key=lambda candidate: (len(candidate), [str(item) for item in candidate]),
+        )
+        if not candidates:
+            return pd.DataFrame(columns=["support", "itemsets"])
+        counts = np.sum(_map_shards(executor, _count_candidates, shards, candidates), axis=0)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    frequent = np.flatnonzero(counts >= min_support_count(min_support, n))
+    return pd.DataFrame(
+        {
+            "support": counts[frequent] / n,
+            "itemsets": [frozenset(candidates[position]) for position in frequent],
+        }
+    )
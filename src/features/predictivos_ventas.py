@@ -3,16 +3,20 @@
 from __future__ import annotations
 
 import itertools
+import json
 import warnings
+from concurrent.futures import Executor, ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 from statsmodels.tsa.statespace.sarimax import SARIMAX
+from statsmodels.tsa.stattools import kpss
 
 from src.utils.load_data import ensure_directory
+from src.utils.parallel import resolve_n_jobs
 
 
 @dataclass
@@ -27,7 +31,7 @@ class ForecastResult:
 def _parse_semana(ventas: pd.DataFrame) -> pd.DataFrame:
     ventas = ventas.copy()
     ventas["semana_inicio"] = pd.to_datetime(
-        ventas["semana_iso"] + "-1", format="%G-W%V-%u"
+        ventas["semana_iso"].astype(str) + "-1", format="%G-W%V-%u"
     )
     ventas = ventas.sort_values("semana_inicio")
     return ventas
@@ -37,31 +41,236 @@ def _candidate_orders() -> List[Tuple[int, int, int]]:
     return list(itertools.product([0, 1, 2], [0, 1], [0, 1, 2]))
 
 
-def _fit_best_model(series: pd.Series) -> Tuple[SARIMAX, Tuple[int, int, int], float]:
-    best_model = None
-    best_aic = np.inf
-    best_order = (1, 1, 1)
-    for order in _candidate_orders():
+Order = Tuple[int, int, int]
+Fit = Tuple[float, pd.Series]
+
+MAX_P = 2
+MAX_D = 1
+MAX_Q = 2
+STEPWISE_MOVES = ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (1, 1))
+ORDER_CACHE_FILE = "arima_orders.json"
+
+
+def _build_model(series: pd.Series, order: Order) -> SARIMAX:
+    return SARIMAX(
+        series,
+        order=order,
+        enforce_stationarity=False,
+        enforce_invertibility=False,
+    )
+
+
+def _warm_start(model: SARIMAX, previous: pd.Series) -> np.ndarray:
+    """Start values for ``model`` copied by name from a neighbouring fit.
+
+    Coefficients the neighbour did not have (a new AR/MA lag) start at zero,
+    so the search begins from the nested model it just moved away from.
+    """
+    start = pd.Series(0.0, index=model.param_names)
+    shared = start.index.intersection(previous.index)
+    start[shared] = previous[shared]
+    return start.to_numpy()
+
+
+def _fit_order(
+    series: pd.Series, order: Order, start_params: Optional[pd.Series] = None
+) -> Optional[Fit]:
+    """Fit one candidate order; returns (aic, params) or ``None`` if it fails.
+
+    Module-level so it can run in worker processes.
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            model = _build_model(series, order)
+            start = _warm_start(model, start_params) if start_params is not None else None
+            fitted = model.fit(start_params=start, disp=False)
+    except Exception:
+        return None
+    if not np.isfinite(fitted.aic):
+        return None
+    return float(fitted.aic), fitted.params
+
+
+def _best_fit(fits: Iterable[Tuple[Order, Optional[Fit]]]) -> Optional[Tuple[Order, float, pd.Series]]:
+    """Lowest-AIC candidate; the first one wins ties."""
+    best = None
+    for order, fit in fits:
+        if fit is not None and (best is None or fit[0] < best[1]):
+            best = (order, fit[0], fit[1])
+    return best
+
+
+def _choose_d(series: pd.Series, max_d: int = MAX_D, alpha: float = 0.05) -> int:
+    """Differencing order from successive KPSS level-stationarity tests."""
+    values = series.dropna().to_numpy(dtype=float)
+    d = 0
+    while d < max_d and len(values) > 3:
         try:
             with warnings.catch_warnings():
                 warnings.simplefilter("ignore")
-                model = SARIMAX(
-                    series,
-                    order=order,
-                    enforce_stationarity=False,
-                    enforce_invertibility=False,
-                )
-                fitted = model.fit(disp=False)
-            if fitted.aic < best_aic:
-                best_model = fitted
-                best_aic = fitted.aic
-                best_order = order
+                pvalue = kpss(values, regression="c", nlags="auto")[1]
         except Exception:
-            continue
+            break
+        if pvalue >= alpha:
+            break
+        values = np.diff(values)
+        d += 1
+    return d
+
+
+def _search_grid(series: pd.Series) -> Optional[Tuple[Order, float, pd.Series]]:
+    return _best_fit((order, _fit_order(series, order)) for order in _candidate_orders())
+
+
+def _search_stepwise(
+    series: pd.Series,
+    initial: Optional[Order] = None,
+    max_fits: Optional[int] = None,
+) -> Optional[Tuple[Order, float, pd.Series]]:
+    """Hyndman-Khandakar stepwise search over (p, q) with d chosen by KPSS.
+
+    Starts from ``initial`` (e.g. last run's winner) or from the usual
+    (2,d,2), (0,d,0), (1,d,0), (0,d,1) set, then moves to the first
+    neighbour (p and/or q changed by one) that lowers the AIC, warm-starting
+    each fit from the current best parameters. Stops when no neighbour
+    improves or after ``max_fits`` model fits (keeping the best model found
+    so far). The budget counts fits, not seconds, so the chosen order does
+    not depend on machine load or on the number of workers.
+    """
+    d = _choose_d(series)
+    fits: Dict[Order, Optional[Fit]] = {}
+
+    def agotado() -> bool:
+        return max_fits is not None and len(fits) >= max(max_fits, 1)
+
+    def evaluar(orders: List[Order]) -> Optional[Tuple[Order, float, pd.Series]]:
+        for order in orders:
+            if order not in fits and not agotado():
+                fits[order] = _fit_order(series, order)
+        return _best_fit((order, fits.get(order)) for order in orders)
+
+    best = None
+    if initial is not None:
+        best = evaluar([(min(initial[0], MAX_P), d, min(initial[2], MAX_Q))])
+    if best is None:
+        best = evaluar([(2, d, 2), (0, d, 0), (1, d, 0), (0, d, 1)])
+
+    while best is not None and not agotado():
+        order, aic, params = best
+        vecinos = [
+            (order[0] + dp, d, order[2] + dq)
+            for dp, dq in STEPWISE_MOVES
+            if 0 <= order[0] + dp <= MAX_P and 0 <= order[2] + dq <= MAX_Q
+        ]
+        mejor_vecino = None
+        for vecino in vecinos:
+            if vecino in fits or agotado():
+                continue
+            fits[vecino] = _fit_order(series, vecino, params)
+            if fits[vecino] is not None and fits[vecino][0] < aic:
+                mejor_vecino = (vecino, *fits[vecino])
+                break
+        if mejor_vecino is None:
+            break
+        best = mejor_vecino
+    return best
+
+
+def _rebuild_model(series: pd.Series, order: Order, params: pd.Series):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return _build_model(series, order).smooth(np.asarray(params))
+
 
-    if best_model is None:
+def _fit_best_model(
+    series: pd.Series,
+    *,
+    search: str = "stepwise",
+    initial: Optional[Order] = None,
+    max_fits: Optional[int] = None,
+) -> Tuple[SARIMAX, Order, float]:
+    if search == "grid":
+        best = _search_grid(series)
+    else:
+        best = _search_stepwise(series, initial, max_fits)
+    if best is None:
         raise RuntimeError("No se pudo ajustar un modelo ARIMA válido")
-    return best_model, best_order, best_aic
+    order, aic, params = best
+    return _rebuild_model(series, order, params), order, aic
+
+
+def _fit_all(
+    series_by_categoria: Dict[str, pd.Series],
+    executor: Optional[Executor],
+    *,
+    search: str,
+    initial_orders: Dict[str, Order],
+    max_fits: Optional[int],
+) -> Dict[str, Tuple[object, Order, float]]:
+    """Select and fit one model per category, serially or over ``executor``.
+
+    ``grid`` fans out every (categoria, order) pair; ``stepwise`` is
+    sequential within a series, so each category is one task. Results are
+    collected by position, so the chosen models do not depend on which
+    worker finishes first.
+    """
+    categorias = list(series_by_categoria)
+    if search == "grid":
+        orders = _candidate_orders()
+        tasks = [
+            (_fit_order, series_by_categoria[categoria], order)
+            for categoria in categorias
+            for order in orders
+        ]
+    else:
+        tasks = [
+            (_search_stepwise, series_by_categoria[categoria], initial_orders.get(categoria), max_fits)
+            for categoria in categorias
+        ]
+
+    if executor is None:
+        results = [func(*args) for func, *args in tasks]
+    else:
+        futures = [executor.submit(func, *args) for func, *args in tasks]
+        results = [future.result() for future in futures]
+
+    modelos = {}
+    for index, categoria in enumerate(categorias):
+        if search == "grid":
+            bloque = results[index * len(orders):(index + 1) * len(orders)]
+            best = _best_fit(zip(orders, bloque))
+        else:
+            best = results[index]
+        if best is None:
+            continue
+        order, aic, params = best
+        modelos[categoria] = (
+            _rebuild_model(series_by_categoria[categoria], order, params),
+            order,
+            aic,
+        )
+    return modelos
+
+
+def load_order_cache(path: Path) -> Dict[str, Order]:
+    """Orders chosen in previous runs, keyed by categoria."""
+    if not path.exists():
+        return {}
+    try:
+        payload = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return {str(categoria): tuple(int(x) for x in order) for categoria, order in payload.items()}
+
+
+def save_order_cache(path: Path, orders: Dict[str, Order]) -> Path:
+    ensure_directory(path.parent)
+    path.write_text(
+        json.dumps({categoria: list(order) for categoria, order in sorted(orders.items())}),
+        encoding="utf-8",
+    )
+    return path
 
 
 def _prepare_result(
@@ -109,30 +318,68 @@ def generate_forecasts(
     ventas_semanales_categoria: pd.DataFrame,
     output_dir: Path,
     *,
-    top_n: int = 10,
+    top_n: Optional[int] = None,
     forecast_steps: int = 8,
+    n_jobs: Optional[int] = 1,
+    search: str = "stepwise",
+    max_fits: Optional[int] = None,
+    order_cache: Optional[Path] = None,
 ) -> Dict[str, Path]:
+    """Select an ARIMA order per category and write forecasts plus model metadata.
+
+    ``top_n=None`` forecasts every category. ``search="stepwise"`` runs the
+    Hyndman-Khandakar search (see ``_search_stepwise``) with at most
+    ``max_fits`` model fits per series, starting from the order cached in
+    ``order_cache`` (default ``output_dir / arima_orders.json``);
+    ``search="grid"`` fits every order of ``_candidate_orders``.
+    ``n_jobs`` > 1 runs the fits in a process pool (``None``/-1 = all
+    cores); the written files are the same as with ``n_jobs=1``.
+    """
     ensure_directory(output_dir)
     ventas = _parse_semana(ventas_semanales_categoria)
 
-    top_categorias = (
-        ventas.groupby("categoria")["ventas_semana"].sum().nlargest(top_n).index.tolist()
-    )
-
-    resultados: List[pd.DataFrame] = []
-    metadata_rows: List[Dict[str, object]] = []
+    totales = ventas.groupby("categoria", observed=True)["ventas_semana"].sum()
+    top_categorias = totales.nlargest(top_n if top_n is not None else len(totales)).index.tolist()
 
+    series_by_categoria: Dict[str, pd.Series] = {}
     for categoria in top_categorias:
         serie_categoria = ventas[ventas["categoria"] == categoria]
         serie = (
             serie_categoria.groupby("semana_inicio")["ventas_semana"].sum()
             .sort_index()
             .asfreq("W-MON")
-            .fillna(method="ffill")
+            .ffill()
         )
         if serie.count() < 12:
             continue
-        model, order, aic = _fit_best_model(serie)
+        series_by_categoria[categoria] = serie
+
+    if search not in ("stepwise", "grid"):
+        raise ValueError(f"Busqueda de ordenes desconocida: {search}")
+    order_cache = order_cache or output_dir / ORDER_CACHE_FILE
+    cached_orders = load_order_cache(order_cache) if search == "stepwise" else {}
+    fit_options = {"search": search, "initial_orders": cached_orders, "max_fits": max_fits}
+
+    tareas = len(series_by_categoria) * (len(_candidate_orders()) if search == "grid" else 1)
+    workers = resolve_n_jobs(n_jobs, tareas)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            modelos = _fit_all(series_by_categoria, executor, **fit_options)
+    else:
+        modelos = _fit_all(series_by_categoria, None, **fit_options)
+
+    save_order_cache(
+        order_cache,
+        {**load_order_cache(order_cache), **{cat: order for cat, (_, order, _) in modelos.items()}},
+    )
+
+    resultados: List[pd.DataFrame] = []
+    metadata_rows: List[Dict[str, object]] = []
+
+    for categoria, serie in series_by_categoria.items():
+        if categoria not in modelos:
+            continue
+        model, order, aic = modelos[categoria]
         result = _prepare_result(
             categoria,
             model,
@@ -21,7 +21,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import numpy as np
 import pandas as pd
@@ -32,20 +32,16 @@ from src.utils.load_data import ensure_directory
 @dataclass
 class PronosticoSimple:
     """
-    Resultado de pronóstico para una categoría.
+    Resultado de pronóstico para todas las series (categorías o SKUs) a la vez.
 
     Atributos:
-        categoria: Nombre de la categoría
-        history: Datos históricos observados
+        history: Datos históricos observados (una fila por serie y semana)
         forecast: Pronóstico futuro con intervalos de confianza
-        metodo: Método utilizado (promedio móvil, tendencia, etc.)
-        parametros: Parámetros del método (ej: ventana=8 semanas)
+        metadata: Método y parámetros de cada serie (ej: ventana=8 semanas)
     """
-    categoria: str
     history: pd.DataFrame
     forecast: pd.DataFrame
-    metodo: str
-    parametros: Dict[str, object]
+    metadata: pd.DataFrame
 
 
 def _parse_semana(ventas: pd.DataFrame) -> pd.DataFrame:
@@ -56,35 +52,87 @@ def _parse_semana(ventas: pd.DataFrame) -> pd.DataFrame:
     """
     ventas = ventas.copy()
     ventas["semana_inicio"] = pd.to_datetime(
-        ventas["semana_iso"] + "-1", format="%G-W%V-%u"
+        ventas["semana_iso"].astype(str) + "-1", format="%G-W%V-%u"
     )
     ventas = ventas.sort_values("semana_inicio")
     return ventas
 
 
+def _matriz_semanal(
+    ventas: pd.DataFrame,
+    id_col: str,
+    ids: List[object],
+) -> tuple[pd.DatetimeIndex, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pivotea las ventas a una matriz semanas × series.
+
+    Cada columna cubre solo su propio rango (primera a última semana con
+    ventas); las semanas faltantes dentro del rango se rellenan con la semana
+    anterior y fuera del rango quedan en NaN.
+
+    Returns:
+        (semanas, matriz, inicio, fin)
+        - semanas: Lunes de cada fila de la matriz
+        - matriz: Ventas semanales (semanas × series)
+        - inicio / fin: Fila de la primera y última semana de cada serie
+    """
+    tabla = (
+        ventas[ventas[id_col].isin(ids)]
+        .groupby(["semana_inicio", id_col], observed=True)["ventas_semana"]
+        .sum()
+        .unstack(id_col)
+        .reindex(columns=ids)
+    )
+    semanas = pd.date_range(tabla.index.min(), tabla.index.max(), freq="W-MON")
+    tabla = tabla.reindex(semanas)
+
+    observada = tabla.notna().to_numpy()
+    inicio = observada.argmax(axis=0)
+    fin = len(semanas) - 1 - observada[::-1].argmax(axis=0)
+
+    matriz = tabla.ffill().to_numpy(dtype=float)
+    filas = np.arange(len(semanas))[:, None]
+    matriz[(filas < inicio) | (filas > fin)] = np.nan
+    return semanas, matriz, inicio, fin
+
+
 def _calcular_promedio_movil(
-    serie: pd.Series,
+    matriz: np.ndarray,
+    inicio: np.ndarray,
+    fin: np.ndarray,
     ventana: int = 8
-) -> tuple[float, float]:
+) -> tuple[np.ndarray, np.ndarray]:
     """
-    Calcula el promedio móvil y su desviación estándar.
+    Calcula el promedio móvil y su desviación estándar de cada serie.
 
     Args:
-        serie: Serie temporal de ventas
+        matriz: Ventas semanales (semanas × series)
+        inicio / fin: Primera y última fila de cada serie
         ventana: Número de semanas a promediar
 
     Returns:
         (promedio, desviacion): Promedio y desviación estándar de las últimas N semanas
     """
-    ultimas_semanas = serie.tail(ventana)
-    promedio = ultimas_semanas.mean()
-    desviacion = ultimas_semanas.std()
+    filas = fin[None, :] - (ventana - 1) + np.arange(ventana)[:, None]
+    en_rango = filas >= inicio[None, :]
+    ultimas_semanas = np.where(
+        en_rango,
+        matriz[np.maximum(filas, 0), np.arange(matriz.shape[1])[None, :]],
+        0.0,
+    )
+
+    n = en_rango.sum(axis=0)
+    promedio = ultimas_semanas.sum(axis=0) / n
+    desvios = np.where(en_rango, ultimas_semanas - promedio, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        desviacion = np.sqrt((desvios**2).sum(axis=0) / (n - 1))
+    desviacion[n < 2] = np.nan
     return promedio, desviacion
 
 
-def _calcular_tendencia(serie: pd.Series) -> float:
+def _calcular_tendencia(matriz: np.ndarray, inicio: np.ndarray) -> np.ndarray:
     """
-    Calcula la tendencia lineal de la serie.
+    Calcula la tendencia lineal de cada serie.
 
     Retorna el cambio promedio por semana (positivo = crecimiento, negativo = decrecimiento)
 
@@ -92,63 +140,72 @@ def _calcular_tendencia(serie: pd.Series) -> float:
         Si las ventas aumentan 100 unidades/semana -> retorna 100.0
         Si las ventas disminuyen 50 unidades/semana -> retorna -50.0
     """
-    if len(serie) < 4:
-        return 0.0
-
-    # Regresión lineal simple: y = a + b*x
-    x = np.arange(len(serie))
-    y = serie.values
-
-    # Calcular pendiente (b)
-    n = len(x)
-    pendiente = (n * np.sum(x * y) - np.sum(x) * np.sum(y)) / (n * np.sum(x**2) - np.sum(x)**2)
+    # Regresión lineal simple: y = a + b*x, con x = semanas desde el inicio de cada serie
+    valida = ~np.isnan(matriz)
+    x = np.where(valida, np.arange(matriz.shape[0])[:, None] - inicio[None, :], 0.0)
+    y = np.where(valida, matriz, 0.0)
+
+    # Calcular pendiente (b) de todas las series a la vez
+    n = valida.sum(axis=0)
+    sum_x = x.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pendiente = (n * (x * y).sum(axis=0) - sum_x * y.sum(axis=0)) / (
+            n * (x**2).sum(axis=0) - sum_x**2
+        )
 
-    return pendiente
+    return np.where(n < 4, 0.0, pendiente)
 
 
 def _generar_pronostico(
-    serie: pd.Series,
+    matriz: np.ndarray,
+    inicio: np.ndarray,
+    fin: np.ndarray,
     steps: int = 8,
     ventana_promedio: int = 8,
     usar_tendencia: bool = True
-) -> tuple[np.ndarray, np.ndarray, np.ndarray, str, dict]:
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, List[str], dict]:
     """
-    Genera pronóstico usando promedio móvil con tendencia opcional.
+    Genera pronósticos usando promedio móvil con tendencia opcional.
 
     Args:
-        serie: Serie temporal de ventas semanales
+        matriz: Ventas semanales (semanas × series), ver ``_matriz_semanal``
+        inicio / fin: Primera y última fila de cada serie
         steps: Número de semanas a pronosticar
         ventana_promedio: Ventana para calcular el promedio móvil
         usar_tendencia: Si True, ajusta por tendencia lineal
 
     Returns:
-        (valores, lower, upper, metodo, params)
-        - valores: Pronóstico central
+        (valores, lower, upper, metodos, params)
+        - valores: Pronóstico central (steps × series)
         - lower: Límite inferior (intervalo 80%)
         - upper: Límite superior (intervalo 80%)
-        - metodo: Descripción del método usado
-        - params: Parámetros utilizados
+        - metodos: Descripción del método usado en cada serie
+        - params: Parámetros utilizados (un array por parámetro)
     """
-    promedio, desviacion = _calcular_promedio_movil(serie, ventana_promedio)
-    tendencia = _calcular_tendencia(serie) if usar_tendencia else 0.0
+    promedio, desviacion = _calcular_promedio_movil(matriz, inicio, fin, ventana_promedio)
+    tendencia = (
+        _calcular_tendencia(matriz, inicio) if usar_tendencia else np.zeros(matriz.shape[1])
+    )
 
-    # Generar pronósticos
-    valores = np.zeros(steps)
-    for i in range(steps):
-        # Promedio base + tendencia acumulada
-        valores[i] = promedio + tendencia * (i + 1)
+    # Promedio base + tendencia acumulada, para cada semana futura y cada serie
+    horizonte = np.arange(steps)[:, None]
+    valores = promedio + tendencia * (horizonte + 1)
 
     # Intervalos de confianza (±1.28 desviaciones estándar = 80% confianza)
     # Nota: El intervalo se amplía con el horizonte de pronóstico
-    lower = valores - 1.28 * desviacion * np.sqrt(1 + np.arange(steps) * 0.1)
-    upper = valores + 1.28 * desviacion * np.sqrt(1 + np.arange(steps) * 0.1)
+    lower = valores - 1.28 * desviacion * np.sqrt(1 + horizonte * 0.1)
+    upper = valores + 1.28 * desviacion * np.sqrt(1 + horizonte * 0.1)
 
     # No permitir ventas negativas
     lower = np.maximum(lower, 0)
 
-    metodo = f"Promedio Móvil ({ventana_promedio} sem)"
-    if usar_tendencia and abs(tendencia) > 0.01:
-        metodo += f" + Tendencia ({tendencia:+.1f} unid/sem)"
+    metodo_base = f"Promedio Móvil ({ventana_promedio} sem)"
+    metodos = [
+        metodo_base + f" + Tendencia ({t:+.1f} unid/sem)"
+        if usar_tendencia and abs(t) > 0.01
+        else metodo_base
+        for t in tendencia
+    ]
 
     params = {
         "ventana": ventana_promedio,
@@ -157,72 +214,121 @@ def _generar_pronostico(
         "desviacion": desviacion
     }
 
-    return valores, lower, upper, metodo, params
+    return valores, lower, upper, metodos, params
 
 
 def _preparar_resultado(
-    categoria: str,
-    serie: pd.Series,
+    id_col: str,
+    ids: np.ndarray,
+    semanas: pd.DatetimeIndex,
+    matriz: np.ndarray,
+    fin: np.ndarray,
     valores: np.ndarray,
     lower: np.ndarray,
     upper: np.ndarray,
-    metodo: str,
-    parametros: dict
-) -> PronosticoSimple:
+) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
-    Prepara el resultado del pronóstico en formato DataFrame.
+    Prepara histórico y pronóstico en formato largo (serie por serie).
     """
-    # Histórico
-    history_df = serie.reset_index()
-    history_df.columns = ["semana_inicio", "ventas_semana"]
-    history_df["categoria"] = categoria
-    history_df["tipo"] = "observado"
-    history_df["ventas_semana_lower"] = np.nan
-    history_df["ventas_semana_upper"] = np.nan
-
-    # Pronóstico
-    ultima_fecha = serie.index[-1]
-    fechas_futuras = pd.date_range(
-        start=ultima_fecha + pd.Timedelta(weeks=1),
-        periods=len(valores),
-        freq="W-MON"
-    )
+    # Histórico: celdas dentro del rango de cada serie, ordenadas por serie y semana
+    serie_hist, semana_hist = np.nonzero(~np.isnan(matriz.T))
+    history_df = pd.DataFrame({
+        "semana_inicio": semanas[semana_hist],
+        "ventas_semana": matriz[semana_hist, serie_hist],
+        id_col: ids[serie_hist],
+        "tipo": "observado",
+        "ventas_semana_lower": np.nan,
+        "ventas_semana_upper": np.nan
+    })
 
+    # Pronóstico: semanas siguientes a la última observada de cada serie
+    steps = valores.shape[0]
+    fechas_futuras = (
+        semanas.to_numpy()[fin][:, None] + np.arange(1, steps + 1) * np.timedelta64(7, "D")
+    )
     forecast_df = pd.DataFrame({
-        "semana_inicio": fechas_futuras,
-        "ventas_semana": valores,
-        "categoria": categoria,
+        "semana_inicio": fechas_futuras.ravel(),
+        "ventas_semana": valores.T.ravel(),
+        id_col: np.repeat(ids, steps),
         "tipo": "forecast",
-        "ventas_semana_lower": lower,
-        "ventas_semana_upper": upper
+        "ventas_semana_lower": lower.T.ravel(),
+        "ventas_semana_upper": upper.T.ravel()
     })
 
-    return PronosticoSimple(
-        categoria=categoria,
-        history=history_df,
-        forecast=forecast_df,
-        metodo=metodo,
-        parametros=parametros
+    return history_df, forecast_df
+
+
+def pronosticar_series(
+    ventas: pd.DataFrame,
+    ids: List[object],
+    *,
+    id_col: str = "categoria",
+    forecast_steps: int = 8,
+    ventana_promedio: int = 8,
+    min_semanas: int = 12
+) -> PronosticoSimple:
+    """
+    Pronostica todas las series de ``ids`` con operaciones de matriz.
+
+    ``ventas`` debe tener las columnas [semana_inicio, ``id_col``, ventas_semana]
+    (ver ``_parse_semana``). Las series con menos de ``min_semanas`` semanas
+    se descartan. Las filas de salida siguen el orden de ``ids``: para cada
+    serie, primero su histórico y luego su pronóstico.
+    """
+    semanas, matriz, inicio, fin = _matriz_semanal(ventas, id_col, ids)
+
+    # Requerir mínimo de semanas de datos (~3 meses por defecto)
+    observaciones = fin - inicio + 1
+    suficientes = observaciones >= min_semanas
+    ids_validos = np.asarray(ids, dtype=object)[suficientes]
+    matriz, inicio, fin = matriz[:, suficientes], inicio[suficientes], fin[suficientes]
+    observaciones = observaciones[suficientes]
+
+    valores, lower, upper, metodos, params = _generar_pronostico(
+        matriz,
+        inicio,
+        fin,
+        steps=forecast_steps,
+        ventana_promedio=ventana_promedio,
+        usar_tendencia=True
     )
+    history_df, forecast_df = _preparar_resultado(
+        id_col, ids_validos, semanas, matriz, fin, valores, lower, upper
+    )
+
+    metadata = pd.DataFrame({
+        id_col: ids_validos,
+        "metodo": metodos,
+        "ventana_promedio": params["ventana"],
+        "tendencia_semanal": params["tendencia_semanal"],
+        "promedio_base": params["promedio_base"],
+        "desviacion_std": params["desviacion"],
+        "observaciones": observaciones.astype(np.int64)
+    })
+
+    return PronosticoSimple(history=history_df, forecast=forecast_df, metadata=metadata)
 
 
 def generate_forecasts(
     ventas_semanales_categoria: pd.DataFrame,
     output_dir: Path,
     *,
-    top_n: int = 10,
+    top_n: Optional[int] = 10,
     forecast_steps: int = 8,
-    ventana_promedio: int = 8
+    ventana_promedio: int = 8,
+    id_col: str = "categoria"
 ) -> Dict[str, Path]:
     """
-    Genera pronósticos de ventas para las principales categorías.
+    Genera pronósticos de ventas para las principales categorías (o SKUs).
 
     Args:
-        ventas_semanales_categoria: DataFrame con columnas [semana_iso, categoria, ventas_semana]
+        ventas_semanales_categoria: DataFrame con columnas [semana_iso, ``id_col``, ventas_semana]
         output_dir: Directorio donde guardar los resultados
-        top_n: Número de categorías principales a pronosticar
+        top_n: Número de series principales a pronosticar (None = todas)
         forecast_steps: Número de semanas a pronosticar
         ventana_promedio: Ventana del promedio móvil (default: 8 semanas = 2 meses)
+        id_col: Columna que identifica cada serie; "producto_id" junto con
+            ``build_ventas_semanales_producto`` da pronósticos por SKU
 
     Returns:
         Diccionario con paths a los archivos generados:
@@ -245,68 +351,37 @@ def generate_forecasts(
     ensure_directory(output_dir)
     ventas = _parse_semana(ventas_semanales_categoria)
 
-    # Seleccionar top N categorías por volumen total
-    top_categorias = (
-        ventas.groupby("categoria")["ventas_semana"]
-        .sum()
-        .nlargest(top_n)
-        .index.tolist()
-    )
-
-    resultados: List[pd.DataFrame] = []
-    metadata_rows: List[Dict[str, object]] = []
-
-    for categoria in top_categorias:
-        # Preparar serie temporal
-        serie_categoria = ventas[ventas["categoria"] == categoria]
-        serie = (
-            serie_categoria.groupby("semana_inicio")["ventas_semana"]
-            .sum()
-            .sort_index()
-            .asfreq("W-MON")
-            .fillna(method="ffill")
-        )
-
-        # Requerir mínimo 12 semanas de datos (~3 meses)
-        if serie.count() < 12:
-            continue
-
-        # Generar pronóstico
-        valores, lower, upper, metodo, params = _generar_pronostico(
-            serie,
-            steps=forecast_steps,
-            ventana_promedio=ventana_promedio,
-            usar_tendencia=True
-        )
-
-        # Preparar resultado
-        result = _preparar_resultado(
-            categoria, serie, valores, lower, upper, metodo, params
-        )
+    # Seleccionar top N series por volumen total
+    totales = ventas.groupby(id_col, observed=True)["ventas_semana"].sum()
+    top_ids = totales.nlargest(top_n if top_n is not None else len(totales)).index.tolist()
+    if not top_ids:
+        return {}
 
-        resultados.append(result.history)
-        resultados.append(result.forecast)
-
-        # Guardar metadata
-        metadata_rows.append({
-            "categoria": categoria,
-            "metodo": metodo,
-            "ventana_promedio": params["ventana"],
-            "tendencia_semanal": params["tendencia_semanal"],
-            "promedio_base": params["promedio_base"],
-            "desviacion_std": params["desviacion"],
-            "observaciones": serie.count()
-        })
-
-    if not resultados:
+    # Todas las series se pronostican en un único paso vectorizado
+    resultado = pronosticar_series(
+        ventas,
+        top_ids,
+        id_col=id_col,
+        forecast_steps=forecast_steps,
+        ventana_promedio=ventana_promedio
+    )
+    if resultado.metadata.empty:
         return {}
 
+    # Intercalar histórico y pronóstico de cada serie (mismo orden que top_ids)
+    posicion = {valor: i for i, valor in enumerate(resultado.metadata[id_col])}
+    combinado = pd.concat([resultado.history, resultado.forecast], ignore_index=True)
+    orden = np.lexsort((
+        np.repeat([0, 1], [len(resultado.history), len(resultado.forecast)]),
+        combinado[id_col].map(posicion).to_numpy(),
+    ))
+
     # Guardar resultados
     forecast_path = output_dir / "prediccion_ventas_semanal.parquet"
     metadata_path = output_dir / "prediccion_ventas_semanal_modelos.parquet"
 
-    pd.concat(resultados, ignore_index=True).to_parquet(forecast_path, index=False)
-    pd.DataFrame(metadata_rows).to_parquet(metadata_path, index=False)
+    combinado.iloc[orden].reset_index(drop=True).to_parquet(forecast_path, index=False)
+    resultado.metadata.to_parquet(metadata_path, index=False)
 
     return {
         "forecast": forecast_path,
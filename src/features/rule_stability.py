@@ -0,0 +1,199 @@
+"""Bootstrap stability of association rules.
+
+Rules are mined again on ``B`` bootstrap resamples of the tickets (rows of
+the ticket x item matrix drawn with replacement). Each rule reports the
+share of resamples in which it passed the thresholds and a percentile
+interval of its lift over those resamples.
+
+The encoded matrix is written once as ``.npy`` CSR arrays and every worker
+opens them with ``mmap_mode="r"``, so the pool shares the OS page cache
+instead of receiving a pickled copy of the matrix per task.
+"""
+
+from __future__ import annotations
+
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from src.data_prep.productos import build_dim_producto
+from src.features.itemsets import Transactions, encode_transactions
+from src.features.market_basket import decorate_rules, mine_rules
+from src.utils.load_data import ensure_directory
+from src.utils.parallel import resolve_n_jobs
+
+
+STABILITY_COLUMNS = [
+    "antecedents",
+    "consequents",
+    "apariciones",
+    "frecuencia",
+    "lift_medio",
+    "lift_ic_inf",
+    "lift_ic_sup",
+    "confianza_media",
+]
+
+RuleKey = Tuple[Tuple[int, ...], Tuple[int, ...]]
+
+
+def save_csr_arrays(matrix: sparse.csr_matrix, directory: Path) -> Path:
+    """Write ``indptr``/``indices`` (and the shape) of a boolean CSR matrix as .npy files."""
+    ensure_directory(directory)
+    np.save(directory / "indptr.npy", matrix.indptr)
+    np.save(directory / "indices.npy", matrix.indices)
+    np.save(directory / "shape.npy", np.asarray(matrix.shape, dtype=np.int64))
+    return directory
+
+
+def load_csr_arrays(directory: Path) -> sparse.csr_matrix:
+    """Boolean CSR matrix over memory-mapped ``indptr``/``indices`` arrays."""
+    indptr = np.load(directory / "indptr.npy", mmap_mode="r")
+    indices = np.load(directory / "indices.npy", mmap_mode="r")
+    shape = tuple(int(value) for value in np.load(directory / "shape.npy"))
+    data = np.ones(len(indices), dtype=bool)
+    return sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+
+
+def _bootstrap_rules(
+    directory: Path, seed: int, options: dict
+) -> Tuple[List[RuleKey], np.ndarray, np.ndarray]:
+    """Mine one resample; rules are keyed by item positions to keep results small."""
+    matrix = load_csr_arrays(directory)
+    n_tickets, n_items = matrix.shape
+    rows = np.random.default_rng(seed).integers(0, n_tickets, size=n_tickets)
+    rules = mine_rules(
+        Transactions(
+            matrix=matrix[rows],
+            items=np.arange(n_items),
+            ticket_ids=rows,
+        ),
+        min_support=options["min_support"],
+        min_confidence=options["min_confidence"],
+        max_len=options["max_len"],
+    )
+    rules = rules[rules["lift"] >= options["min_lift"]]
+    keys = [
+        (tuple(sorted(map(int, antecedent))), tuple(sorted(map(int, consequent))))
+        for antecedent, consequent in zip(rules["antecedents"], rules["consequents"])
+    ]
+    return (
+        keys,
+        rules["lift"].to_numpy(dtype=float),
+        rules["confidence"].to_numpy(dtype=float),
+    )
+
+
+def rule_stability(
+    transactions: Transactions,
+    *,
+    n_boot: int = 100,
+    min_support: float = 0.005,
+    min_confidence: float = 0.15,
+    min_lift: float = 1.0,
+    max_len: Optional[int] = None,
+    level: float = 0.90,
+    seed: int = 42,
+    n_jobs: Optional[int] = -1,
+    work_dir: Optional[Path] = None,
+) -> pd.DataFrame:
+    """Appearance frequency and lift interval of every rule over ``n_boot`` resamples.
+
+    Resample ``b`` uses seed ``seed + b``, so results do not depend on
+    ``n_jobs``. ``lift_ic_inf``/``lift_ic_sup`` are the ``level`` percentile
+    interval of the lift over the resamples in which the rule appeared.
+    ``work_dir`` holds the memory-mapped arrays (a temporary directory by
+    default).
+    """
+    if transactions.n_transactions == 0 or n_boot <= 0:
+        return pd.DataFrame(columns=STABILITY_COLUMNS)
+    options = {
+        "min_support": min_support,
+        "min_confidence": min_confidence,
+        "min_lift": min_lift,
+        "max_len": max_len,
+    }
+    seeds = [seed + b for b in range(n_boot)]
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        directory = save_csr_arrays(transactions.matrix.tocsr(), Path(tmp))
+        workers = resolve_n_jobs(n_jobs, n_boot)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(_bootstrap_rules, directory, value, options) for value in seeds
+                ]
+                resultados = [future.result() for future in futures]
+        else:
+            resultados = [_bootstrap_rules(directory, value, options) for value in seeds]
+
+    lifts: Dict[RuleKey, List[float]] = {}
+    confianzas: Dict[RuleKey, List[float]] = {}
+    for keys, lift, confidence in resultados:
+        for position, key in enumerate(keys):
+            lifts.setdefault(key, []).append(lift[position])
+            confianzas.setdefault(key, []).append(confidence[position])
+    if not lifts:
+        return pd.DataFrame(columns=STABILITY_COLUMNS)
+
+    cola = (1.0 - level) / 2 * 100
+    items = transactions.items
+    filas = []
+    for key, valores in lifts.items():
+        valores = np.asarray(valores)
+        inferior, superior = np.percentile(valores, [cola, 100 - cola])
+        filas.append(
+            (
+                frozenset(items[list(key[0])]),
+                frozenset(items[list(key[1])]),
+                len(valores),
+                len(valores) / n_boot,
+                float(valores.mean()),
+                float(inferior),
+                float(superior),
+                float(np.mean(confianzas[key])),
+            )
+        )
+    estabilidad = pd.DataFrame(filas, columns=STABILITY_COLUMNS)
+    return estabilidad.sort_values(
+        ["frecuencia", "lift_medio"], ascending=False, kind="mergesort"
+    ).reset_index(drop=True)
+
+
+def run_rule_stability(
+    detalle: pd.DataFrame,
+    output_dir: Path,
+    *,
+    n_boot: int = 100,
+    min_support: float = 0.005,
+    min_confidence: float = 0.15,
+    min_lift: float = 1.0,
+    item_col: str = "producto_id",
+    max_len: Optional[int] = None,
+    n_jobs: Optional[int] = -1,
+    productos: Optional[pd.DataFrame] = None,
+) -> Dict[str, Path]:
+    """Export ``reglas_estabilidad.parquet`` with the bootstrap stability of each rule."""
+    ensure_directory(output_dir)
+    if productos is None and item_col == "producto_id":
+        productos = build_dim_producto(detalle)
+    estabilidad = rule_stability(
+        encode_transactions(detalle, item_col=item_col),
+        n_boot=n_boot,
+        min_support=min_support,
+        min_confidence=min_confidence,
+        min_lift=min_lift,
+        max_len=max_len,
+        n_jobs=n_jobs,
+        work_dir=output_dir,
+    )
+    if estabilidad.empty:
+        return {}
+    path = output_dir / "reglas_estabilidad.parquet"
+    decorate_rules(estabilidad, productos).to_parquet(path, index=False)
+    return {"reglas_estabilidad": path}
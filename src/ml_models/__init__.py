@@ -9,6 +9,7 @@ from .ticket_predictor import TicketPredictor
 from .combo_simulator import ComboSimulator
 from .marca_propia_estimator import MarcaPropiaEstimator
 from .cross_sell_optimizer import CrossSellOptimizer
+from .rule_index import RuleIndex
 from .upselling_detector import UpsellingDetector
 from .fidelizacion_simulator import FidelizacionSimulator
 from .strategy_validator import StrategyValidator
@@ -18,6 +19,7 @@ __all__ = [
     "ComboSimulator",
     "MarcaPropiaEstimator",
     "CrossSellOptimizer",
+    "RuleIndex",
     "UpsellingDetector",
     "FidelizacionSimulator",
     "StrategyValidator",
@@ -3,13 +3,15 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
-from typing import Iterable, Optional
+from typing import Iterable, List, Optional
 
 import numpy as np
 import pandas as pd
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.linear_model import LogisticRegression
 
+from src.data_prep.productos import build_dim_producto, match_productos
+
 
 @dataclass
 class ComboSimulator:
@@ -20,9 +22,14 @@ class ComboSimulator:
     model that approximates how frequently the combo should appear under
     comparable conditions. The simulator uses simple heuristics so it can
     operate quickly on aggregated ticket data.
+
+    Combo members are name patterns resolved to ``producto_id`` codes once
+    through the product dimension (``productos``, built from ``detalle``
+    when not given); tickets are then matched on the codes.
     """
 
     combo_products: Iterable[str] = ("FERNET", "COCA")
+    productos: Optional[pd.DataFrame] = None
     probability_model: LogisticRegression = field(
         default_factory=lambda: LogisticRegression(max_iter=1000)
     )
@@ -55,18 +62,33 @@ class ComboSimulator:
 
         return df
 
+    def resolve_combo_products(self, detalle: pd.DataFrame) -> List[np.ndarray]:
+        """producto_id codes whose name matches each combo member."""
+        productos = self.productos if self.productos is not None else build_dim_producto(detalle)
+        return [match_productos(productos, product) for product in self.combo_products]
+
     def identify_combo_tickets(self, detalle: pd.DataFrame) -> pd.Series:
         """Return ticket ids that purchased every product in the combo."""
-        tickets_sets = []
-        for product in self.combo_products:
-            mask = detalle["descripcion"].str.contains(product, case=False, na=False)
-            tickets_sets.append(set(detalle.loc[mask, "ticket_id"].unique()))
-
-        if not tickets_sets:
+        miembros = self.resolve_combo_products(detalle)
+        if not miembros:
             return pd.Index([])
 
-        combo_ticket_ids = set.intersection(*tickets_sets)
-        return pd.Index(sorted(combo_ticket_ids))
+        ticket_codes, ticket_ids = pd.factorize(detalle["ticket_id"])
+        productos = detalle["producto_id"]
+        if isinstance(productos.dtype, pd.CategoricalDtype):
+            producto_codes, codigos = productos.cat.codes.to_numpy(), productos.cat.categories
+        else:
+            producto_codes, codigos = pd.factorize(productos)
+        codigos = pd.Index(codigos).astype(str)
+
+        valid = ticket_codes >= 0
+        combo = np.ones(len(ticket_ids), dtype=bool)
+        for ids in miembros:
+            lineas = valid & np.isin(producto_codes, np.flatnonzero(codigos.isin(ids)))
+            compra = np.zeros(len(ticket_ids), dtype=bool)
+            compra[ticket_codes[lineas]] = True
+            combo &= compra
+        return pd.Index(np.sort(np.asarray(ticket_ids)[combo]))
 
     def _prepare_ticket_features(self, tickets: pd.DataFrame) -> pd.DataFrame:
         tickets = self._augment_ticket_frame(tickets)
@@ -2,11 +2,14 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
 
 import numpy as np
 import pandas as pd
 
+from .rule_index import RuleIndex
+
 
 @dataclass
 class CrossSellOptimizer:
@@ -15,6 +18,7 @@ class CrossSellOptimizer:
     """
 
     reglas: pd.DataFrame
+    index_: Optional[RuleIndex] = field(default=None, init=False, repr=False)
 
     def __post_init__(self) -> None:
         rename_map = {
@@ -53,6 +57,18 @@ class CrossSellOptimizer:
 
         return opportunities.reset_index(drop=True)
 
+    def recommend_for_basket(
+        self,
+        basket: Iterable[str],
+        *,
+        top_n: int = 5,
+        metric: str = "lift",
+    ) -> pd.DataFrame:
+        """Best consequents to suggest for a partial basket (indexed lookup)."""
+        if self.index_ is None:
+            self.index_ = RuleIndex.from_rules(self.reglas)
+        return self.index_.recommend_frame(basket, top_n=top_n, metric=metric)
+
     def simulate_layout_change(
         self,
         opportunities: pd.DataFrame,
@@ -64,16 +64,16 @@ class MarcaPropiaEstimator:
 
         if "ventas" not in pareto_df.columns:
             ventas_map = (
-                detalle.groupby("categoria")["importe_total"].sum()
+                detalle.groupby("categoria", observed=True)["importe_total"].sum()
                 if "importe_total" in detalle.columns
                 else pd.Series(dtype=float)
             )
-            pareto_df["ventas"] = pareto_df["categoria"].map(ventas_map).fillna(0.0)
+            pareto_df["ventas"] = pareto_df["categoria"].map(ventas_map).astype(float).fillna(0.0)
 
         if "margen_pct" not in pareto_df.columns:
             if "rentabilidad_pct" in detalle.columns:
-                margen_map = detalle.groupby("categoria")["rentabilidad_pct"].mean() / 100.0
-                pareto_df["margen_pct"] = pareto_df["categoria"].map(margen_map).fillna(0.30)
+                margen_map = detalle.groupby("categoria", observed=True)["rentabilidad_pct"].mean() / 100.0
+                pareto_df["margen_pct"] = pareto_df["categoria"].map(margen_map).astype(float).fillna(0.30)
             else:
                 pareto_df["margen_pct"] = 0.30
 
@@ -0,0 +1,220 @@
+"""In-memory lookup index over association rules for basket completion."""
+
+from __future__ import annotations
+
+import heapq
+from dataclasses import dataclass, field
+from itertools import combinations
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+INDEX_METRICS = ("lift", "confidence")
+
+
+@dataclass(frozen=True)
+class RuleMatch:
+    """One suggested consequent and the best rule that produced it."""
+
+    consequent: frozenset
+    antecedent: frozenset
+    support: float
+    confidence: float
+    lift: float
+
+
+@dataclass
+class _IndexState:
+    antecedent_sizes: Tuple[int, ...]
+    known_items: frozenset
+    # antecedent -> rule positions sorted by metric (descending), per metric
+    by_antecedent: Dict[str, Dict[frozenset, Tuple[int, ...]]]
+    antecedents: List[frozenset]
+    consequents: List[frozenset]
+    support: np.ndarray
+    confidence: np.ndarray
+    lift: np.ndarray
+
+
+@dataclass
+class RuleIndex:
+    """
+    Hash index of rules keyed by their antecedent itemset.
+
+    A query enumerates the subsets of the basket (restricted to items that
+    appear in some antecedent and to the antecedent sizes actually present)
+    and reads the pre-sorted rule lists of the matching antecedents, so the
+    cost depends on the basket size, not on the number of rules. Rules whose
+    consequent overlaps the basket are skipped and each consequent keeps its
+    best-scoring rule.
+
+    Items are the ``producto_id`` codes of ``antecedents_ids`` /
+    ``consequents_ids`` when the rules carry them (``by_id``), otherwise the
+    ", "-joined labels of ``antecedents`` / ``consequents``.
+
+    Build it with ``from_parquet`` (``reglas.parquet``) or ``from_rules``;
+    ``reload`` rebuilds from the file only when its mtime changed, replacing
+    the index in a single assignment so concurrent readers see either the old
+    or the new rules.
+    """
+
+    path: Optional[Path] = None
+    separator: str = ", "
+    by_id: bool = True
+    mtime_: Optional[float] = field(default=None, init=False)
+    _state: Optional[_IndexState] = field(default=None, init=False, repr=False)
+
+    @classmethod
+    def from_parquet(
+        cls, path: Path, *, separator: str = ", ", by_id: bool = True
+    ) -> "RuleIndex":
+        index = cls(path=Path(path), separator=separator, by_id=by_id)
+        index.reload()
+        return index
+
+    @classmethod
+    def from_rules(
+        cls, reglas: pd.DataFrame, *, separator: str = ", ", by_id: bool = True
+    ) -> "RuleIndex":
+        index = cls(separator=separator, by_id=by_id)
+        index._state = index._build(reglas)
+        return index
+
+    def reload(self, *, force: bool = False) -> bool:
+        """Rebuild from ``path`` if the file changed; returns True when rebuilt."""
+        if self.path is None:
+            raise ValueError("RuleIndex sin archivo de origen: use from_rules para reconstruir")
+        mtime = self.path.stat().st_mtime
+        if not force and self._state is not None and mtime == self.mtime_:
+            return False
+        self._state = self._build(pd.read_parquet(self.path))
+        self.mtime_ = mtime
+        return True
+
+    @property
+    def items(self) -> frozenset:
+        """Items that appear in some antecedent (the ones a query can match)."""
+        return frozenset() if self._state is None else self._state.known_items
+
+    def __len__(self) -> int:
+        return 0 if self._state is None else len(self._state.antecedents)
+
+    def _itemset(self, value) -> frozenset:
+        if isinstance(value, str):
+            return frozenset(part.strip() for part in value.split(self.separator) if part.strip())
+        if isinstance(value, (set, frozenset, list, tuple, np.ndarray)):
+            return frozenset(value)
+        return frozenset([value])
+
+    def _build(self, reglas: pd.DataFrame) -> _IndexState:
+        reglas = reglas.rename(columns={"antecedent": "antecedents", "consequent": "consequents"})
+        if self.by_id and {"antecedents_ids", "consequents_ids"}.issubset(reglas.columns):
+            reglas = reglas.drop(columns=["antecedents", "consequents"]).rename(
+                columns={"antecedents_ids": "antecedents", "consequents_ids": "consequents"}
+            )
+        missing = {"antecedents", "consequents", "support", "confidence", "lift"}.difference(
+            reglas.columns
+        )
+        if missing:
+            raise ValueError(f"Rules dataset missing columns: {sorted(missing)}")
+
+        antecedents = [self._itemset(value) for value in reglas["antecedents"]]
+        consequents = [self._itemset(value) for value in reglas["consequents"]]
+        scores = {metric: reglas[metric].to_numpy(dtype=float) for metric in INDEX_METRICS}
+
+        by_antecedent: Dict[str, Dict[frozenset, Tuple[int, ...]]] = {}
+        for metric, values in scores.items():
+            groups: Dict[frozenset, List[int]] = {}
+            for position in np.argsort(-values, kind="stable"):
+                groups.setdefault(antecedents[position], []).append(int(position))
+            by_antecedent[metric] = {key: tuple(rows) for key, rows in groups.items()}
+
+        return _IndexState(
+            antecedent_sizes=tuple(sorted({len(antecedent) for antecedent in antecedents})),
+            known_items=frozenset().union(*antecedents) if antecedents else frozenset(),
+            by_antecedent=by_antecedent,
+            antecedents=antecedents,
+            consequents=consequents,
+            support=reglas["support"].to_numpy(dtype=float),
+            confidence=scores["confidence"],
+            lift=scores["lift"],
+        )
+
+    def recommend(
+        self,
+        basket: Iterable[Hashable],
+        *,
+        top_n: int = 5,
+        metric: str = "lift",
+        min_confidence: float = 0.0,
+    ) -> List[RuleMatch]:
+        """Top ``top_n`` consequents for a partial basket, best first."""
+        if metric not in INDEX_METRICS:
+            raise ValueError(f"Metrica desconocida: {metric}. Opciones: {INDEX_METRICS}")
+        state = self._state
+        if state is None or top_n <= 0:
+            return []
+
+        basket = frozenset(basket)
+        relevant = sorted(basket & state.known_items, key=str)
+        lists = state.by_antecedent[metric]
+        values = state.lift if metric == "lift" else state.confidence
+
+        best: Dict[frozenset, int] = {}
+        for size in state.antecedent_sizes:
+            if size > len(relevant):
+                break
+            for combo in combinations(relevant, size):
+                rows = lists.get(frozenset(combo))
+                if rows is None:
+                    continue
+                taken = 0
+                for position in rows:
+                    consequent = state.consequents[position]
+                    if state.confidence[position] < min_confidence or not consequent.isdisjoint(basket):
+                        continue
+                    current = best.get(consequent)
+                    if current is None or values[position] > values[current]:
+                        best[consequent] = position
+                    taken += 1
+                    # Lists are sorted, so later rules of this antecedent cannot enter the top.
+                    if taken >= top_n:
+                        break
+
+        winners = heapq.nlargest(top_n, best.values(), key=lambda position: values[position])
+        return [
+            RuleMatch(
+                consequent=state.consequents[position],
+                antecedent=state.antecedents[position],
+                support=float(state.support[position]),
+                confidence=float(state.confidence[position]),
+                lift=float(state.lift[position]),
+            )
+            for position in winners
+        ]
+
+    def recommend_frame(
+        self,
+        basket: Iterable[Hashable],
+        *,
+        top_n: int = 5,
+        metric: str = "lift",
+        min_confidence: float = 0.0,
+    ) -> pd.DataFrame:
+        """``recommend`` as a DataFrame with the itemsets joined by ``separator``."""
+        matches = self.recommend(basket, top_n=top_n, metric=metric, min_confidence=min_confidence)
+        return pd.DataFrame(
+            {
+                "consequent": [self._join(match.consequent) for match in matches],
+                "antecedent": [self._join(match.antecedent) for match in matches],
+                "support": [match.support for match in matches],
+                "confidence": [match.confidence for match in matches],
+                "lift": [match.lift for match in matches],
+            }
+        )
+
+    def _join(self, itemset: frozenset) -> str:
+        return self.separator.join(sorted(str(item) for item in itemset))
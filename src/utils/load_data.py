@@ -2,12 +2,35 @@
 
 from __future__ import annotations
 
+import io
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Iterator, Optional
 
 import pandas as pd
 
 
+SALES_DTYPES: dict[str, str] = {
+    # Read as text: blank or malformed ticket numbers are dropped in prepare_detalle.
+    "Comprobante": "str",
+    "Departamento": "category",
+    "Marca": "category",
+    "Tipo medio de pago": "category",
+    "Cantidad": "float32",
+    "Unitario": "float32",
+    "Importe": "float64",
+    "Fecha": "str",
+    "Código": "str",
+    "Codigo": "str",
+    "Código barras": "str",
+    "Codigo barras": "str",
+    "Nombre": "str",
+    "TIPO FACTURA": "str",
+    "Emisor tarjeta": "str",
+}
+
+SALES_CHUNK_SIZE = 500_000
+
+
 def load_sales_data(
     sales_path: Path,
     *,
@@ -28,6 +51,76 @@ def load_sales_data(
     )
 
 
+class _CsvTail(io.RawIOBase):
+    """Header line of a CSV file followed by its bytes from ``offset`` on."""
+
+    def __init__(self, path: Path, offset: int) -> None:
+        self._handle = path.open("rb")
+        self._pending = self._handle.readline()
+        self._handle.seek(max(offset, len(self._pending)))
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._pending:
+            n = min(len(buffer), len(self._pending))
+            buffer[:n] = self._pending[:n]
+            self._pending = self._pending[n:]
+            return n
+        return self._handle.readinto(buffer)
+
+    def close(self) -> None:
+        self._handle.close()
+        super().close()
+
+
+def open_csv_tail(path: Path, offset: int) -> BinaryIO:
+    """Open ``path`` as a CSV holding only the header and the rows from byte ``offset``.
+
+    ``offset`` must fall at the start of a line; it is used to parse rows
+    appended to an export without re-reading the ones before them.
+    """
+    return io.BufferedReader(_CsvTail(path, offset))
+
+
+def iter_sales_data(
+    sales_path: Path,
+    *,
+    chunksize: int = SALES_CHUNK_SIZE,
+    sep: str = ";",
+    decimal: str = ",",
+    encoding: str = "utf-8",
+    dtype: Optional[dict[str, str]] = None,
+    offset: int = 0,
+) -> Iterator[pd.DataFrame]:
+    """Stream the sales dataset in fixed-size chunks with an explicit schema.
+
+    Only the columns present in the file header receive the typed schema, so
+    exports without payment columns keep working. ``offset`` skips to the
+    rows starting at that byte (see ``open_csv_tail``).
+    """
+    if not sales_path.exists():
+        raise FileNotFoundError(f"Sales file not found: {sales_path}")
+    schema = SALES_DTYPES if dtype is None else dtype
+    header = pd.read_csv(sales_path, sep=sep, encoding=encoding, nrows=0).columns
+    source = open_csv_tail(sales_path, offset) if offset else sales_path
+    reader = pd.read_csv(
+        source,
+        sep=sep,
+        decimal=decimal,
+        encoding=encoding,
+        dtype={column: kind for column, kind in schema.items() if column in header},
+        chunksize=chunksize,
+    )
+    try:
+        with reader:
+            yield from reader
+    finally:
+        if source is not sales_path:
+            source.close()
+
+
 def load_rentabilidad_data(rentabilidad_path: Path) -> pd.DataFrame:
     """Load rentabilidad dataset with margin by department."""
     if not rentabilidad_path.exists():
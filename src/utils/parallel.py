@@ -0,0 +1,17 @@
+"""Helpers shared by the process-pool execution modes."""
+
+from __future__ import annotations
+
+import os
+from typing import Optional
+
+
+def resolve_n_jobs(n_jobs: Optional[int], n_tasks: Optional[int] = None) -> int:
+    """Worker count for ``n_jobs`` (``None``/-1 = all cores), capped at ``n_tasks``."""
+    if n_jobs is None or n_jobs < 0:
+        workers = os.cpu_count() or 1
+    else:
+        workers = max(n_jobs, 1)
+    if n_tasks is not None:
+        workers = min(workers, max(n_tasks, 1))
+    return workers
@@ -0,0 +1,397 @@
+"""Columnar cache that converts raw CSV exports into partitioned Parquet once.
+
+Exports usually grow by appending rows. When the cached bytes are still an
+exact prefix of the source, only the appended tail is parsed and written as
+a new generation of part files into the ``anio``/``mes`` partitions it
+touches; any other change rebuilds the dataset.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import shutil
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, Sequence
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.utils.load_data import SALES_CHUNK_SIZE, SALES_DTYPES, ensure_directory, iter_sales_data
+
+
+MANIFEST_NAME = "_manifest.json"
+PARTITION_COLUMNS = ("anio", "mes")
+CACHE_FORMAT_VERSION = 2
+
+DateParser = Callable[[pd.Series], pd.Series]
+AppendReader = Callable[[int], Iterable[pd.DataFrame]]
+
+
+def _hash_file(
+    path: Path, *, prefix: Optional[int] = None, block_size: int = 1 << 20
+) -> tuple[Optional[str], str]:
+    """Hash of the first ``prefix`` bytes (if given) and of the whole file, in one pass."""
+    digest = hashlib.sha256()
+    prefix_hash = None
+    leidos = 0
+    with path.open("rb") as handle:
+        if prefix is not None:
+            while leidos < prefix:
+                block = handle.read(min(block_size, prefix - leidos))
+                if not block:
+                    break
+                digest.update(block)
+                leidos += len(block)
+            prefix_hash = digest.hexdigest()
+        for block in iter(lambda: handle.read(block_size), b""):
+            digest.update(block)
+    return prefix_hash, digest.hexdigest()
+
+
+def _ends_line(path: Path, size: int) -> bool:
+    """Whether byte ``size - 1`` of ``path`` is a newline (a complete last row)."""
+    with path.open("rb") as handle:
+        handle.seek(size - 1)
+        return handle.read(1) == b"\n"
+
+
+def file_fingerprint(path: Path, sha256: Optional[str] = None) -> dict[str, object]:
+    """Return size, mtime and content hash identifying a source file."""
+    stat = path.stat()
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256 or _hash_file(path)[1],
+    }
+
+
+def cache_dir_for(source: Path, cache_root: Path) -> Path:
+    """Location of the Parquet dataset built from ``source``."""
+    return cache_root / source.stem
+
+
+def _read_manifest(cache_dir: Path) -> Optional[dict]:
+    manifest_path = cache_dir / MANIFEST_NAME
+    if not manifest_path.exists():
+        return None
+    try:
+        return json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(cache_dir: Path, manifest: dict) -> None:
+    (cache_dir / MANIFEST_NAME).write_text(
+        json.dumps(manifest, indent=2, ensure_ascii=False), encoding="utf-8"
+    )
+
+
+def _check_cache(source: Path, cache_dir: Path, signature: str) -> tuple[str, Optional[dict]]:
+    """Classify ``cache_dir`` against ``source``: ``valid``, ``append`` or ``stale``.
+
+    Size and mtime are compared first; the content hash is only recomputed
+    when the file was touched, so an unchanged export is validated without
+    reading it. A larger file whose first ``size`` bytes still hash to the
+    stored digest (ending on a complete row) is an ``append``; the returned
+    manifest then carries the new file's ``sha256`` under ``pending_sha256``.
+    """
+    manifest = _read_manifest(cache_dir)
+    if manifest is None:
+        return "stale", None
+    if manifest.get("version") != CACHE_FORMAT_VERSION or manifest.get("signature") != signature:
+        return "stale", manifest
+    stored = manifest.get("source", {})
+    stat = source.stat()
+    size = stored.get("size")
+    if size == stat.st_size:
+        if stored.get("mtime_ns") == stat.st_mtime_ns:
+            return "valid", manifest
+        if stored.get("sha256") != _hash_file(source)[1]:
+            return "stale", manifest
+        stored["mtime_ns"] = stat.st_mtime_ns
+        _write_manifest(cache_dir, manifest)
+        return "valid", manifest
+    if not isinstance(size, int) or not 0 < size < stat.st_size or not _ends_line(source, size):
+        return "stale", manifest
+    prefix_hash, full_hash = _hash_file(source, prefix=size)
+    if prefix_hash != stored.get("sha256"):
+        return "stale", manifest
+    manifest["pending_sha256"] = full_hash
+    return "append", manifest
+
+
+def is_cache_valid(source: Path, cache_dir: Path, *, signature: str = "") -> bool:
+    """Check whether ``cache_dir`` still reflects ``source`` exactly (see ``_check_cache``)."""
+    return _check_cache(source, cache_dir, signature)[0] == "valid"
+
+
+def _to_arrow(frame: pd.DataFrame) -> pa.Table:
+    """Convert a chunk with a stable schema: text and categorical columns as strings."""
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    fields = []
+    for field, column in zip(table.schema, frame.columns):
+        if pa.types.is_dictionary(field.type):
+            fields.append(pa.field(field.name, field.type.value_type))
+        elif frame[column].dtype == object or pa.types.is_null(field.type):
+            fields.append(pa.field(field.name, pa.string()))
+        else:
+            fields.append(field)
+    return table.cast(pa.schema(fields))
+
+
+def _default_date_parser(values: pd.Series) -> pd.Series:
+    return pd.to_datetime(values, errors="coerce")
+
+
+def _write_partitions(
+    target: Path,
+    chunks: Iterable[pd.DataFrame],
+    *,
+    date_column: str,
+    parser: DateParser,
+    generation: int,
+) -> int:
+    """Write ``chunks`` under ``target/anio=YYYY/mes=MM`` and return the row count.
+
+    File names start with the generation, so rows appended later sort after
+    the ones already in a partition.
+    """
+    filas = 0
+    for chunk_number, chunk in enumerate(chunks):
+        fechas = parser(chunk[date_column])
+        periodo = (fechas.dt.year * 100 + fechas.dt.month).fillna(0).astype("int64")
+        for valor, indices in periodo.groupby(periodo).groups.items():
+            anio, mes = divmod(int(valor), 100)
+            partition_dir = target / f"anio={anio:04d}" / f"mes={mes:02d}"
+            ensure_directory(partition_dir)
+            pq.write_table(
+                _to_arrow(chunk.loc[indices]),
+                partition_dir / f"part-{generation:04d}-{chunk_number:05d}.parquet",
+            )
+        filas += len(chunk)
+    return filas
+
+
+def build_csv_cache(
+    source: Path,
+    cache_dir: Path,
+    chunks: Iterable[pd.DataFrame],
+    *,
+    date_column: str,
+    date_parser: Optional[DateParser] = None,
+    signature: str = "",
+) -> Path:
+    """Write ``chunks`` as a Parquet dataset partitioned by ``anio=YYYY/mes=MM``.
+
+    The dataset is built in a staging directory and swapped in at the end, so
+    an interrupted conversion never leaves a half-written cache behind.
+    """
+    staging = cache_dir.with_name(cache_dir.name + ".tmp")
+    if staging.exists():
+        shutil.rmtree(staging)
+    ensure_directory(staging)
+
+    filas = _write_partitions(
+        staging,
+        chunks,
+        date_column=date_column,
+        parser=date_parser or _default_date_parser,
+        generation=0,
+    )
+    _write_manifest(
+        staging,
+        {
+            "version": CACHE_FORMAT_VERSION,
+            "signature": signature,
+            "source": {"path": str(source), **file_fingerprint(source)},
+            "rows": filas,
+            "generation": 0,
+        },
+    )
+    if cache_dir.exists():
+        shutil.rmtree(cache_dir)
+    staging.rename(cache_dir)
+    return cache_dir
+
+
+def append_csv_cache(
+    source: Path,
+    cache_dir: Path,
+    read_appended: AppendReader,
+    manifest: dict,
+    *,
+    date_column: str,
+    date_parser: Optional[DateParser] = None,
+) -> Path:
+    """Add the rows appended to ``source`` since ``manifest`` was written.
+
+    ``read_appended`` receives the byte offset where the new rows start.
+    Their part files get the next generation number, and the manifest is
+    only updated once they are written; files of that generation left by an
+    interrupted run are removed first, so retrying never duplicates rows.
+    """
+    generation = int(manifest.get("generation", 0)) + 1
+    for leftover in cache_dir.glob(f"anio=*/mes=*/part-{generation:04d}-*.parquet"):
+        leftover.unlink()
+    filas = _write_partitions(
+        cache_dir,
+        read_appended(int(manifest["source"]["size"])),
+        date_column=date_column,
+        parser=date_parser or _default_date_parser,
+        generation=generation,
+    )
+    manifest["source"] = {
+        "path": str(source),
+        **file_fingerprint(source, manifest.pop("pending_sha256")),
+    }
+    manifest["rows"] = int(manifest.get("rows", 0)) + filas
+    manifest["generation"] = generation
+    _write_manifest(cache_dir, manifest)
+    return cache_dir
+
+
+def ensure_csv_cache(
+    source: Path,
+    cache_root: Path,
+    read_chunks: Callable[[], Iterable[pd.DataFrame]],
+    *,
+    date_column: str,
+    date_parser: Optional[DateParser] = None,
+    signature: str = "",
+    read_appended: Optional[AppendReader] = None,
+) -> Path:
+    """Return the cached dataset for ``source``, converting the CSV only when needed.
+
+    With ``read_appended`` (rows from a byte offset, e.g. via
+    ``open_csv_tail``), rows appended to the export are added to the
+    existing dataset instead of converting the whole file again.
+    """
+    if not source.exists():
+        raise FileNotFoundError(f"Source file not found: {source}")
+    cache_dir = cache_dir_for(source, cache_root)
+    estado, manifest = _check_cache(source, cache_dir, signature)
+    if estado == "valid":
+        return cache_dir
+    if estado == "append" and read_appended is not None:
+        return append_csv_cache(
+            source,
+            cache_dir,
+            read_appended,
+            manifest,
+            date_column=date_column,
+            date_parser=date_parser,
+        )
+    return build_csv_cache(
+        source,
+        cache_dir,
+        read_chunks(),
+        date_column=date_column,
+        date_parser=date_parser,
+        signature=signature,
+    )
+
+
+def _open_dataset(cache_dir: Path, categorical: Sequence[str]) -> ds.Dataset:
+    file_format = ds.ParquetFileFormat(
+        read_options=ds.ParquetReadOptions(dictionary_columns=list(categorical))
+    )
+    return ds.dataset(cache_dir, format=file_format, partitioning="hive")
+
+
+def _projection(dataset: ds.Dataset, columns: Optional[Sequence[str]]) -> list[str]:
+    if columns is not None:
+        return [column for column in columns if column in dataset.schema.names]
+    return [name for name in dataset.schema.names if name not in PARTITION_COLUMNS]
+
+
+def _since_filter(since: Optional[pd.Timestamp]) -> Optional[ds.Expression]:
+    if since is None:
+        return None
+    since = pd.Timestamp(since)
+    anio, mes = ds.field("anio"), ds.field("mes")
+    return (anio > since.year) | ((anio == since.year) & (mes >= since.month))
+
+
+def read_csv_cache(
+    cache_dir: Path,
+    *,
+    columns: Optional[Sequence[str]] = None,
+    categorical: Sequence[str] = (),
+    since: Optional[pd.Timestamp] = None,
+) -> pd.DataFrame:
+    """Load a cached dataset with column projection and optional month pruning."""
+    dataset = _open_dataset(cache_dir, categorical)
+    table = dataset.to_table(columns=_projection(dataset, columns), filter=_since_filter(since))
+    return table.to_pandas()
+
+
+def iter_csv_cache(
+    cache_dir: Path,
+    *,
+    columns: Optional[Sequence[str]] = None,
+    categorical: Sequence[str] = (),
+    since: Optional[pd.Timestamp] = None,
+) -> Iterator[pd.DataFrame]:
+    """Yield the cached dataset one Parquet file at a time, in chronological order."""
+    dataset = _open_dataset(cache_dir, categorical)
+    projection = _projection(dataset, columns)
+    fragments = sorted(
+        dataset.get_fragments(filter=_since_filter(since)), key=lambda fragment: fragment.path
+    )
+    for fragment in fragments:
+        yield fragment.to_table(columns=projection, schema=dataset.schema).to_pandas()
+
+
+def _sales_signature(chunksize: int) -> str:
+    return json.dumps({"dtypes": SALES_DTYPES, "chunksize": chunksize}, sort_keys=True)
+
+
+def _sales_categoricals() -> list[str]:
+    return [column for column, kind in SALES_DTYPES.items() if kind == "category"]
+
+
+def ensure_sales_cache(
+    sales_path: Path, cache_root: Path, *, chunksize: int = SALES_CHUNK_SIZE
+) -> Path:
+    """Convert the POS export to the Parquet cache using the typed chunk reader."""
+    return ensure_csv_cache(
+        sales_path,
+        cache_root,
+        lambda: iter_sales_data(sales_path, chunksize=chunksize),
+        date_column="Fecha",
+        signature=_sales_signature(chunksize),
+        read_appended=lambda offset: iter_sales_data(
+            sales_path, chunksize=chunksize, offset=offset
+        ),
+    )
+
+
+def load_sales_cached(
+    sales_path: Path,
+    cache_root: Path,
+    *,
+    columns: Optional[Sequence[str]] = None,
+    since: Optional[pd.Timestamp] = None,
+) -> pd.DataFrame:
+    """Drop-in replacement for ``load_sales_data`` backed by the Parquet cache."""
+    cache_dir = ensure_sales_cache(sales_path, cache_root)
+    return read_csv_cache(
+        cache_dir, columns=columns, categorical=_sales_categoricals(), since=since
+    )
+
+
+def iter_sales_cached(
+    sales_path: Path,
+    cache_root: Path,
+    *,
+    columns: Optional[Sequence[str]] = None,
+    since: Optional[pd.Timestamp] = None,
+) -> Iterator[pd.DataFrame]:
+    """Chunked counterpart of ``load_sales_cached`` for ``run_etl_chunked``."""
+    cache_dir = ensure_sales_cache(sales_path, cache_root)
+    yield from iter_csv_cache(
+        cache_dir, columns=columns, categorical=_sales_categoricals(), since=since
+    )